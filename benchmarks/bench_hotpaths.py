@@ -0,0 +1,258 @@
+"""
+bench_hotpaths.py
+
+发送端与接收端热点路径的微基准测试，完全离线运行（不需要 MQTT broker，也不需要数据库）。
+
+覆盖的用例（每个用例在每个规模下把“一整轮 N 个传感器”作为一次操作）：
+  - generate_batch    : data_generator.generate_batch 生成 N 条读数
+  - detect_anomalies  : anomaly_detector.detect_anomalies 检测 N 条读数
+  - update_baselines  : controller.ZoneController.update（update_baselines 的向量化实现），N/30 个分区
+  - json_dumps        : 发布路径上的 stamp_record + json.dumps，逐条序列化 N 条读数
+  - listen_on_message : 接收端 listen.on_message 处理 N 条消息（解码 → 去重 → 延迟跟踪 → 告警评估 → 限流 → 入队）；
+                        写库线程不启动，每次操作之间（不计时）清空队列并重置去重/限流状态，保证每次都走完整路径
+
+报告：每秒操作数（ops/s）与每秒条数、单次操作延迟分位数（p50/p90/p99）、tracemalloc 峰值内存。
+
+用法：
+    python benchmarks/bench_hotpaths.py                                   # 全部用例 × 30/1k/10k/100k
+    python benchmarks/bench_hotpaths.py --sizes 30,1000 --cases detect_anomalies,json_dumps
+    python benchmarks/bench_hotpaths.py --output results.json             # 保存结果
+    python benchmarks/bench_hotpaths.py --baseline results.json --threshold 0.1
+        # 与基线比较：任一用例 ops/s 低于基线 (1 - threshold) 倍时判为回退，退出码 1
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "sersor-controller-sender"))
+sys.path.insert(0, os.path.join(ROOT, "receiver-database"))
+
+from data_generator import generate_batch          # noqa: E402
+from anomaly_detector import detect_anomalies      # noqa: E402
+from controller import ZoneController              # noqa: E402
+from mqtt_sender import stamp_record               # noqa: E402
+
+DEFAULT_SIZES = (30, 1000, 10000, 100000)
+SENSORS_PER_ZONE = 30
+
+
+# ─── 用例：setup(n) → (op, reset)，op 为计时的一次操作，reset 在每次操作前执行（不计时）──────────
+
+def case_generate_batch(n):
+    return (lambda: generate_batch(25.0, 60.0, 500.0, num_sensors=n, anomaly_rate=0.01)), None
+
+
+def case_detect_anomalies(n):
+    batch = generate_batch(25.0, 60.0, 500.0, num_sensors=n, anomaly_rate=0.01)
+    return (lambda: detect_anomalies(batch)), None
+
+
+def case_update_baselines(n):
+    zones = max(1, n // SENSORS_PER_ZONE)
+    rng = np.random.default_rng(0)
+    ctrl = ZoneController(zones)
+    bases = np.tile([25.0, 60.0, 500.0], (zones, 1))
+    avgs = rng.normal([25.0, 60.0, 500.0], [3.0, 10.0, 80.0], size=(zones, 3))
+    return (lambda: ctrl.update(bases, avgs)), None
+
+
+def case_json_dumps(n):
+    batch = generate_batch(25.0, 60.0, 500.0, num_sensors=n, anomaly_rate=0.01)
+
+    def op():
+        for record in batch:
+            stamp_record(record)
+            json.dumps(record, ensure_ascii=False)
+    return op, None
+
+
+class _Message:
+    """paho MQTTMessage 的最小替身：on_message 只读取 topic 与 payload"""
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def case_listen_on_message(n):
+    import listen
+    import ratelimit
+    from lag import lag_tracker
+    from alerts import alert_monitor
+
+    batch = generate_batch(25.0, 60.0, 500.0, num_sensors=n, anomaly_rate=0.01)
+    messages = []
+    for record in batch:
+        stamp_record(record)
+        messages.append(_Message("greenhouse/sensors", json.dumps(record, ensure_ascii=False).encode()))
+
+    def drain(q):
+        while True:
+            try:
+                q.get_nowait()
+            except Exception:
+                return
+
+    def reset():
+        drain(listen.writer.queue)
+        drain(alert_monitor.events)
+        listen.dedup_cache._keys.clear()
+        listen.admission = ratelimit.from_config()
+        with lag_tracker._lock:
+            lag_tracker._sensors.clear()
+        alert_monitor._open.clear()
+        alert_monitor._last_ts.clear()
+
+    def op():
+        on_message = listen.on_message
+        for msg in messages:
+            on_message(None, None, msg)
+    return op, reset
+
+
+CASES = {
+    "generate_batch": case_generate_batch,
+    "detect_anomalies": case_detect_anomalies,
+    "update_baselines": case_update_baselines,
+    "json_dumps": case_json_dumps,
+    "listen_on_message": case_listen_on_message,
+}
+
+
+# ─── 计时 ───────────────────────────────────────────────────────────────────
+
+def measure(op, reset, min_time, min_reps, max_reps):
+    reset = reset or (lambda: None)
+    reset()
+    op()  # 预热
+
+    timings = []
+    total = 0.0
+    while len(timings) < min_reps or (total < min_time and len(timings) < max_reps):
+        reset()
+        started = time.perf_counter()
+        op()
+        elapsed = time.perf_counter() - started
+        timings.append(elapsed)
+        total += elapsed
+
+    # 峰值内存单独跑一次（tracemalloc 本身会拖慢执行，不与计时混在一起）
+    reset()
+    tracemalloc.start()
+    op()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ordered = sorted(timings)
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+    return {
+        "reps": len(timings),
+        "ops_per_sec": round(len(timings) / total, 3),
+        "mean_ms": round(statistics.fmean(timings) * 1000, 4),
+        "p50_ms": round(pct(50) * 1000, 4),
+        "p90_ms": round(pct(90) * 1000, 4),
+        "p99_ms": round(pct(99) * 1000, 4),
+        "peak_mem_kb": round(peak / 1024, 1),
+    }
+
+
+def run(cases, sizes, min_time, min_reps, max_reps):
+    results = {}
+    for name in cases:
+        for n in sizes:
+            op, reset = CASES[name](n)
+            r = measure(op, reset, min_time, min_reps, max_reps)
+            r["items_per_sec"] = round(r["ops_per_sec"] * n, 1)
+            key = f"{name}@{n}"
+            results[key] = r
+            print(f"{key:<28} {r['ops_per_sec']:>12.2f} ops/s {r['items_per_sec']:>14.0f} 条/s  "
+                  f"p50 {r['p50_ms']:>10.3f} ms  p99 {r['p99_ms']:>10.3f} ms  "
+                  f"峰值 {r['peak_mem_kb']:>10.1f} KB  ({r['reps']} 次)")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """返回回退的用例列表；只比较两边都有的用例"""
+    regressions = []
+    print(f"\n与基线比较（回退阈值 {threshold:.0%}）：")
+    for key, r in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        change = r["ops_per_sec"] / base["ops_per_sec"] - 1 if base["ops_per_sec"] else 0.0
+        regressed = change < -threshold
+        flag = "回退" if regressed else "正常"
+        print(f"  {key:<28} {base['ops_per_sec']:>12.2f} → {r['ops_per_sec']:>12.2f} ops/s  {change:+.1%}  {flag}")
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="发送端 / 接收端热点路径微基准（离线）")
+    parser.add_argument("--cases", type=str, default=",".join(CASES),
+                        help=f"逗号分隔的用例（默认全部：{','.join(CASES)}）")
+    parser.add_argument("--sizes", type=str, default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="逗号分隔的传感器数量（默认 30,1000,10000,100000）")
+    parser.add_argument("--min-time", type=float, default=1.0, help="每个用例至少累计计时的秒数（默认 1）")
+    parser.add_argument("--min-reps", type=int, default=3, help="每个用例至少执行次数（默认 3）")
+    parser.add_argument("--max-reps", type=int, default=1000, help="每个用例最多执行次数（默认 1000）")
+    parser.add_argument("--output", "-o", type=str, default=None, help="把结果保存为 JSON")
+    parser.add_argument("--baseline", "-b", type=str, default=None, help="基线 JSON（之前 --output 保存的文件）")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="ops/s 相对基线下降超过该比例判为回退（默认 0.10）")
+    args = parser.parse_args()
+
+    # on_message 内部的日志与告警打印不计入基准
+    logging.basicConfig(level=logging.WARNING)
+
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error(f"未知用例: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    results = run(cases, sizes, args.min_time, args.min_reps, args.max_reps)
+
+    if args.output:
+        doc = {
+            "meta": {
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 个用例性能回退: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n没有性能回退。")
+
+
+if __name__ == "__main__":
+    main()
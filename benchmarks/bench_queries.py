@@ -0,0 +1,658 @@
+"""
+bench_queries.py
+
+查询性能回归测试：把确定性的合成历史数据批量写入本地数据库（可配置规模，如 1M / 10M / 100M 行），
+逐个运行接收端的统计（calc.*）、存储接口（storage.*）与 API 查询形态，记录耗时并抓取执行计划，
+与基线比较，查询变慢超过阈值或改走顺序扫描时以退出码 1 失败。
+用于在上线前检查表结构、索引与分区改动的影响。
+
+数据库（--db）：
+  sqlite（默认）     本地 SQLite（storage.py 的 SQLiteStorage），只运行存储接口与 API 形态；
+                      数据文件按数据集指纹放在临时目录，规模与参数不变时下次直接复用（--sqlite-path 指定位置）；
+  local              用 initdb / pg_ctl 在临时目录启动一个 Postgres（同 loadtest.py，不能以 root 运行），运行全部形态；
+  postgresql://...   使用已有数据库。数据写在独立的 schema qbench 中（通过 PGOPTIONS 设置 search_path，
+                      接收端代码不用改），不会碰到其它 schema 的表；数据集指纹不变时跳过重新导入（--reload 强制）。
+
+合成数据：sensor_id 1..--sensors，每 --interval 秒一轮，读数由 data_generator.generate_zone_arrays
+按分区（每区 30 个传感器）以固定种子生成，基准温湿度带日周期变化，同样的参数每次得到完全相同的数据。
+Postgres 下用 COPY 导入，导入完成后再建唯一索引（database.DatabaseManager 的正式 DDL），
+并从原始数据生成每小时的 sensor_aggregates 与每条异常读数对应的 alerts，最后 ANALYZE。
+--schema-sql 替换默认的建表语句（例如改成按月分区的表），--post-sql 在导入后执行（例如新增索引），
+两者的内容都计入数据集指纹。SQLite 的表结构固定为 storage.py 中的定义（每次打开都会补建其索引），只支持 --post-sql。
+
+查询参数与规模无关：选定传感器为 sensor_id = sensors // 2 + 1，选定日期为数据时间跨度中间的那一天。
+每个形态先预热一次（同时抓取它执行的全部 SQL），再计时 --reps 次，取中位数；
+每条 SELECT 用 EXPLAIN（Postgres，--analyze 时为 EXPLAIN ANALYZE）或 EXPLAIN QUERY PLAN（SQLite）取计划，
+记录扫描节点，rawdata_from_sensors / sensor_aggregates / alerts（含分区表）上的顺序扫描单独标出。
+本来就要读全表的形态（全表平均、全量导出等）允许顺序扫描。
+
+回归判定（--baseline，之前 --output 保存的文件）：
+  - 耗时：中位数 > 基线 × (1 + --threshold) 且差值超过 --min-delta-ms；
+  - 计划：基线中没有顺序扫描的形态现在出现了顺序扫描；
+  - --strict-scans：不与基线比较，任何不允许顺序扫描的形态出现顺序扫描都判为失败。
+数据量很小时规划器选择顺序扫描是正常的，计划检查请在接近生产的规模上进行。
+
+用法：
+    python benchmarks/bench_queries.py --rows 1M --output q1m.json
+    python benchmarks/bench_queries.py --rows 1M --baseline q1m.json --threshold 0.2
+    python benchmarks/bench_queries.py --db postgresql://user:pw@127.0.0.1:5432/bench --rows 10M --output q10m.json
+    python benchmarks/bench_queries.py --db local --rows 10M --post-sql new_index.sql --baseline q10m.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import hashlib
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SENDER_DIR = os.path.join(os.path.dirname(ROOT), "sersor-controller-sender")
+RECEIVER_DIR = os.path.join(os.path.dirname(ROOT), "receiver-database")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, SENDER_DIR)
+
+from data_generator import generate_zone_arrays                     # noqa: E402
+from loadtest import LocalPostgres, db_env, CREATE_RAWDATA_SQL      # noqa: E402
+
+SCHEMA = "qbench"
+SENSORS_PER_ZONE = 30
+DATASET_VERSION = 1          # 生成规则变化时递增，旧数据集自动失效
+WATCHED = ("rawdata_from_sensors", "sensor_aggregates", "alerts")
+
+AGGREGATES_FROM_RAW_SQL = """
+    INSERT INTO sensor_aggregates (sensor_id, zone, window_start, window_end, count, anomalies,
+        temp_sum, temp_sumsq, temp_min, temp_max, hum_sum, hum_sumsq, hum_min, hum_max,
+        soil_sum, soil_sumsq, soil_min, soil_max)
+    SELECT sensor_id, (sensor_id - 1) / 30, date_trunc('hour', time_stamp), date_trunc('hour', time_stamp) + interval '1 hour',
+           COUNT(*), COUNT(*) FILTER (WHERE is_anomaly),
+           SUM(temperature), SUM(temperature * temperature), MIN(temperature), MAX(temperature),
+           SUM(humidity), SUM(humidity * humidity), MIN(humidity), MAX(humidity),
+           SUM(soil_moisture), SUM(soil_moisture::float8 * soil_moisture), MIN(soil_moisture), MAX(soil_moisture)
+    FROM rawdata_from_sensors
+    GROUP BY sensor_id, date_trunc('hour', time_stamp)
+"""
+
+ALERTS_FROM_RAW_SQL = """
+    INSERT INTO alerts (sensor_id, metric, direction, threshold, started_at, ended_at,
+                        start_value, peak_value, end_value, readings)
+    SELECT sensor_id, 'temperature', 'high', 30, time_stamp, time_stamp + make_interval(secs => %s),
+           temperature, temperature, temperature, 1
+    FROM rawdata_from_sensors
+    WHERE is_anomaly
+"""
+
+
+def parse_count(text):
+    """1000、250k、10M、1.5G → 整数"""
+    text = text.strip().lower()
+    scale = {"k": 10 ** 3, "m": 10 ** 6, "g": 10 ** 9}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+# ─── 合成数据 ───────────────────────────────────────────────────────────────
+
+class Dataset:
+    def __init__(self, args):
+        self.sensors = args.sensors
+        self.rounds = math.ceil(args.rows / args.sensors)
+        self.rows = self.rounds * args.sensors
+        self.interval = args.interval
+        self.start = datetime.datetime.fromisoformat(args.start)
+        self.seed = args.seed
+        self.anomaly_rate = args.anomaly_rate
+        self.schema_sql = _read(args.schema_sql) or CREATE_RAWDATA_SQL
+        self.post_sql = _read(args.post_sql)
+        self.end = self.start + datetime.timedelta(seconds=self.rounds * self.interval)
+
+    @property
+    def fingerprint(self):
+        doc = json.dumps([DATASET_VERSION, self.rows, self.sensors, self.interval, self.start.isoformat(),
+                          self.seed, self.anomaly_rate, self.schema_sql, self.post_sql])
+        return hashlib.sha256(doc.encode()).hexdigest()[:16]
+
+    def chunks(self, rounds_per_chunk):
+        """按轮次生成，每块返回列数组 (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)"""
+        rng = np.random.default_rng(self.seed)
+        zones = math.ceil(self.sensors / SENSORS_PER_ZONE)
+        zone_offset = rng.normal(0, 2, zones)
+        sensor_ids = np.arange(1, zones * SENSORS_PER_ZONE + 1)[:self.sensors]
+        for first in range(0, self.rounds, rounds_per_chunk):
+            cols = [[] for _ in range(6)]
+            for r in range(first, min(first + rounds_per_chunk, self.rounds)):
+                ts = self.start + datetime.timedelta(seconds=r * self.interval)
+                phase = 2 * math.pi * (ts.hour * 3600 + ts.minute * 60 + ts.second) / 86400
+                base_t = 25 + 4 * math.sin(phase) + zone_offset
+                base_h = 60 - 10 * math.sin(phase) + np.zeros(zones)
+                base_s = 500 - 0.02 * (r % 1440) + np.zeros(zones)   # 缓慢变干，模拟浇水周期
+                t, h, s, a = generate_zone_arrays(base_t, base_h, base_s, SENSORS_PER_ZONE, self.anomaly_rate, rng)
+                cols[0].append(sensor_ids)
+                cols[1].append(np.full(self.sensors, np.datetime64(ts, "us")))
+                for i, arr in enumerate((t, h, s, a), start=2):
+                    cols[i].append(arr.reshape(-1)[:self.sensors])
+            yield [np.concatenate(c) for c in cols]
+
+    def query_params(self):
+        mid = self.start + (self.end - self.start) / 2
+        day = mid.date() if self.end - self.start >= datetime.timedelta(days=1) else self.start.date()
+        day_start = datetime.datetime.combine(day, datetime.time())
+        return {
+            "sensor_id": self.sensors // 2 + 1,
+            "few_sensors": list(range(1, min(self.sensors, 5) + 1)),
+            "day": day,
+            "day_start": day_start,
+            "day_end": day_start + datetime.timedelta(days=1),
+            "step_start": max(self.start, mid - datetime.timedelta(hours=3)),
+            "step_end": max(self.start, mid - datetime.timedelta(hours=3)) + datetime.timedelta(hours=6),
+        }
+
+
+def _read(path):
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def _copy_text(cols):
+    sids, ts, t, h, s, a = cols
+    stamps = np.datetime_as_string(ts, unit="us")
+    flags = np.where(a, "t", "f")
+    return "".join(f"{i}\t{st}\t{x}\t{y}\t{z}\t{f}\n"
+                   for i, st, x, y, z, f in zip(sids.tolist(), stamps.tolist(), t.tolist(), h.tolist(),
+                                                s.tolist(), flags.tolist()))
+
+
+# ─── 导入 ───────────────────────────────────────────────────────────────────
+
+def load_postgres(dataset, reload, connect):
+    from database import db_manager
+
+    conn = connect()
+    with conn, conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {SCHEMA}.qbench_dataset (fingerprint TEXT, rows BIGINT, loaded_at TIMESTAMP)")
+        cur.execute(f"SELECT fingerprint FROM {SCHEMA}.qbench_dataset")
+        row = cur.fetchone()
+    if row and row[0] == dataset.fingerprint and not reload:
+        print(f"数据集 {dataset.fingerprint} 已存在，跳过导入（--reload 强制重新导入）")
+        conn.close()
+        return
+
+    print(f"导入 {dataset.rows:,} 行（{dataset.sensors} 个传感器 × {dataset.rounds} 轮，"
+          f"{dataset.start:%Y-%m-%d %H:%M} ~ {dataset.end:%Y-%m-%d %H:%M}）...")
+    started = time.perf_counter()
+    with conn, conn.cursor() as cur:
+        for table in WATCHED:
+            cur.execute(f"DROP TABLE IF EXISTS {SCHEMA}.{table} CASCADE")
+        cur.execute(f"DELETE FROM {SCHEMA}.qbench_dataset")
+        cur.execute(dataset.schema_sql)
+    loaded = 0
+    for cols in dataset.chunks(max(1, 200000 // dataset.sensors)):
+        with conn, conn.cursor() as cur:
+            cur.copy_expert("COPY rawdata_from_sensors (sensor_id, time_stamp, temperature, humidity, "
+                            "soil_moisture, is_anomaly) FROM STDIN", io.StringIO(_copy_text(cols)))
+        loaded += len(cols[0])
+        print(f"\r  {loaded:,}/{dataset.rows:,} 行  {loaded / (time.perf_counter() - started):,.0f} 行/s", end="")
+    print()
+
+    # 正式环境的约束与表结构（唯一索引在导入后再建，比逐行维护索引快得多）
+    db_manager.connect()
+    if not (db_manager.ensure_constraints() and db_manager.ensure_aggregate_table() and db_manager.ensure_alert_table()):
+        raise RuntimeError("建立约束 / 汇总表 / 告警表失败")
+    with conn, conn.cursor() as cur:
+        cur.execute(AGGREGATES_FROM_RAW_SQL)
+        cur.execute(ALERTS_FROM_RAW_SQL, (dataset.interval,))
+        if dataset.post_sql:
+            cur.execute(dataset.post_sql)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE")
+        cur.execute(f"INSERT INTO {SCHEMA}.qbench_dataset VALUES (%s, %s, now())", (dataset.fingerprint, dataset.rows))
+    conn.close()
+    print(f"导入完成，用时 {time.perf_counter() - started:.1f} 秒")
+
+
+def load_sqlite(dataset, reload, url):
+    import storage
+
+    store = storage.open_storage(url)
+    store.conn.execute("CREATE TABLE IF NOT EXISTS qbench_dataset (fingerprint TEXT, rows INTEGER, loaded_at TEXT)")
+    row = store.conn.execute("SELECT fingerprint FROM qbench_dataset").fetchone()
+    if row and row[0] == dataset.fingerprint and not reload:
+        print(f"数据集 {dataset.fingerprint} 已存在，跳过导入（--reload 强制重新导入）")
+        store.close()
+        return
+    if dataset.schema_sql is not CREATE_RAWDATA_SQL:
+        print("注意：SQLite 使用 storage.py 的表结构，--schema-sql 被忽略")
+
+    print(f"导入 {dataset.rows:,} 行（{dataset.sensors} 个传感器 × {dataset.rounds} 轮）...")
+    started = time.perf_counter()
+    store.conn.execute("DELETE FROM rawdata_from_sensors")
+    store.conn.execute("DELETE FROM qbench_dataset")
+    store.commit()
+    loaded = 0
+    for sids, ts, t, h, s, a in dataset.chunks(max(1, 100000 // dataset.sensors)):
+        stamps = [st.replace("T", " ") for st in np.datetime_as_string(ts, unit="us").tolist()]
+        store.conn.executemany(storage.SQLITE_INSERT_SQL,
+                               zip(sids.tolist(), stamps, t.tolist(), h.tolist(), s.tolist(), a.astype(int).tolist()))
+        store.commit()
+        loaded += len(sids)
+        print(f"\r  {loaded:,}/{dataset.rows:,} 行  {loaded / (time.perf_counter() - started):,.0f} 行/s", end="")
+    print()
+    if dataset.post_sql:
+        store.conn.executescript(dataset.post_sql)
+    store.conn.execute("ANALYZE")
+    store.conn.execute("INSERT INTO qbench_dataset VALUES (?, ?, ?)",
+                       (dataset.fingerprint, dataset.rows, datetime.datetime.now().isoformat()))
+    store.commit()
+    store.close()
+    print(f"导入完成，用时 {time.perf_counter() - started:.1f} 秒")
+
+
+# ─── SQL 抓取与执行计划 ──────────────────────────────────────────────────────
+
+_captured = None      # 预热时收集执行过的 SQL，其余时间为 None
+
+
+def _capture(sql):
+    """只保留查询语句（SELECT / WITH，以及 querylayer 的 EXECUTE），跳过建表、事务控制、写入与预备语句查找"""
+    if _captured is None:
+        return
+    import querylayer
+    words = sql.lstrip(" \n\t(").split(None, 1)
+    if words and words[0].upper() in ("SELECT", "WITH", "EXECUTE") and sql.strip() != querylayer.PREPARED_SQL:
+        _captured.append(sql.strip())
+
+
+def instrument(backend):
+    """让接收端代码打开的所有连接都把执行的 SQL 交给 _capture（仅限本进程）"""
+    import storage
+
+    if backend == "sqlite":
+        original = storage.open_storage
+
+        @functools.wraps(original)
+        def traced_open_storage(url=None):
+            store = original(url)
+            if isinstance(store, storage.SQLiteStorage):
+                store.conn.set_trace_callback(_capture)
+            return store
+        storage.open_storage = traced_open_storage
+        return None
+
+    import psycopg2
+    import psycopg2.extensions
+
+    class RecordingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            if _captured is not None:
+                _capture(self.mogrify(query, vars).decode("utf-8"))
+            return super().execute(query, vars)
+
+    original_connect = psycopg2.connect
+    psycopg2.connect = functools.partial(original_connect, cursor_factory=RecordingCursor)
+    return original_connect
+
+
+def _walk_pg(node, out):
+    out.append(node)
+    for child in node.get("Plans", ()):
+        _walk_pg(child, out)
+
+
+def _watched(relation):
+    return relation is not None and any(relation == t or relation.startswith(t + "_") for t in WATCHED)
+
+
+def _prepare_for_explain(cur, sql):
+    """EXECUTE 语句要在解释用的连接上先 PREPARE 同名语句，计划与接收端实际执行的一致"""
+    import querylayer
+    name = sql.split(None, 1)[1].split("(", 1)[0].strip()
+    cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (name,))
+    if cur.fetchone() is None:
+        cur.execute(querylayer.statement(name, None).prepare_sql())
+
+
+def explain_pg(conn, sql, analyze):
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with conn.cursor() as cur:
+        if sql.split(None, 1)[0].upper() == "EXECUTE":
+            _prepare_for_explain(cur, sql)
+        cur.execute(f"EXPLAIN ({options}) {sql}")
+        plan = cur.fetchone()[0]
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = []
+    _walk_pg(plan[0]["Plan"], nodes)
+    scans = []
+    seq = []
+    for n in nodes:
+        if "Relation Name" in n or "Index Name" in n:
+            label = f"{n['Node Type']} on {n.get('Relation Name', '?')}"
+            if n.get("Index Name"):
+                label += f" using {n['Index Name']}"
+            scans.append(label)
+            if n["Node Type"] == "Seq Scan" and _watched(n.get("Relation Name")):
+                seq.append(n["Relation Name"])
+    return {"sql": sql, "scans": scans, "seq_scans": sorted(set(seq)),
+            "total_cost": plan[0]["Plan"].get("Total Cost"), "plan": plan}
+
+
+def _explain_pg_with(conn, analyze, sql):
+    return explain_pg(conn, sql, analyze)
+
+
+def explain_sqlite(conn, sql):
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    details = [r[3] for r in rows]
+    seq = []
+    for d in details:
+        words = d.split()
+        # "SCAN 表" 为顺序扫描；"SCAN 表 USING [COVERING] INDEX" 为完整索引扫描；"SEARCH" 为索引查找
+        if len(words) >= 2 and words[0] == "SCAN" and "USING" not in words and _watched(words[1]):
+            seq.append(words[1])
+    return {"sql": sql, "scans": details, "seq_scans": sorted(set(seq)), "total_cost": None, "plan": details}
+
+
+# ─── 查询形态 ───────────────────────────────────────────────────────────────
+# (名称, 后端 pg / sqlite / both, 是否允许顺序扫描, 函数(ctx))
+
+def _api(path):
+    def run(ctx):
+        response = ctx["client"].get(path.format(**ctx["params"]))
+        body = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} 返回 {response.status_code}: {body[:200]!r}")
+        return len(body)
+    return run
+
+
+def _consume_scan(ctx):
+    store = ctx["store"]
+    p = ctx["params"]
+    return sum(len(rows) for rows in store.scan([p["sensor_id"]], p["day_start"], p["day_end"]))
+
+
+def _build_cases():
+    import calc
+    import alerts
+
+    def cur_case(fn):
+        def run(ctx):
+            with ctx["pg"].cursor() as cur:
+                result = fn(cur, ctx["params"])
+            ctx["pg"].rollback()
+            return result
+        return run
+
+    return [
+        ("calc_avg", "pg", True, cur_case(lambda cur, p: calc.calc_avg(cur))),
+        ("calc_avg_day_sensor", "pg", False, cur_case(lambda cur, p: calc.calc_avg_day_sensor(cur, p["day"], p["sensor_id"]))),
+        ("calc_min_max_day_sensor", "pg", False, cur_case(lambda cur, p: calc.calc_min_max_day_sensor(cur, p["day"], p["sensor_id"]))),
+        ("stats", "pg", False, cur_case(lambda cur, p: calc.stats(cur, p["day"], p["sensor_id"]))),
+        ("calc_time_weighted_day_sensor", "pg", False,
+         cur_case(lambda cur, p: calc.calc_time_weighted_day_sensor(cur, p["day"], p["sensor_id"]))),
+        ("fetch_step_series", "pg", False,
+         cur_case(lambda cur, p: len(calc.fetch_step_series(cur, p["sensor_id"], p["step_start"], p["step_end"], 60)))),
+        ("calc_aggregate_stats", "pg", False,
+         cur_case(lambda cur, p: calc.calc_aggregate_stats(cur, p["sensor_id"], p["day_start"], p["day_end"]))),
+        ("alerts_active", "pg", False, cur_case(lambda cur, p: len(alerts.query_alerts(cur, active=True)))),
+        ("alerts_history_sensor", "pg", False,
+         cur_case(lambda cur, p: len(alerts.query_alerts(cur, active=False, sensor_id=p["sensor_id"],
+                                                         since=p["day_start"], until=p["day_end"])))),
+        ("calc_avg_storage", "both", True, lambda ctx: calc.calc_avg_storage(ctx["store"])),
+        ("stats_storage", "both", False, lambda ctx: calc.stats_storage(ctx["store"], ctx["params"]["day"], ctx["params"]["sensor_id"])),
+        ("storage_scan_sensor_day", "both", False, _consume_scan),
+        ("storage_latest_all", "both", True, lambda ctx: len(ctx["store"].latest())),
+        ("storage_latest_few", "both", False, lambda ctx: len(ctx["store"].latest(ctx["params"]["few_sensors"]))),
+        ("api_sensor_data_json", "both", True, _api("/sensor-data")),
+        ("api_sensor_data_ndjson", "both", True, _api("/sensor-data?format=ndjson")),
+        ("api_sensor_data_npy", "both", True, _api("/sensor-data?format=npy")),
+        ("api_latest", "both", True, _api("/sensor-data/latest")),
+        ("api_step", "pg", False,
+         _api("/sensor-data/step?sensor_id={sensor_id}&start={step_start:%Y-%m-%dT%H:%M:%S}"
+              "&end={step_end:%Y-%m-%dT%H:%M:%S}&step=60")),
+        ("api_alerts_history", "pg", False,
+         _api("/alerts?state=history&sensor_id={sensor_id}&since={day_start:%Y-%m-%dT%H:%M:%S}"
+              "&until={day_end:%Y-%m-%dT%H:%M:%S}")),
+    ]
+
+
+# 全量导出的形态只在数据量不超过该值时运行（默认 JSON 输出会在内存里构造全部行）
+FULL_EXPORT_CASES = {"api_sensor_data_json": 1, "api_sensor_data_ndjson": 5, "api_sensor_data_npy": 5}
+
+
+def run_case(fn, ctx, reps):
+    global _captured
+    sink = io.StringIO()
+    _captured = []
+    try:
+        with contextlib.redirect_stdout(sink):
+            fn(ctx)   # 预热 + 抓取 SQL
+    finally:
+        statements, _captured = _captured, None
+    timings = []
+    with contextlib.redirect_stdout(sink):
+        for _ in range(reps):
+            started = time.perf_counter()
+            fn(ctx)
+            timings.append(time.perf_counter() - started)
+    ordered = sorted(timings)
+    return statements, {
+        "reps": reps,
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))] * 1000, 3),
+    }
+
+
+def run_suite(cases, backend, ctx, args, explain):
+    results = {}
+    for name, backends, allow_seq, fn in cases:
+        limit = FULL_EXPORT_CASES.get(name)
+        if limit is not None and ctx["rows"] > limit * args.max_export_rows:
+            print(f"{name:<32} 跳过（{ctx['rows']:,} 行超过全量导出上限）")
+            continue
+        try:
+            statements, r = run_case(fn, ctx, args.reps)
+        except Exception as e:
+            print(f"{name:<32} 失败: {type(e).__name__}: {e}")
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+            continue
+        plans = []
+        for sql in dict.fromkeys(statements):
+            try:
+                plans.append(explain(sql))
+            except Exception as e:
+                plans.append({"sql": sql, "error": str(e), "scans": [], "seq_scans": []})
+        seq = sorted({rel for p in plans for rel in p["seq_scans"]})
+        r.update({"allow_seq_scan": allow_seq, "seq_scans": seq, "statements": len(plans), "plans": plans})
+        results[name] = r
+        scans = "; ".join(dict.fromkeys(s for p in plans for s in p["scans"]))
+        flag = "  顺序扫描: " + ",".join(seq) if seq else ""
+        print(f"{name:<32} 中位 {r['median_ms']:>10.2f} ms  p95 {r['p95_ms']:>10.2f} ms  "
+              f"{len(plans)} 条 SQL{flag}\n{'':<34}{scans[:160]}")
+    return results
+
+
+# ─── 回归判定 ───────────────────────────────────────────────────────────────
+
+def compare(results, baseline, args):
+    failures = []
+    print(f"\n与基线比较（耗时阈值 {args.threshold:.0%}，最小差值 {args.min_delta_ms} ms）：")
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None or "error" in r or "error" in base:
+            continue
+        change = r["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        slower = change > args.threshold and r["median_ms"] - base["median_ms"] > args.min_delta_ms
+        new_seq = sorted(set(r["seq_scans"]) - set(base.get("seq_scans", ())))
+        notes = []
+        if slower:
+            notes.append("变慢")
+            failures.append(f"{name}: {base['median_ms']} → {r['median_ms']} ms ({change:+.0%})")
+        if new_seq:
+            notes.append("改走顺序扫描 " + ",".join(new_seq))
+            failures.append(f"{name}: 新出现顺序扫描 {', '.join(new_seq)}")
+        print(f"  {name:<32} {base['median_ms']:>10.2f} → {r['median_ms']:>10.2f} ms  {change:+7.1%}  "
+              f"{' / '.join(notes) or '正常'}")
+    return failures
+
+
+def strict_scans(results):
+    return [f"{name}: 顺序扫描 {', '.join(r['seq_scans'])}" for name, r in results.items()
+            if r.get("seq_scans") and not r["allow_seq_scan"]]
+
+
+# ─── 入口 ───────────────────────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="查询性能回归测试（合成大数据集）")
+    parser.add_argument("--db", type=str, default="sqlite", help="sqlite / local / postgresql://...（默认 sqlite）")
+    parser.add_argument("--rows", type=str, default="1M", help="合成数据行数，可用 k/M/G 后缀（默认 1M）")
+    parser.add_argument("--sensors", type=int, default=1000, help="传感器数量（默认 1000）")
+    parser.add_argument("--interval", type=float, default=60.0, help="每个传感器两次读数的间隔秒数（默认 60）")
+    parser.add_argument("--start", type=str, default="2025-06-01T00:00:00", help="数据起始时间")
+    parser.add_argument("--seed", type=int, default=20250605, help="随机种子")
+    parser.add_argument("--anomaly-rate", type=float, default=0.01, help="异常读数比例（默认 0.01）")
+    parser.add_argument("--reload", action="store_true", help="即使数据集指纹相同也重新导入")
+    parser.add_argument("--schema-sql", type=str, default=None, help="替换默认建表语句的 SQL 文件（Postgres）")
+    parser.add_argument("--post-sql", type=str, default=None, help="导入后执行的 SQL 文件（如新增索引）")
+    parser.add_argument("--sqlite-path", type=str, default=None, help="SQLite 数据文件（默认按指纹放在临时目录）")
+    parser.add_argument("--cases", type=str, default=None, help="逗号分隔的形态名（默认全部）")
+    parser.add_argument("--reps", type=int, default=5, help="每个形态计时次数（默认 5）")
+    parser.add_argument("--analyze", action="store_true", help="Postgres 使用 EXPLAIN ANALYZE BUFFERS（会再执行一次查询）")
+    parser.add_argument("--max-export-rows", type=str, default="1M",
+                        help="全量导出形态的数据量上限：JSON 为该值，NDJSON / npy 为 5 倍（默认 1M）")
+    parser.add_argument("--output", "-o", type=str, default=None, help="把结果（含完整执行计划）保存为 JSON")
+    parser.add_argument("--baseline", "-b", type=str, default=None, help="基线 JSON（之前 --output 保存的文件）")
+    parser.add_argument("--threshold", type=float, default=0.25, help="中位耗时相对基线增加超过该比例判为回退（默认 0.25）")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="差值小于该毫秒数不判为回退（默认 2）")
+    parser.add_argument("--strict-scans", action="store_true", help="不允许顺序扫描的形态出现顺序扫描即失败")
+    args = parser.parse_args()
+    args.rows = parse_count(args.rows)
+    args.max_export_rows = parse_count(args.max_export_rows)
+
+    dataset = Dataset(args)
+    backend = "sqlite" if args.db == "sqlite" else "pg"
+    postgres = None
+    env = {"LOG_LEVEL": "WARNING", "ALERTS_ENABLED": "false"}
+    if backend == "sqlite":
+        path = args.sqlite_path or os.path.join(tempfile.gettempdir(), f"qbench-{dataset.fingerprint}.db")
+        env["STORAGE_URL"] = f"sqlite:///{os.path.abspath(path)}"
+        db_label = f"SQLite {path}"
+    else:
+        if args.db == "local":
+            postgres = LocalPostgres()
+            dsn, db_label = postgres.dsn, f"本地 Postgres @ 127.0.0.1:{postgres.port}"
+        else:
+            dsn, db_label = args.db, f"Postgres（schema {SCHEMA}）"
+        env.update(db_env(dsn))
+        env["STORAGE_URL"] = ""
+        env["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+    # 接收端模块在导入时读取 config，环境变量必须先设置
+    os.environ.update(env)
+    sys.path.insert(0, RECEIVER_DIR)
+
+    try:
+        print(f"数据库: {db_label}  数据集: {dataset.rows:,} 行，指纹 {dataset.fingerprint}")
+        original_connect = instrument(backend)
+        import storage
+        from config import config
+        if backend == "sqlite":
+            load_sqlite(dataset, args.reload, env["STORAGE_URL"])
+        else:
+            load_postgres(dataset, args.reload, lambda: original_connect(config.DB_URL))
+
+        import app
+        cases = _build_cases()
+        if args.cases:
+            wanted = [c.strip() for c in args.cases.split(",") if c.strip()]
+            unknown = [c for c in wanted if c not in {name for name, *_ in cases}]
+            if unknown:
+                parser.error(f"未知形态: {', '.join(unknown)}")
+            cases = [c for c in cases if c[0] in wanted]
+        cases = [c for c in cases if c[1] in ("both", backend)]
+
+        ctx = {"params": dataset.query_params(), "rows": dataset.rows,
+               "client": app.app.test_client(), "store": storage.open_storage()}
+        if backend == "pg":
+            import psycopg2
+            ctx["pg"] = psycopg2.connect(config.DB_URL)   # 已被 instrument 替换，执行的 SQL 会被抓取
+            explain_conn = original_connect(config.DB_URL)
+            explain = functools.partial(_explain_pg_with, explain_conn, args.analyze)
+        else:
+            explain_conn = storage.open_storage(env["STORAGE_URL"]).conn
+            explain = functools.partial(explain_sqlite, explain_conn)
+        p = ctx["params"]
+        print(f"查询参数: sensor_id={p['sensor_id']}  日期={p['day']}  阶梯 {p['step_start']} ~ {p['step_end']}\n")
+
+        results = run_suite(cases, backend, ctx, args, explain)
+        ctx["store"].close()
+        explain_conn.close()
+        if backend == "pg":
+            ctx["pg"].close()
+    finally:
+        if postgres is not None:
+            postgres.stop()
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base_doc = json.load(f)
+        if base_doc["meta"].get("backend") != backend:
+            print(f"\n基线后端为 {base_doc['meta'].get('backend')}，当前为 {backend}，不做比较")
+        else:
+            if base_doc["meta"].get("fingerprint") != dataset.fingerprint:
+                print("\n注意：基线的数据集指纹不同（规模、参数或表结构变了），耗时对比仅供参考")
+            failures += compare(results, base_doc["results"], args)
+    if args.strict_scans:
+        failures += strict_scans(results)
+
+    if args.output:
+        doc = {
+            "meta": {
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "backend": backend,
+                "db": db_label,
+                "fingerprint": dataset.fingerprint,
+                "rows": dataset.rows,
+                "sensors": dataset.sensors,
+                "interval": dataset.interval,
+                "params": {k: str(v) for k, v in dataset.query_params().items()},
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\n结果已保存到 {args.output}")
+
+    errors = [name for name, r in results.items() if "error" in r]
+    if errors:
+        print(f"\n{len(errors)} 个形态执行失败: {', '.join(errors)}")
+    if failures:
+        print(f"\n{len(failures)} 项回退：")
+        for line in failures:
+            print(f"  - {line}")
+    if failures or errors:
+        sys.exit(1)
+    print("\n没有查询性能回退。")
+
+
+if __name__ == "__main__":
+    main()
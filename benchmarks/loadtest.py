@@ -0,0 +1,784 @@
+"""
+loadtest.py
+
+端到端压测：发送端 → MQTT → 入库引擎 → 数据库，阶梯式提高发送速率，找出吞吐停止增长的位置。
+
+全部在本机运行，不连接 test.mosquitto.org 或远程数据库：
+  - MQTT broker：本机有 mosquitto 时启动一个临时实例，否则使用 mini_broker.py（asyncio 实现的最小 broker）；
+    也可用 --broker host:port 指向已有的 broker；
+  - 数据库（--db）：
+      fake（默认）     进程内替身：按 (sensor_id, time_stamp) 去重模拟唯一约束，
+                        每批按 “固定开销 + 每行开销” sleep 模拟写库耗时（--fake-batch-ms / --fake-row-us），
+                        提交后的延迟统计、计数与真实 BatchWriter 完全一致；
+      sqlite           真实 BatchWriter 写入临时目录里的本地 SQLite（storage.py，WAL 模式），不需要任何外部服务，
+                        只支持 threaded 引擎；告警照常评估但不写库；
+      local            用 initdb / pg_ctl 在临时目录启动一个 Postgres 实例（需要本机安装 Postgres，且不能以 root 运行）；
+      postgresql://... 使用已有数据库，压测数据写在 sensor_id >= SENSOR_BASE 的区间，每个配置开始前清理。
+发送端直接使用 mqtt_sender.MqttPublisher.publish_records（与 main.py / fleet_sim.py 相同的发布路径），
+读数由 data_generator.generate_batch 生成，时间戳改为微秒精度以免同一传感器一秒内多条被去重。
+
+每个入库配置（--engines × --batch-sizes）在独立子进程中运行真实的 listen（threaded）或 async_ingest（async）引擎，
+每一级速率（--rates）持续 --duration 秒，由 --publishers 个发送进程分摊，之后等待积压写完，统计：
+  - 发送速率：各发送进程实际发出的条数 / 发送耗时（低于目标说明发送端或 broker 已饱和）；
+  - 持续入库速率：发送期间稳态段（跳过开头约 1 秒）每秒提交到数据库的条数；
+  - 积压：发送结束时已收到但尚未提交的条数，以及从发送结束到全部提交所需时间；
+  - 端到端提交延迟 p50/p95/p99（publish_ts → 提交，来自 lag_tracker）；
+  - 丢失：发出但最终没有入库的条数（包含 seq 缺口统计）。
+持续入库速率 ≥ 目标的 (1 - --tolerance) 且 p95 延迟不超过 --lag-slo 视为“跟得上”，
+报告给出每个配置最后一个跟得上的速率（拐点）与峰值吞吐，并根据积压位置提示瓶颈。
+注意：入库限流（RATE_*）默认被放开，否则压测测到的是限流阈值；--keep-admission 保留配置的限流。
+
+用法：
+    python benchmarks/loadtest.py                                           # threaded，fake 数据库，默认速率阶梯
+    python benchmarks/loadtest.py --rates 1000,2000,5000,10000 --duration 10 --engines threaded,async
+    python benchmarks/loadtest.py --db sqlite --batch-sizes 100,500,2000
+    python benchmarks/loadtest.py --db local --batch-sizes 100,500,2000 --report loadtest.md
+    python benchmarks/loadtest.py --db postgresql://user:pw@127.0.0.1:5432/bench --output loadtest.json
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SENDER_DIR = os.path.join(os.path.dirname(ROOT), "sersor-controller-sender")
+RECEIVER_DIR = os.path.join(os.path.dirname(ROOT), "receiver-database")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, SENDER_DIR)
+
+DEFAULT_RATES = (500, 1000, 2000, 5000, 10000, 20000)
+SENSOR_BASE = 900000          # 压测传感器 id 起点，避开真实传感器
+WARMUP_SENSOR_BASE = 990000
+TOPIC = "greenhouse/loadtest"
+MARKER_TOPIC = "loadtest/marker"   # 不在 greenhouse/# 下，入库端收不到
+TICK_S = 0.05
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_port(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+# ─── MQTT broker ────────────────────────────────────────────────────────────
+
+class LocalBroker:
+    """kind: mosquitto / mini / external"""
+
+    def __init__(self, address=None, force_mini=False):
+        self.proc = None
+        self.tmpdir = None
+        if address:
+            host, _, port = address.partition(":")
+            self.host, self.port, self.kind = host, int(port or 1883), "external"
+            return
+        self.host, self.port = "127.0.0.1", free_port()
+        mosquitto = None if force_mini else shutil.which("mosquitto")
+        if mosquitto:
+            self.kind = "mosquitto"
+            self.tmpdir = tempfile.mkdtemp(prefix="loadtest-mosquitto-")
+            conf = os.path.join(self.tmpdir, "mosquitto.conf")
+            with open(conf, "w") as f:
+                f.write(f"listener {self.port} {self.host}\nallow_anonymous true\npersistence false\n"
+                        "max_queued_messages 1000000\n")
+            self.proc = subprocess.Popen([mosquitto, "-c", conf],
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            import mini_broker
+            self.kind = "mini"
+            self.proc = multiprocessing.Process(target=mini_broker.run, args=(self.host, self.port),
+                                                name="mini-broker", daemon=True)
+            self.proc.start()
+        if not _wait_port(self.host, self.port, 10):
+            self.stop()
+            raise RuntimeError(f"MQTT broker ({self.kind}) 没有在 {self.host}:{self.port} 上启动")
+
+    def stop(self):
+        if isinstance(self.proc, subprocess.Popen):
+            self.proc.terminate()
+            self.proc.wait(timeout=10)
+        elif self.proc is not None:
+            self.proc.terminate()
+            self.proc.join(timeout=10)
+        self.proc = None
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def __str__(self):
+        return f"{self.kind} @ {self.host}:{self.port}"
+
+
+# ─── 数据库 ─────────────────────────────────────────────────────────────────
+
+class LocalPostgres:
+    """在临时目录里 initdb 并启动一个只监听 127.0.0.1 的实例，结束时停止并删除"""
+
+    def __init__(self):
+        initdb, pg_ctl = shutil.which("initdb"), shutil.which("pg_ctl")
+        if not initdb or not pg_ctl:
+            raise RuntimeError("没有找到 initdb / pg_ctl，请安装 Postgres 或改用 --db fake / --db <连接串>")
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            raise RuntimeError("Postgres 不能以 root 运行，请换普通用户或改用 --db fake / --db <连接串>")
+        self.pg_ctl = pg_ctl
+        self.port = free_port()
+        self.datadir = tempfile.mkdtemp(prefix="loadtest-pg-")
+        subprocess.run([initdb, "-D", self.datadir, "-U", "postgres", "--auth=trust"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([pg_ctl, "-D", self.datadir, "-w", "-l", os.path.join(self.datadir, "server.log"),
+                        "-o", f"-p {self.port} -h 127.0.0.1 -k {self.datadir}", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.dsn = f"postgresql://postgres@127.0.0.1:{self.port}/postgres"
+
+    def stop(self):
+        subprocess.run([self.pg_ctl, "-D", self.datadir, "-m", "fast", "stop"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+
+def db_env(dsn):
+    """连接串 → 接收端 config.py 读取的 DB_* 环境变量"""
+    url = urlparse(dsn)
+    return {
+        "DB_HOST": url.hostname or "127.0.0.1",
+        "DB_PORT": str(url.port or 5432),
+        "DB_NAME": (url.path or "/postgres").lstrip("/") or "postgres",
+        "DB_USER": url.username or "postgres",
+        "DB_PASSWORD": url.password or "",
+    }
+
+
+class FakeStore:
+    """进程内的“数据库”：唯一约束 (sensor_id, time_stamp) + 写入耗时模型"""
+
+    def __init__(self, batch_s, row_s):
+        self.batch_s = batch_s
+        self.row_s = row_s
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def cost(self, n):
+        return self.batch_s + self.row_s * n
+
+    def insert(self, rows):
+        inserted = 0
+        with self._lock:
+            for row in rows:
+                key = (row[0], row[1])
+                if key not in self._keys:
+                    self._keys.add(key)
+                    inserted += 1
+        return inserted
+
+
+CREATE_RAWDATA_SQL = """
+    CREATE TABLE IF NOT EXISTS rawdata_from_sensors (
+        id            SERIAL PRIMARY KEY,
+        sensor_id     INTEGER NOT NULL,
+        time_stamp    TIMESTAMP NOT NULL,
+        temperature   DOUBLE PRECISION,
+        humidity      DOUBLE PRECISION,
+        soil_moisture INTEGER,
+        is_anomaly    BOOLEAN
+    )
+"""
+
+
+# ─── 入库子进程 ─────────────────────────────────────────────────────────────
+
+def _prepare_database():
+    """真实数据库：建表/唯一索引（不存在时），清掉上一次压测留下的行"""
+    from database import db_manager
+
+    db_manager.connect()
+    with db_manager.conn, db_manager.conn.cursor() as cur:
+        cur.execute(CREATE_RAWDATA_SQL)
+    db_manager.ensure_constraints()
+    db_manager.ensure_alert_table()
+    with db_manager.conn, db_manager.conn.cursor() as cur:
+        cur.execute("DELETE FROM rawdata_from_sensors WHERE sensor_id >= %s", (SENSOR_BASE,))
+        cur.execute("DELETE FROM alerts WHERE sensor_id >= %s", (SENSOR_BASE,))
+
+
+def _prepare_local():
+    """本地 SQLite：建表，清掉上一次压测留下的行"""
+    import storage
+
+    store = storage.open_storage()
+    store.conn.execute("DELETE FROM rawdata_from_sensors WHERE sensor_id >= ?", (SENSOR_BASE,))
+    store.commit()
+    store.close()
+
+
+def _fake_threaded(store):
+    import listen
+    import metrics
+    from lag import lag_tracker
+    from writer import BatchWriter
+
+    class FakeDbWriter(BatchWriter):
+        def _flush(self, rows, stamps=()):
+            with metrics.DB_INSERT_SECONDS.time():
+                time.sleep(store.cost(len(rows)))
+                inserted = store.insert(rows)
+            commit_ts = time.time()
+            for row, publish_ts in zip(rows, stamps):
+                if publish_ts is not None:
+                    lag_tracker.observe_commit(row[0], publish_ts, commit_ts)
+            metrics.BATCH_ROWS.observe(len(rows))
+            self.inserted += inserted
+            self.conflicts += len(rows) - inserted
+
+    listen.writer = FakeDbWriter(db_url="fake://")
+    return listen.writer
+
+
+def _fake_async(store):
+    import asyncio
+    import async_ingest
+    import metrics
+    from config import config
+    from lag import lag_tracker
+
+    class FakeDbAsyncIngest(async_ingest.AsyncIngest):
+        async def _fake_writer(self):
+            while True:
+                entries = await self._next_batch()
+                rows = [row for row, _, _ in entries]
+                with metrics.DB_INSERT_SECONDS.time():
+                    await asyncio.sleep(store.cost(len(rows)))
+                    inserted = store.insert(rows)
+                metrics.BATCH_ROWS.observe(len(rows))
+                self.inserted += inserted
+                self.dedup_cache.mark(key for _, _, key in entries if key is not None)
+                commit_ts = time.time()
+                for row, publish_ts, _ in entries:
+                    if publish_ts is not None:
+                        lag_tracker.observe_commit(row[0], publish_ts, commit_ts)
+
+        async def run(self):
+            writers = [asyncio.create_task(self._fake_writer()) for _ in range(config.ASYNC_WRITERS)]
+            await asyncio.gather(self._subscribe(), *writers)
+
+    return FakeDbAsyncIngest
+
+
+def _discard_alert_events(monitor):
+    # fake / sqlite 模式下告警照常评估（属于入库热路径），但事件不写库（alerts 表只在 Postgres）
+    while True:
+        monitor.events.get()
+
+
+def ingest_child(conn, engine, env, fake_cost):
+    """入库子进程：在后台线程运行真实入库引擎，主线程通过 Pipe 响应 stats / reset / stop"""
+    os.environ.update(env)
+    sys.path.insert(0, RECEIVER_DIR)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        from lag import lag_tracker
+        from alerts import alert_monitor
+        store = FakeStore(*fake_cost) if fake_cost else None
+        local = os.environ.get("STORAGE_URL", "").startswith("sqlite://")
+        if local and engine != "threaded":
+            raise RuntimeError("本地 SQLite 只支持 threaded 引擎（async 引擎使用 asyncpg）")
+        if local:
+            _prepare_local()
+        elif store is None:
+            _prepare_database()
+        if store is not None or local:
+            alert_monitor._restore = lambda: None
+            alert_monitor._run = lambda: _discard_alert_events(alert_monitor)
+
+        if engine == "threaded":
+            import listen
+            writer = _fake_threaded(store) if store else listen.writer
+            target = lambda: listen.listening(client_id="loadtest-threaded", topic="greenhouse/#", metrics_port=0)
+
+            def counters():
+                s = writer.stats()
+                # 落盘到溢出文件的行不会再出现在本次统计中，按已处理计入 failed，避免等待积压时卡住
+                return {"inserted": s["inserted"], "conflicts": s["conflicts"],
+                        "failed": s["failed"] + s["spilled"], "queued": s["queued"]}
+        else:
+            import asyncio
+            import async_ingest
+            cls = _fake_async(store) if store else async_ingest.AsyncIngest
+            ingest = cls(client_id="loadtest-async", topic="greenhouse/#")
+            from config import config
+            if config.ALERTS_ENABLED:
+                alert_monitor.start()
+            target = lambda: asyncio.run(ingest.run())
+
+            def counters():
+                s = ingest.stats()
+                return {"inserted": s["inserted"], "conflicts": 0,
+                        "failed": s["failed"], "queued": s["queued"]}
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+
+    threading.Thread(target=target, name=f"ingest-{engine}", daemon=True).start()
+    conn.send(("ready", None))
+
+    while True:
+        cmd = conn.recv()
+        if cmd == "stats":
+            summary = lag_tracker.summary()
+            conn.send({**counters(), "received": summary["received"], "lost": summary["lost"],
+                       "commit_lag_s": summary["commit_lag_s"], "receive_lag_s": summary["receive_lag_s"]})
+        elif cmd == "reset":
+            # 每一级重新统计延迟分位数；窗口放大，覆盖整级的全部读数
+            with lag_tracker._lock:
+                lag_tracker._commit_lags = deque(maxlen=2000000)
+                lag_tracker._receive_lags = deque(maxlen=2000000)
+            conn.send("ok")
+        elif cmd == "stop":
+            return
+
+
+class IngestProcess:
+    def __init__(self, engine, batch_size, broker, args, dsn):
+        env = {
+            "MQTT_BROKER": broker.host,
+            "MQTT_PORT": str(broker.port),
+            "WRITER_BATCH_SIZE": str(batch_size),
+            "ASYNC_WRITERS": str(args.async_writers),
+            "METRICS_PORT": "0",
+            "LOG_LEVEL": "WARNING",
+            "LAG_ALERT_S": str(args.lag_slo),
+        }
+        if not args.keep_admission:
+            env.update({"RATE_SENSOR_PER_S": "1e9", "RATE_SENSOR_BURST": "1e9",
+                        "RATE_GLOBAL_PER_S": "1e9", "RATE_GLOBAL_BURST": "1e9"})
+        fake_cost = None
+        if dsn is None:
+            fake_cost = (args.fake_batch_ms / 1000.0, args.fake_row_us / 1e6)
+        elif dsn.startswith("sqlite://"):
+            env.update({"STORAGE_URL": dsn, "FORWARD_URL": ""})
+        else:
+            env.update(db_env(dsn))
+        self.conn, child = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(target=ingest_child, args=(child, engine, env, fake_cost),
+                                            name=f"ingest-{engine}", daemon=True)
+        self.proc.start()
+        if not self.conn.poll(30):
+            self.close()
+            raise RuntimeError("入库进程启动超时")
+        status, detail = self.conn.recv()
+        if status != "ready":
+            self.close()
+            raise RuntimeError(detail)
+
+    def call(self, cmd):
+        self.conn.send(cmd)
+        return self.conn.recv()
+
+    def close(self):
+        if self.proc.is_alive():
+            try:
+                self.conn.send("stop")
+            except (BrokenPipeError, OSError):
+                pass
+            self.proc.join(timeout=3)
+            if self.proc.is_alive():
+                self.proc.terminate()
+                self.proc.join(timeout=3)
+
+
+# ─── 发送子进程 ─────────────────────────────────────────────────────────────
+
+def publisher_child(results, index, broker_host, broker_port, rate, duration, sensors, sensor_base, qos):
+    """按单调时钟节拍以 rate 条/秒发布 duration 秒；结束后等 broker 确认全部在途消息"""
+    from data_generator import generate_batch
+    from mqtt_sender import MqttPublisher
+
+    publisher = MqttPublisher(broker_host, broker_port, qos=qos)
+    deadline = time.monotonic() + 10
+    while not publisher.client.is_connected():
+        if time.monotonic() > deadline:
+            results.put({"index": index, "error": "连接 broker 超时", "sent": 0, "elapsed": 0.0})
+            publisher.close()
+            return
+        time.sleep(0.02)
+
+    template = generate_batch(25.0, 60.0, 500.0, num_sensors=sensors, anomaly_rate=0.01)
+    for i, record in enumerate(template):
+        record["sensor_id"] = record["id"] = sensor_base + i
+
+    sent = 0
+    cursor = 0
+    started = time.monotonic()
+    end = started + duration
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        due = int(rate * (now - started)) - sent
+        if due > 0:
+            batch = []
+            for _ in range(due):
+                record = copy.copy(template[cursor])
+                cursor = (cursor + 1) % sensors
+                record["timestamp"] = datetime.datetime.now().isoformat()
+                batch.append(record)
+            sent += publisher.publish_records(batch, topic=TOPIC)
+        time.sleep(max(0.0, min(TICK_S, end - time.monotonic())))
+    elapsed = time.monotonic() - started
+
+    # 消息按顺序发送：标记消息被确认时，之前的消息都已交给 broker
+    flush_started = time.monotonic()
+    info = publisher.client.publish(MARKER_TOPIC, b"", qos=1)
+    try:
+        info.wait_for_publish(timeout=60)
+    except (ValueError, RuntimeError):
+        pass
+    flush_s = time.monotonic() - flush_started
+    publisher.close()
+    results.put({"index": index, "sent": sent, "elapsed": elapsed, "flush_s": flush_s})
+
+
+def run_publishers(broker, rate, duration, publishers, sensors, qos, sensor_base=SENSOR_BASE):
+    results = multiprocessing.Queue()
+    procs = []
+    for i in range(publishers):
+        p = multiprocessing.Process(
+            target=publisher_child,
+            args=(results, i, broker.host, broker.port, rate / publishers, duration,
+                  sensors, sensor_base + i * sensors, qos),
+            name=f"publisher-{i}", daemon=True)
+        p.start()
+        procs.append(p)
+    return procs, results
+
+
+def collect_publishers(procs, results, timeout):
+    out = []
+    deadline = time.monotonic() + timeout
+    for _ in procs:
+        try:
+            out.append(results.get(timeout=max(0.1, deadline - time.monotonic())))
+        except Exception:
+            break
+    for p in procs:
+        p.join(timeout=1)
+        if p.is_alive():
+            p.terminate()
+    return out
+
+
+# ─── 压测流程 ───────────────────────────────────────────────────────────────
+
+def _delta(after, before, key):
+    return after[key] - before[key]
+
+
+def warmup(ingest, broker, qos, timeout=15.0):
+    """订阅建立之前发出的消息会被 broker 丢弃：小流量预热，直到入库端确实收到"""
+    before = ingest.call("stats")["received"]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        procs, results = run_publishers(broker, 100, 0.5, 1, 10, qos, sensor_base=WARMUP_SENSOR_BASE)
+        collect_publishers(procs, results, 20)
+        time.sleep(0.3)
+        if ingest.call("stats")["received"] > before:
+            return True
+    return False
+
+
+def wait_drain(ingest, expected, timeout):
+    """等待积压写完：队列为空且已处理条数不再变化，或已处理条数达到发送条数"""
+    started = time.monotonic()
+    last = None
+    stable = 0
+    while True:
+        s = ingest.call("stats")
+        done = s["inserted"] + s["conflicts"] + s["failed"]
+        if s["queued"] == 0 and (done >= expected or done == last):
+            stable += 1
+            if done >= expected or stable >= 4:
+                return s
+        else:
+            stable = 0
+        last = done
+        if time.monotonic() - started > timeout:
+            return s
+        time.sleep(0.25)
+
+
+def run_step(ingest, broker, rate, args):
+    ingest.call("reset")
+    before = ingest.call("stats")
+    procs, results = run_publishers(broker, rate, args.duration, args.publishers, args.sensors, args.qos)
+    # 入库速率取稳态段：跳过开头（连接、第一次攒批的 flush 间隔），只看 [settle, duration] 之间的增量
+    settle = min(1.0, args.duration / 4)
+    time.sleep(settle)
+    at_settle = ingest.call("stats")
+    settled_at = time.monotonic()
+    time.sleep(max(0.0, args.duration - settle))
+    at_end = ingest.call("stats")
+    ended_at = time.monotonic()
+    window = ended_at - settled_at
+    pubs = collect_publishers(procs, results, args.duration + 90)
+    sent = sum(p["sent"] for p in pubs)
+    send_elapsed = max((p["elapsed"] for p in pubs), default=args.duration) or args.duration
+    flush_s = max((p.get("flush_s", 0.0) for p in pubs), default=0.0)
+    errors = [p["error"] for p in pubs if p.get("error")]
+
+    base_done = before["inserted"] + before["conflicts"] + before["failed"]
+    after = wait_drain(ingest, base_done + sent, args.drain_timeout)
+    drain_s = time.monotonic() - ended_at
+
+    inserted_at_end = _delta(at_end, before, "inserted")
+    received_at_end = _delta(at_end, before, "received")
+    inserted = _delta(after, before, "inserted")
+    received = _delta(after, before, "received")
+    commit = after["commit_lag_s"]
+    return {
+        "offered_per_s": rate,
+        "sent": sent,
+        "sent_per_s": round(sent / send_elapsed, 1),
+        "publisher_flush_s": round(flush_s, 3),
+        "received": received,
+        "inserted": inserted,
+        "sustained_per_s": round(_delta(at_end, at_settle, "inserted") / window, 1),
+        "received_per_s": round(_delta(at_end, at_settle, "received") / window, 1),
+        "backlog_at_end": max(0, received_at_end - inserted_at_end),
+        "writer_queue_at_end": at_end["queued"],
+        "drain_s": round(drain_s, 2),
+        "lost": max(0, sent - inserted - _delta(after, before, "conflicts")),
+        "seq_gaps": _delta(after, before, "lost"),
+        "failed": _delta(after, before, "failed"),
+        "commit_lag_p50_s": commit["p50"],
+        "commit_lag_p95_s": commit["p95"],
+        "commit_lag_p99_s": commit["p99"],
+        "errors": errors,
+    }
+
+
+def keeps_up(step, args):
+    """无丢失、p95 提交延迟不超过 SLO，并且入库速率达到目标；
+    低速率时每次攒批间隔会让窗口内的增量有一个批次的误差，结束时积压不超过 SLO 内的量同样算跟得上"""
+    p95 = step["commit_lag_p95_s"]
+    if step["lost"] or p95 is None or p95 > args.lag_slo:
+        return False
+    return (step["sustained_per_s"] >= step["offered_per_s"] * (1 - args.tolerance)
+            or step["backlog_at_end"] <= step["offered_per_s"] * args.lag_slo)
+
+
+def bottleneck(step, batch_size):
+    """根据积压出现的位置粗略判断瓶颈"""
+    if step["sent_per_s"] < step["offered_per_s"] * 0.9:
+        return "发送端 / broker（发送速率达不到目标）"
+    if step["writer_queue_at_end"] > 2 * batch_size:
+        return "写库（写入队列积压）"
+    if step["received_per_s"] < step["sent_per_s"] * 0.9:
+        return "接收端 MQTT 回调 / 解码（收到的少于发出的）"
+    if step["lost"]:
+        return "丢失（检查 broker 队列上限与 QoS）"
+    return "延迟超过 SLO"
+
+
+def run_config(engine, batch_size, broker, args, dsn):
+    label = f"{engine} batch={batch_size}"
+    print(f"\n=== {label} ===")
+    try:
+        ingest = IngestProcess(engine, batch_size, broker, args, dsn)
+    except Exception as e:
+        print(f"  跳过：{e}")
+        return {"config": label, "error": str(e), "steps": []}
+    steps = []
+    try:
+        if not warmup(ingest, broker, args.qos):
+            print("  跳过：入库端没有收到预热消息（订阅失败？）")
+            return {"config": label, "error": "warmup failed", "steps": []}
+        misses = 0
+        for rate in args.rates:
+            step = run_step(ingest, broker, rate, args)
+            step["keeps_up"] = keeps_up(step, args)
+            steps.append(step)
+            print(f"  目标 {rate:>8} 条/s  发送 {step['sent_per_s']:>9.0f}  入库 {step['sustained_per_s']:>9.0f}  "
+                  f"积压 {step['backlog_at_end']:>7}  清空 {step['drain_s']:>6.2f}s  "
+                  f"p95 {_fmt_lag(step['commit_lag_p95_s'])}  丢失 {step['lost']:>6}  "
+                  f"{'✓' if step['keeps_up'] else '✗'}")
+            misses = 0 if step["keeps_up"] else misses + 1
+            if misses >= 2 and not args.keep_going:
+                print("  连续两级跟不上，停止加压")
+                break
+    finally:
+        ingest.close()
+    return {"config": label, "engine": engine, "batch_size": batch_size, "steps": steps}
+
+
+def _fmt_lag(v):
+    return f"{v:>7.3f}s" if v is not None else "     n/a"
+
+
+def summarize(result, args):
+    steps = result["steps"]
+    if not steps:
+        return None
+    good = [s for s in steps if s["keeps_up"]]
+    knee = good[-1]["offered_per_s"] if good else None
+    peak = max(steps, key=lambda s: s["sustained_per_s"])
+    first_bad = next((s for s in steps if not s["keeps_up"]), None)
+    return {
+        "knee_per_s": knee,
+        "peak_sustained_per_s": peak["sustained_per_s"],
+        "peak_at_offered_per_s": peak["offered_per_s"],
+        "limited_by": bottleneck(first_bad, result["batch_size"]) if first_bad else None,
+    }
+
+
+def render_report(results, meta, args):
+    lines = [
+        "# 端到端压测报告",
+        "",
+        f"- 时间：{meta['created']}  主机：{meta['platform']}（{meta['cpu_count']} 核）",
+        f"- broker：{meta['broker']}  数据库：{meta['db']}",
+        f"- 每级 {args.duration} 秒，{args.publishers} 个发送进程，{args.sensors} 个传感器/进程，QoS {args.qos}；"
+        f"跟得上 = 入库速率 ≥ 目标 × {1 - args.tolerance:.0%}、无丢失、p95 提交延迟 ≤ {args.lag_slo}s",
+        "",
+    ]
+    for result in results:
+        lines.append(f"## {result['config']}")
+        lines.append("")
+        if result.get("error"):
+            lines += [f"未运行：{result['error']}", ""]
+            continue
+        lines.append("| 目标 条/s | 发送 条/s | 入库 条/s | 结束时积压 | 清空 s | p50 s | p95 s | p99 s | 丢失 | 跟得上 |")
+        lines.append("|---:|---:|---:|---:|---:|---:|---:|---:|---:|:---:|")
+        for s in result["steps"]:
+            lines.append(
+                f"| {s['offered_per_s']} | {s['sent_per_s']:.0f} | {s['sustained_per_s']:.0f} | "
+                f"{s['backlog_at_end']} | {s['drain_s']:.2f} | {s['commit_lag_p50_s']} | "
+                f"{s['commit_lag_p95_s']} | {s['commit_lag_p99_s']} | {s['lost']} | "
+                f"{'✓' if s['keeps_up'] else '✗'} |")
+        summary = result.get("summary")
+        if summary:
+            lines.append("")
+            knee = summary["knee_per_s"]
+            lines.append(f"拐点：{'最低一级就跟不上' if knee is None else f'{knee} 条/s'}；"
+                         f"峰值持续入库 {summary['peak_sustained_per_s']:.0f} 条/s"
+                         f"（目标 {summary['peak_at_offered_per_s']} 条/s 时）。")
+            if summary["limited_by"]:
+                lines.append(f"瓶颈提示：{summary['limited_by']}。")
+            else:
+                lines.append("所有速率都跟得上，吞吐尚未饱和，可继续提高 --rates。")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="发送端 → MQTT → 入库 → 数据库 端到端压测")
+    parser.add_argument("--rates", type=str, default=",".join(str(r) for r in DEFAULT_RATES),
+                        help="逗号分隔的发送速率阶梯（条/秒）")
+    parser.add_argument("--duration", type=float, default=5.0, help="每一级持续秒数（默认 5）")
+    parser.add_argument("--engines", type=str, default="threaded", help="逗号分隔：threaded,async（默认 threaded）")
+    parser.add_argument("--batch-sizes", type=str, default="500", help="逗号分隔的 WRITER_BATCH_SIZE（默认 500）")
+    parser.add_argument("--async-writers", type=int, default=4, help="async 引擎的并发写入协程数（默认 4）")
+    parser.add_argument("--publishers", type=int, default=2, help="发送进程数（默认 2）")
+    parser.add_argument("--sensors", type=int, default=1000, help="每个发送进程模拟的传感器数（默认 1000）")
+    parser.add_argument("--qos", type=int, default=1, choices=(0, 1, 2), help="发布 QoS（默认 1）")
+    parser.add_argument("--broker", type=str, default=None, help="使用已有 broker host:port（默认在本机启动）")
+    parser.add_argument("--mini-broker", action="store_true", help="即使有 mosquitto 也使用 mini_broker.py")
+    parser.add_argument("--db", type=str, default="fake", help="fake / sqlite / local / postgresql://...（默认 fake）")
+    parser.add_argument("--fake-batch-ms", type=float, default=2.0, help="fake 数据库每批固定开销（毫秒，默认 2）")
+    parser.add_argument("--fake-row-us", type=float, default=10.0, help="fake 数据库每行开销（微秒，默认 10）")
+    parser.add_argument("--keep-admission", action="store_true", help="保留 RATE_* 配置的入库限流")
+    parser.add_argument("--lag-slo", type=float, default=2.0, help="p95 提交延迟上限（秒，默认 2）")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="入库速率允许低于目标的比例（默认 0.05）")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="每级结束后等待积压写完的上限（秒）")
+    parser.add_argument("--keep-going", action="store_true", help="连续跟不上时也继续跑完所有速率")
+    parser.add_argument("--output", "-o", type=str, default=None, help="把结果保存为 JSON")
+    parser.add_argument("--report", type=str, default=None, help="把 Markdown 报告保存到文件")
+    args = parser.parse_args()
+
+    args.rates = [int(r) for r in args.rates.split(",") if r.strip()]
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    unknown = [e for e in engines if e not in ("threaded", "async")]
+    if unknown:
+        parser.error(f"未知入库引擎: {', '.join(unknown)}")
+    batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+
+    # paho 在发布失败时会打印大量告警，交给压测统计
+    logging.basicConfig(level=logging.WARNING)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+
+    broker = LocalBroker(args.broker, args.mini_broker)
+    postgres = None
+    sqlite_dir = None
+    try:
+        if args.db == "fake":
+            dsn, db_label = None, f"fake（每批 {args.fake_batch_ms} ms + 每行 {args.fake_row_us} µs）"
+        elif args.db == "sqlite":
+            sqlite_dir = tempfile.mkdtemp(prefix="loadtest-sqlite-")
+            dsn, db_label = f"sqlite:///{os.path.join(sqlite_dir, 'loadtest.db')}", "本地 SQLite（WAL）"
+        elif args.db == "local":
+            postgres = LocalPostgres()
+            dsn, db_label = postgres.dsn, f"本地 Postgres @ 127.0.0.1:{postgres.port}"
+        else:
+            dsn, db_label = args.db, f"Postgres {urlparse(args.db).hostname}"
+        print(f"broker: {broker}  数据库: {db_label}")
+
+        results = []
+        for engine in engines:
+            for batch_size in batch_sizes:
+                result = run_config(engine, batch_size, broker, args, dsn)
+                if result["steps"]:
+                    result["summary"] = summarize(result, args)
+                results.append(result)
+    finally:
+        if postgres is not None:
+            postgres.stop()
+        if sqlite_dir is not None:
+            shutil.rmtree(sqlite_dir, ignore_errors=True)
+        broker.stop()
+
+    meta = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "broker": broker.kind,
+        "db": db_label,
+    }
+    report = render_report(results, meta, args)
+    print("\n" + report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+        print(f"报告已保存到 {args.report}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "args": {k: v for k, v in vars(args).items()}, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
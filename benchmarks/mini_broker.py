@@ -0,0 +1,260 @@
+"""
+mini_broker.py
+
+压测用的最小 MQTT broker（asyncio 实现），在本机没有 mosquitto 时替代真实 broker。
+
+支持：
+  - MQTT 3.1.1 与 5.0 客户端（发送端 paho 默认 3.1.1，接收端使用 5.0）；
+  - CONNECT / PUBLISH（QoS 0/1/2）/ SUBSCRIBE / UNSUBSCRIBE / PINGREQ / DISCONNECT；
+  - 通配符 + 与 #，共享订阅 $share/<组>/<过滤器>（组内轮询分发）。
+不支持：持久会话与离线消息、保留消息、遗嘱、认证、MQTT 5 的流量控制（Receive Maximum 被忽略）。
+这些对吞吐压测没有影响，但断线重连类测试请使用真实 broker。
+
+向订阅者写入时等待 drain()，订阅者消费跟不上会反压到发布者的读取循环，与真实 broker 的 TCP 背压表现一致。
+
+用法：
+    python benchmarks/mini_broker.py --port 1883
+"""
+
+import argparse
+import asyncio
+import itertools
+import struct
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte = n % 128
+        n //= 128
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return bytes(out)
+
+
+def _packet(ptype, flags, body):
+    return bytes([(ptype << 4) | flags]) + _encode_length(len(body)) + body
+
+
+def _utf8(s):
+    data = s.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def _read_varint(buf, pos):
+    value, shift = 0, 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _read_str(buf, pos):
+    n = struct.unpack_from("!H", buf, pos)[0]
+    return bytes(buf[pos + 2:pos + 2 + n]), pos + 2 + n
+
+
+def topic_matches(filter_, topic):
+    f_parts = filter_.split("/")
+    t_parts = topic.split("/")
+    for i, part in enumerate(f_parts):
+        if part == "#":
+            return True
+        if i >= len(t_parts):
+            return False
+        if part != "+" and part != t_parts[i]:
+            return False
+    return len(f_parts) == len(t_parts)
+
+
+class Session:
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.version = 4
+        self.client_id = None
+        self.subscriptions = {}    # 过滤器（含 $share 前缀）-> qos
+        self._ids = itertools.cycle(range(1, 65536))
+        self._pending_qos2 = {}
+
+    async def send_publish(self, topic, payload, qos):
+        body = _utf8(topic)
+        if qos:
+            body += struct.pack("!H", next(self._ids))
+        if self.version == 5:
+            body += b"\x00"
+        body += payload
+        self.writer.write(_packet(PUBLISH, qos << 1, body))
+        await self.writer.drain()
+
+    async def run(self):
+        try:
+            while True:
+                first = await self.reader.readexactly(1)
+                length, shift = 0, 0
+                while True:
+                    byte = (await self.reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    if not byte & 0x80:
+                        break
+                    shift += 7
+                body = await self.reader.readexactly(length) if length else b""
+                if not await self.handle(first[0] >> 4, first[0] & 0x0F, body):
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.remove(self)
+            self.writer.close()
+
+    async def handle(self, ptype, flags, body):
+        if ptype == CONNECT:
+            _, pos = _read_str(body, 0)
+            self.version = body[pos]
+            pos += 4                      # 协议级别 + 连接标志 + keepalive
+            if self.version == 5:
+                n, pos = _read_varint(body, pos)
+                pos += n
+            client_id, pos = _read_str(body, pos)
+            self.client_id = client_id.decode("utf-8", "replace")
+            ack = b"\x00\x00\x00" if self.version == 5 else b"\x00\x00"
+            self.writer.write(_packet(CONNACK, 0, ack))
+            await self.writer.drain()
+        elif ptype == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, pos = _read_str(body, 0)
+            pid = None
+            if qos:
+                pid = body[pos:pos + 2]
+                pos += 2
+            if self.version == 5:
+                n, pos = _read_varint(body, pos)
+                pos += n
+            payload = body[pos:]
+            if qos == 1:
+                self.writer.write(_packet(PUBACK, 0, pid))
+            elif qos == 2:
+                self.writer.write(_packet(PUBREC, 0, pid))
+            await self.broker.route(topic.decode("utf-8"), payload, qos)
+        elif ptype == PUBREL:
+            self.writer.write(_packet(PUBCOMP, 0, body[:2]))
+            await self.writer.drain()
+        elif ptype == SUBSCRIBE:
+            pid = body[:2]
+            pos = 2
+            if self.version == 5:
+                n, pos = _read_varint(body, pos)
+                pos += n
+            codes = bytearray()
+            while pos < len(body):
+                filter_, pos = _read_str(body, pos)
+                qos = body[pos] & 0x03
+                pos += 1
+                self.subscriptions[filter_.decode("utf-8")] = qos
+                codes.append(qos)
+            props = b"\x00" if self.version == 5 else b""
+            self.writer.write(_packet(SUBACK, 0, pid + props + bytes(codes)))
+            await self.writer.drain()
+            self.broker.rebuild()
+        elif ptype == UNSUBSCRIBE:
+            pid = body[:2]
+            pos = 2
+            if self.version == 5:
+                n, pos = _read_varint(body, pos)
+                pos += n
+            count = 0
+            while pos < len(body):
+                filter_, pos = _read_str(body, pos)
+                self.subscriptions.pop(filter_.decode("utf-8"), None)
+                count += 1
+            tail = (b"\x00" + b"\x00" * count) if self.version == 5 else b""
+            self.writer.write(_packet(UNSUBACK, 0, pid + tail))
+            await self.writer.drain()
+            self.broker.rebuild()
+        elif ptype == PINGREQ:
+            self.writer.write(_packet(PINGRESP, 0, b""))
+            await self.writer.drain()
+        elif ptype == DISCONNECT:
+            return False
+        # PUBACK / PUBREC / PUBCOMP（订阅端对我们下发消息的确认）无需处理
+        return True
+
+
+class Broker:
+    def __init__(self):
+        self.sessions = set()
+        self._direct = []          # [(过滤器, session, qos)]
+        self._shared = {}          # (组, 过滤器) -> [(session, qos)]
+        self._rr = {}
+        self.routed = 0
+
+    def remove(self, session):
+        self.sessions.discard(session)
+        self.rebuild()
+
+    def rebuild(self):
+        self._direct = []
+        self._shared = {}
+        for s in self.sessions:
+            for filter_, qos in s.subscriptions.items():
+                if filter_.startswith("$share/"):
+                    _, group, real = filter_.split("/", 2)
+                    self._shared.setdefault((group, real), []).append((s, qos))
+                else:
+                    self._direct.append((filter_, s, qos))
+
+    async def route(self, topic, payload, qos):
+        self.routed += 1
+        targets = {}
+        for filter_, s, sub_qos in self._direct:
+            if topic_matches(filter_, topic):
+                targets[s] = max(targets.get(s, 0), min(qos, sub_qos))
+        for key, members in self._shared.items():
+            if topic_matches(key[1], topic):
+                i = self._rr.get(key, 0)
+                s, sub_qos = members[i % len(members)]
+                self._rr[key] = i + 1
+                targets[s] = max(targets.get(s, 0), min(qos, sub_qos))
+        for s, out_qos in targets.items():
+            try:
+                await s.send_publish(topic, payload, out_qos)
+            except ConnectionError:
+                pass
+
+    async def serve(self, host, port, ready=None):
+        async def on_client(reader, writer):
+            session = Session(self, reader, writer)
+            self.sessions.add(session)
+            await session.run()
+
+        server = await asyncio.start_server(on_client, host, port)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+
+def run(host="127.0.0.1", port=1883, ready=None):
+    """阻塞运行（可作为 multiprocessing.Process 的 target；ready 为 multiprocessing.Event）"""
+    asyncio.run(Broker().serve(host, port, ready))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="压测用最小 MQTT broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    print(f"mini broker 监听 {args.host}:{args.port}")
+    try:
+        run(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,325 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter as _Counter
+from contextlib import nullcontext
+
+# 可选的运行时剖析，发送端与接收端共用（各自目录下的 profiling.py 从这里导入），默认关闭，
+# 可以一直编译在生产代码里：关闭时 profiler.tick() 只做一次属性判断，profiler.stage() 返回共享的空上下文。
+#
+# 开启方式：main.py --profile cpu,sample,mem,timers（或 all），接收端也可用环境变量 PROFILE。
+#   timers : 各阶段墙钟耗时（次数 / 合计 / 平均 / 最大）与各循环的迭代次数；
+#   cpu    : 在被剖析的循环所在线程里开启 cProfile，持续 cpu_window 秒后写出 .prof 与前 40 个函数；
+#   sample : 后台线程按 sample_hz 对所有线程采样调用栈，写出 flamegraph 可用的折叠栈与热点函数；
+#   mem    : tracemalloc 分配最多的代码行，以及与上一次报告相比增长最多的行。
+# 报告每 interval 秒写一次（0 表示不定时），也可以随时 kill -USR1 <pid> 触发（Windows 只支持定时），
+# 写到 <目录>/<进程名>-<pid>/<时间>-<序号>-*.txt。计时与采样在每次报告后清零，报告只覆盖上一段时间。
+# 被剖析的循环与阶段见两端的 profiling.py。
+
+MODES = ("cpu", "sample", "mem", "timers")
+MAX_STACK_DEPTH = 64
+_NULL = nullcontext()
+
+
+def _log(level, message):
+    """接收端配置了 logging 时写日志；发送端没有配置 logging，按它的习惯直接打印"""
+    if logging.getLogger().handlers:
+        logging.log(level, message)
+    else:
+        print(f"[{'Info' if level <= logging.INFO else 'Warning'}] {message}")
+
+
+def parse_modes(value):
+    modes = {m.strip().lower() for m in (value or "").split(",") if m.strip()}
+    if "all" in modes:
+        return set(MODES)
+    unknown = modes - set(MODES)
+    if unknown:
+        raise ValueError(f"未知的剖析模式: {', '.join(sorted(unknown))}（可选 {', '.join(MODES)}, all）")
+    return modes
+
+
+class _StageStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.name, time.perf_counter() - self.started)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.modes = set()
+        self.name = "proc"
+        self.out_dir = None
+        self.interval = 0.0
+        self.cpu_window = 10.0
+        self.sample_hz = 100.0
+        self._timing = False
+        self._stages = {}
+        self._loops = _Counter()
+        self._since = time.monotonic()
+        self._lock = threading.Lock()
+        self._dump_event = threading.Event()
+        # cpu：同一时刻只在一个线程里开着一个 cProfile（Python 3.12 起不允许多个同时开启）
+        self._cpu_requested = False
+        self._cpu_owner = None
+        self._cpu_loop = None
+        self._cpu_profile = None
+        self._cpu_until = 0.0
+        self._samples = _Counter()
+        self._sample_total = 0
+        self._skip_threads = set()
+        self._mem_previous = None
+        self._pid = os.getpid()
+        self._dumps = 0
+
+    # ─── 埋点（热路径）─────────────────────────────────────────────────────────
+    def stage(self, name):
+        """计时一个阶段：with profiler.stage("decode"): ..."""
+        if not self._timing:
+            return _NULL
+        return _Stage(self, name)
+
+    def tick(self, loop):
+        """标记循环的一次迭代，在该循环所在线程上驱动 cpu 剖析窗口"""
+        if not self.enabled:
+            return
+        if self._timing:
+            self._loops[loop] += 1
+        if self._cpu_requested or self._cpu_owner is not None:
+            self._cpu_tick(loop)
+
+    def _record(self, name, elapsed):
+        with self._lock:
+            s = self._stages.get(name)
+            if s is None:
+                s = self._stages[name] = _StageStats()
+            s.count += 1
+            s.total += elapsed
+            if elapsed > s.max:
+                s.max = elapsed
+
+    # ─── cpu ────────────────────────────────────────────────────────────────
+    def _cpu_tick(self, loop):
+        me = threading.get_ident()
+        with self._lock:
+            if self._cpu_owner is None:
+                if not self._cpu_requested:
+                    return
+                self._cpu_requested = False
+                self._cpu_owner, self._cpu_loop = me, loop
+                self._cpu_until = time.monotonic() + self.cpu_window
+                self._cpu_profile = cProfile.Profile()
+                start = True
+            elif self._cpu_owner != me or time.monotonic() < self._cpu_until:
+                return
+            else:
+                start = False
+        if start:
+            self._cpu_profile.enable()
+            return
+        self._cpu_profile.disable()
+        profile, loop_name = self._cpu_profile, self._cpu_loop
+        with self._lock:
+            self._cpu_owner = self._cpu_profile = self._cpu_loop = None
+        # 写文件放到后台线程，不占用被剖析循环的时间
+        threading.Thread(target=self._write_cpu, args=(profile, loop_name), daemon=True).start()
+
+    def _write_cpu(self, profile, loop):
+        prefix = self._prefix()
+        profile.dump_stats(f"{prefix}-cpu-{loop}.prof")
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(40)
+        self._write(f"{prefix}-cpu-{loop}.txt",
+                    f"cProfile：循环 {loop}，窗口 {self.cpu_window:g} 秒\n\n{out.getvalue()}")
+
+    # ─── sample ─────────────────────────────────────────────────────────────
+    def _sample_loop(self):
+        self._skip_threads.add(threading.get_ident())
+        period = 1.0 / self.sample_hz
+        while True:
+            time.sleep(period)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            stacks = []
+            for ident, frame in frames.items():
+                if ident in self._skip_threads:
+                    continue
+                parts = []
+                while frame is not None and len(parts) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(parts)))
+            del frames
+            with self._lock:
+                self._samples.update(stacks)
+                self._sample_total += 1
+
+    def _dump_samples(self, prefix):
+        with self._lock:
+            samples, total = self._samples, self._sample_total
+            self._samples, self._sample_total = _Counter(), 0
+        if not samples:
+            return
+        with open(f"{prefix}-sample.folded", "w", encoding="utf-8") as f:
+            for stack, n in samples.most_common():
+                f.write(f"{stack} {n}\n")
+        leaf = _Counter()
+        for stack, n in samples.items():
+            leaf[stack.rsplit(";", 1)[-1]] += n
+        lines = [f"采样 {total} 次（{self.sample_hz:g} Hz），按栈顶函数统计（含等待 I/O 与锁的线程）：", ""]
+        for func, n in leaf.most_common(40):
+            lines.append(f"{n / total:8.1%}  {n:>8}  {func}")
+        self._write(f"{prefix}-sample.txt", "\n".join(lines))
+
+    # ─── mem ────────────────────────────────────────────────────────────────
+    def _dump_mem(self, prefix):
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"当前 {current / 1024:.1f} KB，峰值 {peak / 1024:.1f} KB", "", "分配最多的代码行："]
+        for stat in snapshot.statistics("lineno")[:25]:
+            lines.append(f"  {stat}")
+        if self._mem_previous is not None:
+            lines += ["", "与上一次报告相比增长最多："]
+            for stat in snapshot.compare_to(self._mem_previous, "lineno")[:15]:
+                lines.append(f"  {stat}")
+        self._mem_previous = snapshot
+        self._write(f"{prefix}-mem.txt", "\n".join(lines))
+
+    # ─── 报告 ───────────────────────────────────────────────────────────────
+    def _prefix(self):
+        # 序号避免同一秒内的定时报告与信号报告互相覆盖
+        with self._lock:
+            self._dumps += 1
+            n = self._dumps
+        return os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{n:04d}")
+
+    def _write(self, path, text):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+    def _dump_timers(self, prefix):
+        now = time.monotonic()
+        with self._lock:
+            stages, loops, since = self._stages, self._loops, self._since
+            self._stages, self._loops, self._since = {}, _Counter(), now
+        wall = max(now - since, 1e-9)
+        lines = [f"最近 {wall:.1f} 秒", "", f"{'阶段':<20}{'次数':>10}{'合计 s':>12}{'占比':>8}{'平均 ms':>12}{'最大 ms':>12}"]
+        for name, s in sorted(stages.items(), key=lambda kv: -kv[1].total):
+            lines.append(f"{name:<20}{s.count:>10}{s.total:>12.3f}{s.total / wall:>8.1%}"
+                         f"{s.total / s.count * 1000:>12.3f}{s.max * 1000:>12.3f}")
+        if loops:
+            lines += ["", f"{'循环':<20}{'迭代':>10}{'每秒':>12}"]
+            for name, n in loops.most_common():
+                lines.append(f"{name:<20}{n:>10}{n / wall:>12.1f}")
+        self._write(f"{prefix}-timers.txt", "\n".join(lines))
+
+    def dump(self, reason="manual"):
+        """写出一份报告；cpu 模式下同时请求一次剖析窗口，窗口结束后另行写出"""
+        if not self.enabled:
+            return
+        prefix = self._prefix()
+        try:
+            if "timers" in self.modes:
+                self._dump_timers(prefix)
+            if "sample" in self.modes:
+                self._dump_samples(prefix)
+            if "mem" in self.modes:
+                self._dump_mem(prefix)
+            if "cpu" in self.modes:
+                with self._lock:
+                    if self._cpu_owner is None:
+                        self._cpu_requested = True
+            _log(logging.INFO, f"剖析报告已写出（{reason}）: {prefix}-*")
+        except OSError as e:
+            _log(logging.WARNING, f"写剖析报告失败: {e}")
+
+    def _dump_loop(self):
+        self._skip_threads.add(threading.get_ident())
+        while True:
+            triggered = self._dump_event.wait(self.interval if self.interval > 0 else None)
+            self._dump_event.clear()
+            self.dump("signal" if triggered else "schedule")
+
+    def _on_signal(self, signum, frame):
+        self._dump_event.set()
+
+    # ─── 启动 ───────────────────────────────────────────────────────────────
+    def start(self, modes, out_dir="profiles", interval=60.0, name="proc",
+              cpu_window=10.0, sample_hz=100.0, mem_frames=10):
+        modes = parse_modes(modes) if isinstance(modes, str) else set(modes)
+        if self._pid != os.getpid():
+            # fork 出的子进程继承了父进程的状态，但没有继承后台线程，重新初始化
+            self.__init__()
+        if not modes or self.enabled:
+            return False
+        self.modes = modes
+        self.name = name
+        self.interval = interval
+        self.cpu_window = cpu_window
+        self.sample_hz = sample_hz
+        self.out_dir = os.path.join(out_dir, f"{name}-{os.getpid()}")
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._timing = "timers" in modes
+        self._since = time.monotonic()
+        if "mem" in modes and not tracemalloc.is_tracing():
+            tracemalloc.start(mem_frames)
+        if "sample" in modes:
+            threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True).start()
+        if "cpu" in modes:
+            # 第一个窗口立即开始，不必等第一次报告
+            self._cpu_requested = True
+        threading.Thread(target=self._dump_loop, name="profiler-dump", daemon=True).start()
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, self._on_signal)
+        self.enabled = True
+        when = f"每 {interval:g} 秒" if interval > 0 else "仅在收到信号时"
+        hint = f"（kill -USR1 {os.getpid()} 立即写出）" if hasattr(signal, "SIGUSR1") else ""
+        _log(logging.INFO, f"剖析已开启: {', '.join(sorted(modes))}，{when}写出到 {self.out_dir}{hint}")
+        return True
+
+    def start_from_config(self, config, name="receiver", **overrides):
+        """按 config.PROFILE_* 启动；overrides 可覆盖 modes / out_dir / interval 等参数"""
+        options = {
+            "modes": config.PROFILE,
+            "out_dir": config.PROFILE_DIR,
+            "interval": config.PROFILE_INTERVAL,
+            "cpu_window": config.PROFILE_CPU_WINDOW,
+            "sample_hz": config.PROFILE_SAMPLE_HZ,
+        }
+        options.update({k: v for k, v in overrides.items() if v is not None})
+        return self.start(name=name, **options)
+
+
+# 进程内共享的剖析器
+profiler = Profiler()
@@ -0,0 +1,239 @@
+import json
+import logging
+import queue
+import threading
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+from config import config
+import metrics
+import spill
+import storage
+from dedup import RecentKeyCache
+
+# 发送端边缘预聚合的窗口汇总（主题 .../summary，格式见发送端 aggregator.py）直接写入 sensor_aggregates，
+# 每个传感器每个窗口一行。保存 条数 / 和 / 平方和 / 最小 / 最大，可以还原平均值与标准差，
+# 并且多个窗口可以相加合并成更长的时间段：
+#   avg    = sum / count
+#   stddev = sqrt((sumsq - sum * sum / count) / (count - 1))
+# 发送端退出时会提前发出不完整的窗口，重启后同一窗口的其余部分再发一次：主键 (sensor_id, window_start)
+# 冲突时合并两部分（条数与和相加，最小 / 最大取两者），而不是丢掉后一部分。
+# 因为冲突会累加，QoS 1 重投的同一条汇总要在写入前挡住：最近写入过的汇总消息按内容记在 recent_summaries，
+# 内容相同的汇总只写一次（两部分的条数与和不会完全相同）。提交之后、确认之前进程崩溃导致的重投仍会重复计数。
+
+METRICS = ("temp", "hum", "soil")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS sensor_aggregates (
+        sensor_id     INTEGER NOT NULL,
+        zone          INTEGER,
+        window_start  TIMESTAMP NOT NULL,
+        window_end    TIMESTAMP NOT NULL,
+        count         INTEGER NOT NULL,
+        anomalies     INTEGER NOT NULL DEFAULT 0,
+        temp_sum DOUBLE PRECISION, temp_sumsq DOUBLE PRECISION, temp_min DOUBLE PRECISION, temp_max DOUBLE PRECISION,
+        hum_sum  DOUBLE PRECISION, hum_sumsq  DOUBLE PRECISION, hum_min  DOUBLE PRECISION, hum_max  DOUBLE PRECISION,
+        soil_sum DOUBLE PRECISION, soil_sumsq DOUBLE PRECISION, soil_min DOUBLE PRECISION, soil_max DOUBLE PRECISION,
+        PRIMARY KEY (sensor_id, window_start)
+    );
+    CREATE INDEX IF NOT EXISTS idx_sensor_aggregates_window ON sensor_aggregates (window_start);
+"""
+
+COLUMNS = ["sensor_id", "zone", "window_start", "window_end", "count", "anomalies"] + [
+    f"{m}_{stat}" for m in METRICS for stat in ("sum", "sumsq", "min", "max")]
+
+MERGE_SQL = ",\n        ".join(
+    ["window_end = GREATEST(sensor_aggregates.window_end, EXCLUDED.window_end)"]
+    + [f"{col} = sensor_aggregates.{col} + EXCLUDED.{col}" for col in ("count", "anomalies")]
+    + [f"{m}_{stat} = sensor_aggregates.{m}_{stat} + EXCLUDED.{m}_{stat}"
+       for m in METRICS for stat in ("sum", "sumsq")]
+    + [f"{m}_{stat} = {fn}(sensor_aggregates.{m}_{stat}, EXCLUDED.{m}_{stat})"
+       for m in METRICS for stat, fn in (("min", "LEAST"), ("max", "GREATEST"))])
+
+INSERT_SQL = f"""
+    INSERT INTO sensor_aggregates ({", ".join(COLUMNS)})
+    VALUES %s
+    ON CONFLICT (sensor_id, window_start) DO UPDATE SET
+        {MERGE_SQL}
+"""
+
+# asyncpg 版本（async_ingest 使用）
+ASYNC_INSERT_SQL = f"""
+    INSERT INTO sensor_aggregates ({", ".join(COLUMNS)})
+    VALUES ({", ".join(f"${i}" for i in range(1, len(COLUMNS) + 1))})
+    ON CONFLICT (sensor_id, window_start) DO UPDATE SET
+        {MERGE_SQL}
+"""
+
+SUMMARY_TOPIC = "greenhouse/+/summary"  # 发送端 <主题前缀>/summary 与车队模拟 greenhouse/<分区>/summary
+SUMMARY_DEDUP_SIZE = 10000
+
+# 两个入库引擎（INGEST_MODE=both）在同一进程内共用
+recent_summaries = RecentKeyCache(SUMMARY_DEDUP_SIZE)
+
+SUMMARY_RECEIVED = metrics.Counter("ingest_summaries_total", "Window summary messages received")
+SUMMARY_ROWS = metrics.Counter("ingest_summary_rows_total", "Per-sensor aggregate rows written")
+SUMMARY_DUPLICATES = metrics.Counter("ingest_summary_duplicates_total", "Redelivered window summaries skipped")
+
+
+def is_summary_topic(topic):
+    return topic.endswith("/summary")
+
+
+def summary_key(payload):
+    """汇总消息的内容键：同一窗口的两部分条数与和不同，重投的同一条消息相同"""
+    return (payload.get("zone"), payload.get("window_start"), payload.get("window_end"),
+            json.dumps([payload.get(k) for k in ("sensor_ids", "count", "anomalies", "sum")]))
+
+
+def summary_rows(payload):
+    """把一条汇总消息展开为 sensor_aggregates 的行（顺序同 COLUMNS）；字段缺失或长度不一致时抛 ValueError"""
+    try:
+        zone = payload.get("zone")
+        start, end = payload["window_start"], payload["window_end"]
+        columns = [payload[k] for k in ("sensor_ids", "count", "anomalies", "sum", "sumsq", "min", "max")]
+    except (KeyError, AttributeError) as e:
+        raise ValueError(f"汇总消息缺少字段: {e}")
+    if len({len(c) for c in columns}) != 1:
+        raise ValueError("汇总消息各字段长度不一致")
+    rows = []
+    for sensor_id, count, anomalies, s, sq, lo, hi in zip(*columns):
+        row = [sensor_id, zone, start, end, count, anomalies]
+        for i in range(len(METRICS)):
+            row += [s[i], sq[i], lo[i], hi[i]]
+        rows.append(tuple(row))
+    return rows
+
+
+class AggregateWriter:
+    """后台写入线程：汇总消息量很小（每个分区每个窗口一条），逐条写入，使用独立连接，不与 BatchWriter 的事务交错。
+
+    与读数行的 BatchWriter 一致：连接错误时按指数退避重试 WRITER_RETRIES 次，仍失败的汇总消息落盘到溢出文件
+    （见 spill.py），之后每次写入成功时（以及启动时）重放；数据错误的汇总写进拒收文件。
+    ack（QoS 1 手动确认）只在提交、落盘或拒收之后调用：预聚合模式下发送端不再逐条发送正常读数，
+    一条汇总丢失就是整个窗口的数据丢失。"""
+
+    def __init__(self, db_url=None, spill_path=None, max_queue=10000):
+        self.db_url = db_url or config.DB_URL
+        self.spill_path = spill_path
+        self.retries = config.WRITER_RETRIES
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.conn = None
+        self._thread = None
+        self._next_replay = 0.0
+        self.summaries = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.retried = 0
+        self.spilled = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="aggregate-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, payload, ack=None):
+        """校验并排队一条汇总消息；字段缺失时抛 ValueError（调用方照常确认）"""
+        SUMMARY_RECEIVED.inc()
+        summary_rows(payload)
+        self.queue.put((payload, ack))
+
+    def _run(self):
+        self._replay_spill()
+        while True:
+            payload, ack = self.queue.get()
+            if self.write(payload, ack) and time.monotonic() >= self._next_replay:
+                self._replay_spill()
+
+    def _connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.db_url)
+        return self.conn
+
+    def write(self, payload, ack=None):
+        """写入一条汇总（连接错误时重试），返回是否写入了数据库；提交、落盘或拒收后调用 ack"""
+        rows = summary_rows(payload)
+        key = summary_key(payload)
+        if not rows or recent_summaries.seen(key, record=False):
+            if rows:
+                self.duplicates += 1
+                SUMMARY_DUPLICATES.inc()
+            _ack(ack)
+            return True
+        delay = config.MQTT_RECONNECT_MIN
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                time.sleep(delay)
+                delay = min(delay * 2, config.MQTT_RECONNECT_MAX)
+            try:
+                inserted = self._insert(rows)
+            except storage.DATA_ERRORS as e:
+                logging.error(f"拒收无法写入的汇总（{len(rows)} 行）: {e}")
+                self.rejected += len(rows)
+                spill.append(spill.rejected_path(self.spill_path), [payload])
+                _ack(ack)
+                return False
+            except Exception as e:
+                logging.error(f"汇总写入失败（{len(rows)} 行）: {e}")
+                continue
+            recent_summaries.mark([key])
+            self.summaries += 1
+            self.inserted += inserted
+            SUMMARY_ROWS.inc(n=inserted)
+            metrics.log_sampled("aggregates.write", logging.INFO,
+                                f"窗口汇总入库: 分区 {payload.get('zone')} {payload['window_start']} "
+                                f"{inserted}/{len(rows)} 行", every=100)
+            _ack(ack)
+            return True
+        if spill.append(self.spill_path, [payload]):
+            self.spilled += 1
+            logging.warning(f"写入失败的汇总已落盘到 {self.spill_path}，数据库恢复后重放")
+            _ack(ack)
+        else:
+            # 不确认：重连后 broker 重投这条汇总
+            self.failed += len(rows)
+        return False
+
+    def _insert(self, rows):
+        """写入并提交，返回写入或合并的行数；失败时丢弃连接并抛出原异常"""
+        conn = None
+        try:
+            conn = self._connect()
+            with conn.cursor() as cur, metrics.DB_INSERT_SECONDS.time():
+                execute_values(cur, INSERT_SQL, rows, page_size=len(rows))
+                inserted = cur.rowcount
+            conn.commit()
+            return inserted
+        except Exception:
+            if conn is not None:
+                try:
+                    if not conn.closed:
+                        conn.rollback()
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+            self.conn = None
+            raise
+
+    def _replay_spill(self):
+        self._next_replay = time.monotonic() + config.MQTT_RECONNECT_MAX
+        payloads = spill.take(self.spill_path)
+        if not payloads:
+            return
+        logging.info(f"重放溢出文件中的 {len(payloads)} 条汇总")
+        for payload in payloads:
+            self.write(payload)
+        spill.done(self.spill_path)
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "summaries": self.summaries, "inserted": self.inserted,
+                "duplicates": self.duplicates, "retried": self.retried, "spilled": self.spilled,
+                "rejected": self.rejected, "failed": self.failed}
+
+
+def _ack(ack):
+    if ack is not None:
+        ack()
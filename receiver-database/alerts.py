@@ -0,0 +1,272 @@
+import logging
+import math
+import queue
+import threading
+import psycopg2
+from config import config
+import metrics
+
+# 基于状态跳变的告警：入库时逐条评估读数，每个 (sensor_id, 指标) 在内存里保存当前状态，
+# 只有“正常 → 越限”（打开）和“越限 → 正常”（关闭）时才写 alerts 表，
+# 记录开始/结束时间、开始值/峰值/结束值与持续期间的读数条数。
+# 查询告警只需在这张小表上走索引，不必扫描 rawdata_from_sensors。
+#
+# 写库在后台线程完成，不阻塞 MQTT 回调；进程启动时从表中恢复仍未关闭的告警，重启不会重复打开。
+# 打开中的告警峰值每 ALERT_FLUSH_S 秒回写一次，/alerts?state=active 能看到接近实时的峰值。
+# 写库失败时事件保留到下一轮按原顺序重试，峰值重新标记为待写，不会丢失打开/关闭事件。
+#
+# 状态保存在进程内，要求同一传感器的读数都进入同一个进程：多进程入库（ingest_pool）只在 --ordered
+# 时启用告警，无序共享订阅下各进程看到的读数不全，会重复打开（被 uq_alerts_open 吞掉）或被别的进程关闭。
+
+METRICS = ("temperature", "humidity", "soil_moisture")
+
+CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS alerts (
+        id           BIGSERIAL PRIMARY KEY,
+        sensor_id    INTEGER NOT NULL,
+        metric       VARCHAR(32) NOT NULL,
+        direction    VARCHAR(8) NOT NULL,
+        threshold    DOUBLE PRECISION NOT NULL,
+        started_at   TIMESTAMP NOT NULL,
+        ended_at     TIMESTAMP,
+        start_value  DOUBLE PRECISION NOT NULL,
+        peak_value   DOUBLE PRECISION NOT NULL,
+        end_value    DOUBLE PRECISION,
+        readings     INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_alerts_open ON alerts (sensor_id, metric) WHERE ended_at IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_alerts_sensor_started ON alerts (sensor_id, started_at DESC);
+    CREATE INDEX IF NOT EXISTS idx_alerts_started ON alerts (started_at DESC);
+"""
+
+OPEN_SQL = """
+    INSERT INTO alerts (sensor_id, metric, direction, threshold, started_at, start_value, peak_value)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT DO NOTHING
+"""
+
+PEAK_SQL = """
+    UPDATE alerts SET peak_value = %s, readings = %s
+    WHERE sensor_id = %s AND metric = %s AND ended_at IS NULL
+"""
+
+CLOSE_SQL = """
+    UPDATE alerts SET ended_at = %s, end_value = %s, peak_value = %s, readings = %s
+    WHERE sensor_id = %s AND metric = %s AND ended_at IS NULL
+"""
+
+ALERTS_OPENED = metrics.Counter("ingest_alerts_opened_total", "Alerts opened", ("metric",))
+ALERTS_CLOSED = metrics.Counter("ingest_alerts_closed_total", "Alerts closed", ("metric",))
+
+
+def limits_from_config():
+    return {
+        "temperature": (config.ALERT_TEMP_MIN, config.ALERT_TEMP_MAX),
+        "humidity": (config.ALERT_HUM_MIN, config.ALERT_HUM_MAX),
+        "soil_moisture": (config.ALERT_SOIL_MIN, config.ALERT_SOIL_MAX),
+    }
+
+
+class _OpenAlert:
+    __slots__ = ("direction", "threshold", "peak", "readings", "dirty")
+
+    def __init__(self, direction, threshold, value, readings=1):
+        self.direction = direction
+        self.threshold = threshold
+        self.peak = value
+        self.readings = readings
+        self.dirty = False
+
+
+def _number(value):
+    """读数转为 float；缺失或无法转换（字符串、布尔等）时返回 None，不参与告警评估，也不影响该读数入库"""
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+class AlertMonitor:
+    def __init__(self, db_url=None, limits=None, flush_interval=None):
+        self.db_url = db_url or config.DB_URL
+        self.limits = limits or limits_from_config()
+        self.flush_interval = flush_interval or config.ALERT_FLUSH_S
+        self.events = queue.Queue()
+        self.conn = None
+        self._pending = []     # 上一轮写库失败、待重试的事件
+        self._open = {}        # (sensor_id, metric) -> _OpenAlert
+        self._last_ts = {}     # sensor_id -> 最近评估的时间戳，迟到的旧读数不参与状态跳变
+        self._lock = threading.Lock()
+        self._thread = None
+        self.counters = {"evaluated": 0, "opened": 0, "closed": 0, "stale": 0, "failed": 0}  # failed 为写库失败次数
+
+    def start(self):
+        if self._thread is None:
+            self._restore()
+            self._thread = threading.Thread(target=self._run, name="alert-writer", daemon=True)
+            self._thread.start()
+
+    def observe(self, sensor_id, time_stamp, temperature, humidity, soil_moisture):
+        """评估一条读数；只在状态跳变时把事件放入写库队列"""
+        values = (temperature, humidity, soil_moisture)
+        with self._lock:
+            self.counters["evaluated"] += 1
+            last = self._last_ts.get(sensor_id)
+            if last is not None and str(time_stamp) < last:
+                self.counters["stale"] += 1
+                return
+            self._last_ts[sensor_id] = str(time_stamp)
+
+            for metric, value in zip(METRICS, values):
+                value = _number(value)
+                if value is None:
+                    continue
+                lo, hi = self.limits[metric]
+                key = (sensor_id, metric)
+                state = self._open.get(key)
+                if value > hi:
+                    direction, threshold = "high", hi
+                elif value < lo:
+                    direction, threshold = "low", lo
+                else:
+                    direction = None
+
+                if state is None:
+                    if direction is not None:
+                        self._open[key] = _OpenAlert(direction, threshold, value)
+                        self.counters["opened"] += 1
+                        ALERTS_OPENED.inc(metric)
+                        self.events.put(("open", (sensor_id, metric, direction, threshold,
+                                                  time_stamp, value, value)))
+                elif direction == state.direction:
+                    state.readings += 1
+                    if (value > state.peak) if direction == "high" else (value < state.peak):
+                        state.peak = value
+                        state.dirty = True
+                else:
+                    # 回到正常区间（或直接跳到另一侧越限）：关闭当前告警，另一侧越限时再打开新告警
+                    del self._open[key]
+                    self.counters["closed"] += 1
+                    ALERTS_CLOSED.inc(metric)
+                    self.events.put(("close", (time_stamp, value, state.peak, state.readings,
+                                               sensor_id, metric)))
+                    if direction is not None:
+                        self._open[key] = _OpenAlert(direction, threshold, value)
+                        self.counters["opened"] += 1
+                        ALERTS_OPENED.inc(metric)
+                        self.events.put(("open", (sensor_id, metric, direction, threshold,
+                                                  time_stamp, value, value)))
+
+    def _connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.db_url)
+        return self.conn
+
+    def _restore(self):
+        """从表中恢复未关闭的告警，避免重启后把同一次越限再打开一次"""
+        try:
+            conn = self._connect()
+            with conn.cursor() as cur:
+                cur.execute("SELECT sensor_id, metric, direction, threshold, peak_value, readings "
+                            "FROM alerts WHERE ended_at IS NULL")
+                rows = cur.fetchall()
+            conn.commit()
+        except psycopg2.Error as e:
+            logging.error(f"恢复未关闭告警失败: {e}")
+            return
+        with self._lock:
+            for sensor_id, metric, direction, threshold, peak, readings in rows:
+                self._open[(sensor_id, metric)] = _OpenAlert(direction, threshold, peak, readings)
+        if rows:
+            logging.info(f"已恢复 {len(rows)} 条未关闭的告警")
+
+    def _dirty_peaks(self):
+        with self._lock:
+            updates = []
+            for (sensor_id, metric), state in self._open.items():
+                if state.dirty:
+                    state.dirty = False
+                    updates.append((state.peak, state.readings, sensor_id, metric))
+            return updates
+
+    def _mark_dirty(self, peaks):
+        """峰值回写失败：重新标记为待写（告警在此期间已关闭的不再需要）"""
+        with self._lock:
+            for _, _, sensor_id, metric in peaks:
+                state = self._open.get((sensor_id, metric))
+                if state is not None:
+                    state.dirty = True
+
+    def _run(self):
+        while True:
+            batch, self._pending = self._pending, []
+            try:
+                batch.append(self.events.get(timeout=self.flush_interval))
+                while True:
+                    batch.append(self.events.get_nowait())
+            except queue.Empty:
+                pass
+            peaks = self._dirty_peaks()
+            if not batch and not peaks:
+                continue
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    # 事件按发生顺序执行，同一告警的 open 一定在 close 之前
+                    for kind, params in batch:
+                        cur.execute(OPEN_SQL if kind == "open" else CLOSE_SQL, params)
+                    for params in peaks:
+                        cur.execute(PEAK_SQL, params)
+                conn.commit()
+            except psycopg2.Error as e:
+                logging.error(f"告警写入失败（{len(batch)} 个事件），{self.flush_interval:.0f} 秒内重试: {e}")
+                self.counters["failed"] += 1
+                self._pending = batch
+                self._mark_dirty(peaks)
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        conn.close()  # 下一轮重新连接
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, "active": len(self._open),
+                    "pending_events": self.events.qsize() + len(self._pending)}
+
+
+# 进程内共享的告警监视器（threaded 与 async 引擎共用）
+alert_monitor = AlertMonitor()
+metrics.register_stats("ingest_alerts", alert_monitor.stats)
+
+
+# ─── 查询（Flask API 使用）────────────────────────────────────────────────────
+ALERT_COLUMNS = ["id", "sensor_id", "metric", "direction", "threshold", "started_at", "ended_at",
+                 "start_value", "peak_value", "end_value", "readings"]
+
+
+def query_alerts(cur, active=True, sensor_id=None, since=None, until=None, limit=100):
+    """active=True 只查未关闭的告警；否则按开始时间倒序查历史（可按传感器与时间范围过滤）"""
+    where, params = [], []
+    if active:
+        where.append("ended_at IS NULL")
+    if sensor_id is not None:
+        where.append("sensor_id = %s")
+        params.append(sensor_id)
+    if since is not None:
+        where.append("started_at >= %s")
+        params.append(since)
+    if until is not None:
+        where.append("started_at < %s")
+        params.append(until)
+    sql = f"SELECT {', '.join(ALERT_COLUMNS)} FROM alerts"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY started_at DESC LIMIT %s"
+    params.append(limit)
+    cur.execute(sql, params)
+    return [dict(zip(ALERT_COLUMNS, row)) for row in cur.fetchall()]
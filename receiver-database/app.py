@@ -1,26 +1,152 @@
-from flask import Flask, jsonify
+import time
+from flask import Flask, jsonify, request, g, Response
+import datetime
 import psycopg2
 from config import config
+import metrics
+from calc import fetch_step_series
+from alerts import query_alerts
+import formats
+import storage
+import querylayer
 
 app = Flask(__name__)
 
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    start = getattr(g, "request_start", None)
+    if start is not None:
+        metrics.API_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+    metrics.API_REQUESTS.inc(endpoint, response.status_code)
+    return formats.compress_response(response, request)
+
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 def get_db_connection():
     conn = psycopg2.connect(config.DB_URL)
     return conn
 
+# 原始读数：GET /sensor-data?format=columnar|ndjson|npy（或 Accept 头协商，格式说明见 formats.py）
+# 默认 json 输出保持不变；其它格式用服务器端游标边查边发，并按 Accept-Encoding 压缩
+SENSOR_DATA_SQL = """
+    SELECT sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly
+    FROM rawdata_from_sensors
+"""
+
 @app.route('/sensor-data')
 def get_sensor_data():
-    conn = get_db_connection()
-    cur = conn.cursor()
     try:
-        cur.execute("SELECT * FROM rawdata_from_sensors;")
+        fmt = formats.negotiate_format(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if storage.is_local():
+        return local_sensor_data(fmt)
+    if fmt != 'json':
+        return formats.stream_query(get_db_connection(), SENSOR_DATA_SQL, None,
+                                    fmt, formats.negotiate_encoding(request))
+
+    # 非流式查询复用连接池中的连接，固定语句在连接上只预备一次（见 querylayer.py）
+    with querylayer.connection() as conn, conn.cursor() as cur:
+        querylayer.execute(cur, "api_sensor_data", "SELECT * FROM rawdata_from_sensors;")
         rows = cur.fetchall()
         columns = [desc[0] for desc in cur.description]
         data = [dict(zip(columns, row)) for row in rows]
-        return jsonify(data)
+        response = jsonify(data)
+        response.vary.add('Accept')
+        return response
+
+def _scan_local():
+    store = storage.open_storage()
+    try:
+        yield from store.scan()
     finally:
-        cur.close()
-        conn.close()
+        store.close()
+
+def local_sensor_data(fmt):
+    """STORAGE_URL 为本地 SQLite（边缘节点）时从本地库读取，格式与 Postgres 版相同"""
+    columns = list(storage.COLUMNS)
+    if fmt != 'json':
+        return formats.stream_blocks(columns, _scan_local(), fmt, formats.negotiate_encoding(request))
+    data = [dict(zip(columns, row)) for rows in _scan_local() for row in rows]
+    response = jsonify(data)
+    response.vary.add('Accept')
+    return response
+
+# 每个传感器的最新读数：GET /sensor-data/latest（全部传感器）或 GET /sensor-data/latest?sensor_id=1,2,3
+@app.route('/sensor-data/latest')
+def get_latest():
+    try:
+        sensor_ids = [int(s) for s in request.args['sensor_id'].split(',')] if 'sensor_id' in request.args else None
+    except ValueError as e:
+        return jsonify({"error": f"invalid parameters: {e}"}), 400
+    store = storage.open_storage()
+    try:
+        rows = store.latest(sensor_ids)
+        return jsonify([dict(zip(storage.COLUMNS, row)) for row in rows])
+    finally:
+        store.close()
+
+# 阶梯保持重采样：GET /sensor-data/step?sensor_id=3&start=2025-06-05T00:00&end=2025-06-05T12:00&step=60
+# 发送端死区压缩后只有变化时才有新行，图表按固定步长取“当时有效”的读数；超过 HOLD_MAX_S 无数据的点为 null
+STEP_MAX_POINTS = 10000
+
+@app.route('/sensor-data/step')
+def get_step_series():
+    try:
+        sensor_id = int(request.args['sensor_id'])
+        end = datetime.datetime.fromisoformat(request.args['end']) if 'end' in request.args else datetime.datetime.now()
+        start = datetime.datetime.fromisoformat(request.args['start']) if 'start' in request.args else end - datetime.timedelta(hours=1)
+        step = float(request.args.get('step', 60))
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": f"invalid parameters: {e}"}), 400
+    if step <= 0 or end <= start:
+        return jsonify({"error": "step must be positive and end later than start"}), 400
+    if (end - start).total_seconds() / step > STEP_MAX_POINTS:
+        return jsonify({"error": f"too many points (max {STEP_MAX_POINTS}), increase step"}), 400
+
+    with querylayer.connection() as conn, conn.cursor() as cur:
+        rows = fetch_step_series(cur, sensor_id, start, end, step)
+        columns = ["time", "temperature", "humidity", "soil_moisture", "is_anomaly", "source_time"]
+        return jsonify([dict(zip(columns, row)) for row in rows])
+
+# 告警查询：GET /alerts?state=active（默认，未关闭的告警）
+#          GET /alerts?state=history&sensor_id=3&since=2025-06-05T00:00&until=2025-06-06T00:00&limit=100
+ALERTS_MAX_LIMIT = 1000
+
+@app.route('/alerts')
+def get_alerts():
+    state = request.args.get('state', 'active')
+    if state not in ('active', 'history'):
+        return jsonify({"error": "state must be 'active' or 'history'"}), 400
+    try:
+        sensor_id = int(request.args['sensor_id']) if 'sensor_id' in request.args else None
+        since = datetime.datetime.fromisoformat(request.args['since']) if 'since' in request.args else None
+        until = datetime.datetime.fromisoformat(request.args['until']) if 'until' in request.args else None
+        limit = int(request.args.get('limit', 100))
+    except ValueError as e:
+        return jsonify({"error": f"invalid parameters: {e}"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    limit = min(limit, ALERTS_MAX_LIMIT)
+
+    with querylayer.connection() as conn, conn.cursor() as cur:
+        alerts = query_alerts(cur, active=(state == 'active'), sensor_id=sensor_id,
+                              since=since, until=until, limit=limit)
+        now = datetime.datetime.now()
+        for alert in alerts:
+            end = alert["ended_at"] or now
+            alert["duration_s"] = round((end - alert["started_at"]).total_seconds(), 3)
+        return jsonify(alerts)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
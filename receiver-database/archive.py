@@ -0,0 +1,455 @@
+import argparse
+import datetime
+import json
+import mmap
+import os
+import shutil
+import zlib
+import numpy as np
+import psycopg2
+from config import config
+
+# 历史读数的列式冷归档：已结束的日期按天、按传感器分组导出为压缩列文件，长周期分析直接读文件，不再全表扫描 Postgres。
+#
+# 目录结构（每天每组一个目录，组号 = sensor_id // ARCHIVE_GROUP_SIZE）：
+#   <ARCHIVE_DIR>/<YYYY-MM-DD>/g<组号>/index.json       列的 dtype、编码方式与每个块的索引
+#   <ARCHIVE_DIR>/<YYYY-MM-DD>/g<组号>/<列名>.bin       各块依次拼接的列数据
+#   <ARCHIVE_DIR>/<YYYY-MM-DD>/_SUCCESS                 当天导出完成的标记
+# 组内按 (sensor_id, time_stamp) 排序，每 ARCHIVE_CHUNK_ROWS 行一块；index.json 记录每块的行数、
+# 时间范围、sensor_id 范围、每列的 min/max 以及在列文件中的偏移，读取时据此跳过无关的块。
+#
+# 编码：time_stamp 存为微秒（int64）的差分，sensor_id 存为 int32，读数为 float64（NULL 为 NaN），is_anomaly 为 uint8；
+# codec 为 zlib 时每块先做字节重排（同一字节位放在一起，浮点列更好压缩）再压缩，none 时不压缩、读取时零拷贝。
+# 读取时只 mmap 需要的列文件，只解压需要的块。
+
+COLUMNS = {
+    "sensor_id": "int32",
+    "time_stamp": "datetime64[us]",
+    "temperature": "float64",
+    "humidity": "float64",
+    "soil_moisture": "float64",
+    "is_anomaly": "uint8",
+}
+METRICS = ("temperature", "humidity", "soil_moisture")
+CODECS = ("zlib", "none")
+FORMAT_VERSION = 1
+
+SELECT_DAY_SQL = """
+    SELECT sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly
+    FROM rawdata_from_sensors
+    WHERE time_stamp >= %s AND time_stamp < %s
+    ORDER BY sensor_id, time_stamp
+"""
+
+
+# ─── 编码 ───────────────────────────────────────────────────────────────────
+
+def _storage(name):
+    """落盘的 dtype：时间差分存 int64"""
+    return np.dtype("int64") if name == "time_stamp" else np.dtype(COLUMNS[name])
+
+
+def _encode(name, values, codec):
+    arr = values.astype(COLUMNS[name], copy=False)
+    if name == "time_stamp":
+        arr = np.diff(arr.astype("int64"), prepend=np.int64(0))
+    raw = np.ascontiguousarray(arr).view(np.uint8)
+    if codec == "none":
+        return raw.tobytes(), raw.nbytes
+    itemsize = arr.dtype.itemsize
+    shuffled = raw.reshape(-1, itemsize).T.tobytes()
+    return zlib.compress(shuffled, 6), raw.nbytes
+
+
+def _decode(name, buf, raw_nbytes, codec):
+    dtype = _storage(name)
+    if codec == "none":
+        arr = np.frombuffer(buf, dtype=dtype)
+    else:
+        data = np.frombuffer(zlib.decompress(buf), dtype=np.uint8)
+        arr = data.reshape(dtype.itemsize, -1).T.copy().view(dtype).reshape(-1)
+    if name == "time_stamp":
+        return np.cumsum(arr).astype("datetime64[us]")
+    return arr
+
+
+# ─── 导出 ───────────────────────────────────────────────────────────────────
+
+class _GroupWriter:
+    def __init__(self, path, day, group, chunk_rows, codec):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.codec = codec
+        self.index = {"version": FORMAT_VERSION, "day": str(day), "group": group, "codec": codec,
+                      "rows": 0, "columns": dict(COLUMNS), "chunks": []}
+        os.makedirs(path)
+        self.files = {name: open(os.path.join(path, f"{name}.bin"), "wb") for name in COLUMNS}
+        self.offsets = dict.fromkeys(COLUMNS, 0)
+        self.pending = []
+
+    def add(self, row):
+        self.pending.append(row)
+        if len(self.pending) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        sensor_id, ts, temp, hum, soil, anomaly = zip(*rows)
+        columns = {
+            "sensor_id": np.array(sensor_id, dtype="int32"),
+            "time_stamp": np.array(ts, dtype="datetime64[us]"),
+            "temperature": np.array(temp, dtype="float64"),
+            "humidity": np.array(hum, dtype="float64"),
+            "soil_moisture": np.array(soil, dtype="float64"),
+            "is_anomaly": np.array([bool(a) for a in anomaly], dtype="uint8"),
+        }
+        chunk = {"rows": len(rows),
+                 "t_min": str(columns["time_stamp"].min()), "t_max": str(columns["time_stamp"].max()),
+                 "sensor_min": int(columns["sensor_id"][0]), "sensor_max": int(columns["sensor_id"][-1]),
+                 "stats": {}, "offsets": {}}
+        for name in METRICS:
+            values = columns[name]
+            if np.isnan(values).all():
+                chunk["stats"][name] = [None, None]
+            else:
+                chunk["stats"][name] = [float(np.nanmin(values)), float(np.nanmax(values))]
+        for name, values in columns.items():
+            data, raw_nbytes = _encode(name, values, self.codec)
+            self.files[name].write(data)
+            chunk["offsets"][name] = [self.offsets[name], len(data), raw_nbytes]
+            self.offsets[name] += len(data)
+        self.index["chunks"].append(chunk)
+        self.index["rows"] += len(rows)
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        with open(os.path.join(self.path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+
+
+def export_rows(rows, root, day, group_size=None, chunk_rows=None, codec=None):
+    """
+    把按 (sensor_id, time_stamp) 排好序的行写成一天的归档；先写临时目录再改名，重复导出同一天会整体替换。
+    rows: (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly) 的可迭代对象
+    返回 {组号: 行数}
+    """
+    group_size = group_size or config.ARCHIVE_GROUP_SIZE
+    chunk_rows = chunk_rows or config.ARCHIVE_CHUNK_ROWS
+    codec = codec or config.ARCHIVE_CODEC
+    if codec not in CODECS:
+        raise ValueError(f"未知的压缩方式: {codec}（可选 {', '.join(CODECS)}）")
+
+    final = os.path.join(root, str(day))
+    tmp = final + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    counts = {}
+    writer = None
+    for row in rows:
+        group = row[0] // group_size
+        if writer is None or writer.index["group"] != group:
+            if writer is not None:
+                writer.close()
+                counts[writer.index["group"]] = writer.index["rows"]
+            writer = _GroupWriter(os.path.join(tmp, f"g{group}"), day, group, chunk_rows, codec)
+        writer.add(row)
+    if writer is not None:
+        writer.close()
+        counts[writer.index["group"]] = writer.index["rows"]
+    open(os.path.join(tmp, "_SUCCESS"), "w").close()
+    shutil.rmtree(final, ignore_errors=True)
+    os.rename(tmp, final)
+    return counts
+
+
+def archive_day(conn, day, root=None, **options):
+    """用服务端游标按排序流式读取一天的原始读数并导出，内存占用与表大小无关"""
+    root = root or config.ARCHIVE_DIR
+    start = datetime.datetime.combine(day, datetime.time())
+    with conn.cursor(name=f"archive_{day:%Y%m%d}") as cur:
+        cur.itersize = 50000
+        cur.execute(SELECT_DAY_SQL, (start, start + datetime.timedelta(days=1)))
+        counts = export_rows(cur, root, day, **options)
+    conn.commit()
+    return counts
+
+
+def is_archived(root, day):
+    return os.path.exists(os.path.join(root, str(day), "_SUCCESS"))
+
+
+def archive_closed_days(conn, root=None, after_days=None, **options):
+    """导出所有已结束（早于今天 after_days 天）且尚未归档的日期"""
+    root = root or config.ARCHIVE_DIR
+    after_days = config.ARCHIVE_AFTER_DAYS if after_days is None else after_days
+    with conn.cursor() as cur:
+        cur.execute("SELECT MIN(time_stamp) FROM rawdata_from_sensors")
+        first = cur.fetchone()[0]
+    conn.commit()
+    if first is None:
+        return {}
+    cutoff = datetime.date.today() - datetime.timedelta(days=after_days)
+    done = {}
+    day = first.date()
+    while day < cutoff:
+        if not is_archived(root, day):
+            counts = archive_day(conn, day, root, **options)
+            done[str(day)] = sum(counts.values())
+            print(f"Archived {day}: {done[str(day)]} rows in {len(counts)} sensor groups")
+        day += datetime.timedelta(days=1)
+    return done
+
+
+# ─── 读取 ───────────────────────────────────────────────────────────────────
+
+class _Group:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            self.index = json.load(f)
+        for chunk in self.index["chunks"]:
+            chunk["t_min"] = np.datetime64(chunk["t_min"], "us")
+            chunk["t_max"] = np.datetime64(chunk["t_max"], "us")
+        self._maps = {}
+
+    def _map(self, name):
+        m = self._maps.get(name)
+        if m is None:
+            with open(os.path.join(self.path, f"{name}.bin"), "rb") as f:
+                m = self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                    if os.fstat(f.fileno()).st_size else b""
+        return m
+
+    def close(self):
+        for m in self._maps.values():
+            if isinstance(m, mmap.mmap):
+                m.close()
+        self._maps.clear()
+
+    def column(self, chunk, name):
+        offset, nbytes, raw_nbytes = chunk["offsets"][name]
+        buf = memoryview(self._map(name))[offset:offset + nbytes]
+        return _decode(name, buf, raw_nbytes, self.index["codec"])
+
+
+class ArchiveReader:
+    """
+    只读访问归档目录；scan() 返回 {列名: numpy 数组}。
+    块按时间范围、sensor_id 范围与 value_ranges（每列 [下限, 上限]）剪枝，只映射用到的列、只解压用到的块。
+    """
+
+    def __init__(self, root=None, group_size=None):
+        self.root = root or config.ARCHIVE_DIR
+        self.group_size = group_size or config.ARCHIVE_GROUP_SIZE
+        self._groups = {}
+        self.chunks_read = 0
+        self.chunks_skipped = 0
+
+    def close(self):
+        for g in self._groups.values():
+            g.close()
+        self._groups.clear()
+
+    def days(self):
+        if not os.path.isdir(self.root):
+            return []
+        # 只认完成标记齐全的日期目录（跳过导出中途留下的 .tmp 目录）
+        return sorted(datetime.date.fromisoformat(d) for d in os.listdir(self.root)
+                      if len(d) == 10 and is_archived(self.root, d))
+
+    def _group(self, path):
+        g = self._groups.get(path)
+        if g is None:
+            g = self._groups[path] = _Group(path)
+        return g
+
+    def _group_paths(self, day, sensor_ids):
+        base = os.path.join(self.root, str(day))
+        if sensor_ids is None:
+            names = sorted(n for n in os.listdir(base) if n.startswith("g"))
+        else:
+            names = [f"g{g}" for g in sorted({int(s) // self.group_size for s in sensor_ids})]
+        return [os.path.join(base, n) for n in names if os.path.isdir(os.path.join(base, n))]
+
+    def scan(self, columns=COLUMNS, sensor_ids=None, start=None, end=None, value_ranges=None):
+        columns = list(columns)
+        unknown = [c for c in columns if c not in COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的列: {', '.join(unknown)}")
+        start = None if start is None else np.datetime64(start, "us")
+        end = None if end is None else np.datetime64(end, "us")
+        ids = None if sensor_ids is None else np.asarray(sorted(set(int(s) for s in sensor_ids)), dtype="int32")
+        value_ranges = value_ranges or {}
+        need = set(columns)
+        if ids is not None:
+            need.add("sensor_id")
+        if start is not None or end is not None:
+            need.add("time_stamp")
+        need.update(value_ranges)
+
+        parts = {c: [] for c in columns}
+        for day in self.days():
+            day_start = np.datetime64(day, "us")
+            if (end is not None and day_start >= end) or \
+                    (start is not None and day_start + np.timedelta64(1, "D") <= start):
+                continue
+            for path in self._group_paths(day, None if ids is None else ids):
+                group = self._group(path)
+                for chunk in group.index["chunks"]:
+                    if not self._chunk_overlaps(chunk, ids, start, end, value_ranges):
+                        self.chunks_skipped += 1
+                        continue
+                    self.chunks_read += 1
+                    data = {c: group.column(chunk, c) for c in need}
+                    mask = None
+                    if ids is not None:
+                        mask = np.isin(data["sensor_id"], ids)
+                    if start is not None:
+                        mask = _and(mask, data["time_stamp"] >= start)
+                    if end is not None:
+                        mask = _and(mask, data["time_stamp"] < end)
+                    for c, (lo, hi) in value_ranges.items():
+                        mask = _and(mask, (data[c] >= lo) & (data[c] <= hi))
+                    for c in columns:
+                        parts[c].append(data[c] if mask is None else data[c][mask])
+        return {c: np.concatenate(parts[c]) if parts[c] else np.empty(0, dtype=COLUMNS[c]) for c in columns}
+
+    @staticmethod
+    def _chunk_overlaps(chunk, ids, start, end, value_ranges):
+        if start is not None and chunk["t_max"] < start:
+            return False
+        if end is not None and chunk["t_min"] >= end:
+            return False
+        if ids is not None:
+            lo = np.searchsorted(ids, chunk["sensor_min"])
+            if lo >= len(ids) or ids[lo] > chunk["sensor_max"]:
+                return False
+        for c, (lo, hi) in value_ranges.items():
+            cmin, cmax = chunk["stats"].get(c, [None, None])
+            if cmin is None or cmax < lo or cmin > hi:
+                return False
+        return True
+
+
+def _and(mask, cond):
+    return cond if mask is None else mask & cond
+
+
+# ─── calc 风格的聚合（直接在数组上计算）──────────────────────────────────────
+
+def _metric_stats(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    return {
+        "avg": float(values.mean()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        # 与 Postgres STDDEV 一致：样本标准差
+        "std": float(values.std(ddof=1)) if len(values) > 1 else None,
+    }
+
+
+def archive_stats(reader, sensor_id, start, end):
+    data = reader.scan(METRICS, sensor_ids=[sensor_id], start=start, end=end)
+    count = len(data["temperature"])
+    if not count:
+        print(f"No archived data found for (Sensor: {sensor_id}, [{start}, {end}))")
+        return None
+    result = {"count": count, **{m: _metric_stats(data[m]) for m in METRICS}}
+    t, h, s = (result[m] for m in METRICS)
+    print(f"Sensor: {sensor_id} [{start}, {end}) from archive \n Count: {count} \n Temp) Avg: {t['avg']:.2f}, Min: {t['min']:.2f}, Max: {t['max']:.2f}, StdDev: {t['std'] or 0:.2f} \n Humidity) Avg: {h['avg']:.2f}, Min: {h['min']:.2f}, Max: {h['max']:.2f}, StdDev: {h['std'] or 0:.2f} \n Soil Moisture) Avg: {s['avg']:.2f}, Min: {s['min']:.2f}, Max: {s['max']:.2f}, StdDev: {s['std'] or 0:.2f}")
+    return result
+# Same output as calc.stats(), computed from memory-mapped archive columns instead of rawdata_from_sensors.
+
+def archive_avg(reader, start=None, end=None):
+    data = reader.scan(("sensor_id", *METRICS), start=start, end=end)
+    ids, inverse = np.unique(data["sensor_id"], return_inverse=True)
+    result = {}
+    averages = []
+    for m in METRICS:
+        values = data[m]
+        valid = ~np.isnan(values)
+        sums = np.bincount(inverse[valid], weights=values[valid], minlength=len(ids))
+        counts = np.bincount(inverse[valid], minlength=len(ids))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages.append(sums / counts)
+    for i, sensor_id in enumerate(ids):
+        avg_temp, avg_humidity, avg_soil_moisture = (a[i] for a in averages)
+        result[int(sensor_id)] = (avg_temp, avg_humidity, avg_soil_moisture)
+        print(f"Sensor: {sensor_id}, Avg Temperature: {avg_temp:.2f}, Avg Humidity: {avg_humidity:.2f}, Avg Soil Moisture: {avg_soil_moisture:.2f}")
+    return result
+# Same output as calc.calc_avg() (optionally limited to [start, end)), grouped with bincount over the archive.
+
+def archive_daily(reader, sensor_id, start=None, end=None):
+    """每天的平均值，用于季节趋势：{日期: (温度, 湿度, 土壤)}"""
+    data = reader.scan(("time_stamp", *METRICS), sensor_ids=[sensor_id], start=start, end=end)
+    days = data["time_stamp"].astype("datetime64[D]")
+    keys, inverse = np.unique(days, return_inverse=True)
+    out = {}
+    columns = []
+    for m in METRICS:
+        values = data[m]
+        valid = ~np.isnan(values)
+        sums = np.bincount(inverse[valid], weights=values[valid], minlength=len(keys))
+        counts = np.bincount(inverse[valid], minlength=len(keys))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            columns.append(sums / counts)
+    for i, day in enumerate(keys):
+        out[str(day)] = tuple(float(c[i]) for c in columns)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史读数的列式冷归档")
+    parser.add_argument("--root", type=str, default=None, help="归档目录（默认 ARCHIVE_DIR）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="导出已结束且尚未归档的日期（或 --day 指定的一天）")
+    p_export.add_argument("--day", type=str, default=None, help="只导出这一天（YYYY-MM-DD），已归档时重新导出")
+    p_export.add_argument("--codec", choices=CODECS, default=None, help="压缩方式（默认 ARCHIVE_CODEC）")
+    p_stats = sub.add_parser("stats", help="在归档上计算单个传感器的统计量")
+    p_stats.add_argument("--sensor", type=int, required=True)
+    p_stats.add_argument("--start", type=str, required=True, help="起始时间（含），ISO 格式")
+    p_stats.add_argument("--end", type=str, required=True, help="结束时间（不含），ISO 格式")
+    sub.add_parser("info", help="列出已归档的日期与大小")
+    args = parser.parse_args()
+    root = args.root or config.ARCHIVE_DIR
+
+    if args.command == "export":
+        conn = psycopg2.connect(config.DB_URL)
+        try:
+            if args.day:
+                day = datetime.date.fromisoformat(args.day)
+                counts = archive_day(conn, day, root, codec=args.codec)
+                print(f"Archived {day}: {sum(counts.values())} rows in {len(counts)} sensor groups")
+            else:
+                done = archive_closed_days(conn, root, codec=args.codec)
+                if not done:
+                    print("Nothing to archive")
+        finally:
+            conn.close()
+    elif args.command == "stats":
+        reader = ArchiveReader(root)
+        archive_stats(reader, args.sensor, args.start, args.end)
+        print(f"chunks read: {reader.chunks_read}, skipped: {reader.chunks_skipped}")
+    else:
+        reader = ArchiveReader(root)
+        for day in reader.days():
+            base = os.path.join(root, str(day))
+            rows = size = groups = 0
+            for name in os.listdir(base):
+                path = os.path.join(base, name)
+                if not os.path.isdir(path):
+                    continue
+                groups += 1
+                rows += reader._group(path).index["rows"]
+                size += sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            print(f"{day}: {rows} rows, {groups} sensor groups, {size / 1024:.1f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import time
+import aiomqtt
+import asyncpg
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from config import config
+from dedup import RecentKeyCache
+import ratelimit
+import metrics
+from lag import lag_tracker
+import aggregates
+import spill
+import storage
+from alerts import alert_monitor
+from profiling import profiler
+
+# asyncio 入库引擎：在一个事件循环里完成 MQTT 订阅、JSON 解码与批量写库，
+# 不再依赖 paho 回调线程和阻塞的 psycopg2 调用。
+# 多个写入协程共享一个 asyncpg 连接池，每批一条 unnest() INSERT，
+# 批与批之间在不同连接上并发执行，形成流水线。
+# soil_moisture 以 float8[] 传入：发送端个别读数为小数时不会让整批失败，列为 INTEGER 时由赋值转换取整。
+# 去重缓存只在批次写入成功后记录键。aiomqtt 收到 QoS 1 消息即自动确认，broker 不会重投写入失败的读数：
+# 连接错误按指数退避重试 WRITER_RETRIES 次，仍失败的批次与 BatchWriter 一样落盘到溢出文件（见 spill.py），
+# 之后每次写入成功时（以及启动时）重放；数据错误按二分只拒收出错的行。窗口汇总写入失败时同样落盘，
+# 下一条汇总写入成功后重放。
+# 只写 Postgres：本地 SQLite 存储（STORAGE_URL=sqlite://...）请使用 threaded 引擎。
+
+TOPIC = "greenhouse/#"
+CLIENT_ID = "mqtt-listener-async"
+
+INSERT_SQL = """
+    INSERT INTO rawdata_from_sensors
+    (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+    SELECT * FROM unnest($1::int[], $2::timestamp[], $3::float8[], $4::float8[], $5::float8[], $6::bool[])
+    ON CONFLICT DO NOTHING
+"""
+
+# 由某一行的数据本身引起、重试不会成功的错误（asyncpg 在客户端编码参数失败时同样抛 DataError）
+DATA_ERRORS = (ValueError, TypeError, asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+class AsyncIngest:
+    def __init__(self, broker=None, port=None, client_id=CLIENT_ID, topic=TOPIC, db_url=None):
+        self.broker = broker or config.MQTT_BROKER
+        self.port = port or config.MQTT_PORT
+        self.client_id = client_id
+        self.topic = topic
+        self.db_url = db_url or config.STORAGE_URL or config.DB_URL
+        if storage.is_local(self.db_url):
+            raise ValueError(f"async 入库引擎只支持 Postgres，本地存储 {self.db_url} 请使用 INGEST_MODE=threaded")
+        spill_dir = config.WRITER_SPILL_DIR
+        self.spill_path = os.path.join(spill_dir, f"{client_id}.jsonl") if spill_dir else None
+        self.summary_spill_path = os.path.join(spill_dir, f"{client_id}.summaries.jsonl") if spill_dir else None
+        self._next_replay = 0.0
+        self._next_summary_replay = 0.0
+        self.batch_size = config.WRITER_BATCH_SIZE
+        self.flush_interval = config.WRITER_FLUSH_INTERVAL
+        self.dedup_cache = RecentKeyCache(config.DEDUP_CACHE_SIZE)
+        self.admission = ratelimit.from_config()
+        self.queue = asyncio.Queue(maxsize=100000)
+        self.pool = None
+        self.received = 0
+        self.inserted = 0
+        self.retried = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.summary_rows = 0
+        self.summaries_spilled = 0
+
+    async def handle_summary(self, payload):
+        """窗口汇总消息直接写入 sensor_aggregates，不经过限流与批量队列"""
+        aggregates.SUMMARY_RECEIVED.inc()
+        data = json.loads(payload)
+        rows = _summary_rows(data)
+        if not rows:
+            return
+        if await self._write_summary(data, rows) and time.monotonic() >= self._next_summary_replay:
+            await self._replay_summaries()
+
+    async def _write_summary(self, data, rows):
+        """写入一条汇总，返回是否写入了数据库；连接错误时落盘，数据错误时拒收"""
+        key = aggregates.summary_key(data)
+        if aggregates.recent_summaries.seen(key, record=False):
+            aggregates.SUMMARY_DUPLICATES.inc()
+            return True
+        try:
+            async with self.pool.acquire() as conn:
+                with metrics.DB_INSERT_SECONDS.time():
+                    await conn.executemany(aggregates.ASYNC_INSERT_SQL, rows)
+        except DATA_ERRORS as e:
+            logging.error(f"拒收无法写入的汇总（{len(rows)} 行）: {e}")
+            self.rejected += len(rows)
+            spill.append(spill.rejected_path(self.summary_spill_path), [data])
+            return False
+        except Exception as e:
+            logging.error(f"汇总写入失败（{len(rows)} 行）: {e}")
+            if spill.append(self.summary_spill_path, [data]):
+                self.summaries_spilled += 1
+            else:
+                self.failed += len(rows)
+            return False
+        aggregates.recent_summaries.mark([key])
+        self.summary_rows += len(rows)
+        aggregates.SUMMARY_ROWS.inc(n=len(rows))
+        return True
+
+    async def _replay_summaries(self):
+        self._next_summary_replay = time.monotonic() + config.MQTT_RECONNECT_MAX
+        for data in spill.take(self.summary_spill_path):
+            await self._write_summary(data, _summary_rows(data))
+        spill.done(self.summary_spill_path)
+
+    async def handle_payload(self, payload):
+        """在事件循环内解码一条消息并放入写入队列"""
+        recv_ts = time.time()
+        with metrics.DECODE_SECONDS.time(), profiler.stage("decode"):
+            data = json.loads(payload)
+        sensor_id = data.get("sensor_id")
+        time_stamp = data.get("timestamp")
+        if sensor_id is None or time_stamp is None:
+            raise ValueError(f"读数缺少 sensor_id 或 timestamp: {data}")
+        if self.dedup_cache.seen((sensor_id, time_stamp), record=False):
+            return
+        publish_ts = data.get("publish_ts")
+        lag_tracker.observe_receive(sensor_id, data.get("seq"), publish_ts, recv_ts)
+        if config.ALERTS_ENABLED:
+            with profiler.stage("alerts"):
+                alert_monitor.observe(sensor_id, time_stamp, data.get("temperature"),
+                                      data.get("humidity"), data.get("soil_moisture"))
+        reading = (
+            sensor_id,
+            datetime.datetime.fromisoformat(time_stamp),
+            data.get("temperature"),
+            data.get("humidity"),
+            data.get("soil_moisture"),
+            data.get("is_anomaly"),
+        )
+        key = (sensor_id, time_stamp)
+        for row in self.admission.admit(reading):
+            if row is reading:
+                await self.queue.put((time.monotonic(), row, publish_ts, key))
+            else:
+                await self.queue.put((time.monotonic(), row, None, None))
+
+    async def _next_batch(self):
+        item = await self.queue.get()
+        metrics.QUEUE_WAIT_SECONDS.observe(time.monotonic() - item[0])
+        entries = [item[1:]]   # (row, publish_ts, 去重键)
+        deadline = time.monotonic() + self.flush_interval
+        while len(entries) < self.batch_size:
+            try:
+                entries.append(self.queue.get_nowait()[1:])
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entries.append((await asyncio.wait_for(self.queue.get(), remaining))[1:])
+            except asyncio.TimeoutError:
+                break
+        return entries
+
+    async def _writer(self):
+        while True:
+            entries = await self._next_batch()
+            profiler.tick("writer")
+            with profiler.stage("db_flush"):
+                ok = await self._write(entries)
+            if ok and time.monotonic() >= self._next_replay:
+                await self._replay_spill()
+
+    async def _write(self, entries):
+        """写入一批 (row, publish_ts, 去重键)，返回是否写入了数据库；连接错误时重试后落盘，数据错误时二分"""
+        rows = [row for row, _, _ in entries]
+        columns = [list(col) for col in zip(*rows)]
+        delay = config.MQTT_RECONNECT_MIN
+        for attempt in range(config.WRITER_RETRIES + 1):
+            if attempt:
+                self.retried += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, config.MQTT_RECONNECT_MAX)
+            try:
+                async with self.pool.acquire() as conn:
+                    with metrics.DB_INSERT_SECONDS.time():
+                        status = await conn.execute(INSERT_SQL, *columns)
+            except DATA_ERRORS as e:
+                return await self._write_split(entries, e)
+            except Exception as e:
+                # 包括连接断开与连接池关闭；写入协程不能退出
+                logging.error(f"批量写入失败（{len(rows)} 条）: {e}")
+                continue
+            metrics.BATCH_ROWS.observe(len(rows))
+            # status 形如 "INSERT 0 <行数>"
+            self.inserted += int(status.split()[-1])
+            self.dedup_cache.mark(key for _, _, key in entries if key is not None)
+            commit_ts = time.time()
+            for row, publish_ts, _ in entries:
+                if publish_ts is not None:
+                    lag_tracker.observe_commit(row[0], publish_ts, commit_ts)
+            return True
+        if spill.append(self.spill_path, rows):
+            self.spilled += len(rows)
+            logging.warning(f"{len(rows)} 条写入失败的行已落盘到 {self.spill_path}，数据库恢复后重放")
+        else:
+            self.failed += len(rows)
+        return False
+
+    async def _write_split(self, entries, error):
+        """数据错误：单行时拒收，多行时二分后分别写入"""
+        if len(entries) == 1:
+            row, _, key = entries[0]
+            self.rejected += 1
+            metrics.WRITER_REJECTED.inc()
+            logging.error(f"拒收无法写入的行 {row}: {error}")
+            spill.append(spill.rejected_path(self.spill_path), [row])
+            if key is not None:
+                self.dedup_cache.mark([key])
+            return False
+        mid = len(entries) // 2
+        first = await self._write(entries[:mid])
+        second = await self._write(entries[mid:])
+        return first and second
+
+    async def _replay_spill(self):
+        """重放溢出文件；重放失败的批次由 _write 重新落盘"""
+        self._next_replay = time.monotonic() + config.MQTT_RECONNECT_MAX
+        rows = spill.take(self.spill_path)
+        if not rows:
+            return
+        logging.info(f"重放溢出文件中的 {len(rows)} 行")
+        for i in range(0, len(rows), self.batch_size):
+            batch = [((sid, datetime.datetime.fromisoformat(ts), *rest), None, None)
+                     for sid, ts, *rest in rows[i:i + self.batch_size]]
+            if await self._write(batch):
+                self.replayed += len(batch)
+        spill.done(self.spill_path)
+
+    async def _drain_admission(self):
+        """定时取出限流合并行，并清理空闲的令牌桶"""
+        while True:
+            await asyncio.sleep(min(1.0, self.admission.window))
+            for row in self.admission.drain():
+                await self.queue.put((time.monotonic(), row, None, None))
+
+    async def _subscribe(self):
+        properties = Properties(PacketTypes.CONNECT)
+        properties.SessionExpiryInterval = config.MQTT_SESSION_EXPIRY
+        properties.ReceiveMaximum = config.MQTT_RECEIVE_MAXIMUM
+        delay = config.MQTT_RECONNECT_MIN
+        while True:
+            try:
+                async with aiomqtt.Client(self.broker, self.port, identifier=self.client_id,
+                                          protocol=aiomqtt.ProtocolVersion.V5,
+                                          clean_start=False, properties=properties,
+                                          keepalive=60) as client:
+                    for topic in [self.topic] if isinstance(self.topic, str) else self.topic:
+                        await client.subscribe(topic, qos=1)
+                    logging.info(f"Connected to MQTT Broker! 订阅 {self.topic}")
+                    delay = config.MQTT_RECONNECT_MIN
+                    async for message in client.messages:
+                        self.received += 1
+                        metrics.MQTT_RECEIVED.inc()
+                        profiler.tick("ingest")
+                        try:
+                            if aggregates.is_summary_topic(message.topic.value):
+                                await self.handle_summary(message.payload)
+                            else:
+                                await self.handle_payload(message.payload)
+                        except (ValueError, TypeError) as e:
+                            metrics.DECODE_ERRORS.inc()
+                            logging.error(f"消息处理失败: {e}")
+            except aiomqtt.MqttError as e:
+                wait = delay * random.uniform(1, 2)
+                logging.warning(f"连接断开: {e}，{wait:.1f} 秒后重连...")
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, config.MQTT_RECONNECT_MAX)
+
+    async def run(self):
+        self.pool = await asyncpg.create_pool(self.db_url, min_size=config.ASYNC_WRITERS,
+                                              max_size=config.ASYNC_WRITERS)
+        try:
+            await self._replay_spill()
+            await self._replay_summaries()
+            writers = [asyncio.create_task(self._writer()) for _ in range(config.ASYNC_WRITERS)]
+            if self.admission.enabled:
+                writers.append(asyncio.create_task(self._drain_admission()))
+            await asyncio.gather(self._subscribe(), *writers)
+        finally:
+            await self.pool.close()
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "queued": self.queue.qsize(),
+            "inserted": self.inserted,
+            "retried": self.retried,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "summary_rows": self.summary_rows,
+            "summaries_spilled": self.summaries_spilled,
+            "dedup": self.dedup_cache.stats(),
+            "admission": self.admission.stats(),
+        }
+
+
+def _summary_rows(data):
+    return [(sid, zone, datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end), *rest)
+            for sid, zone, start, end, *rest in aggregates.summary_rows(data)]
+
+
+def listening(client_id=CLIENT_ID, topic=TOPIC, metrics_port=None):
+    """与 listen.listening 对应的入口，可直接作为线程目标使用"""
+    metrics.start_http_server(config.METRICS_PORT if metrics_port is None else metrics_port)
+    engine = AsyncIngest(client_id=client_id, topic=topic)
+    if config.ALERTS_ENABLED:
+        alert_monitor.start()
+    metrics.register_stats("ingest_async", engine.stats)
+    asyncio.run(engine.run())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    try:
+        listening()
+    except KeyboardInterrupt:
+        print("程序被用户中断")
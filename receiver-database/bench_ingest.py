@@ -0,0 +1,110 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import threading
+import time
+import paho.mqtt.client as mqtt
+import psycopg2
+from config import config
+
+# 入库引擎基准测试：对比 threaded（listen）与 async（async_ingest）两条路径。
+# 在本进程内启动被测引擎，另起一个子进程向 broker 以 QoS 1 发布 N 条带唯一时间戳的读数，
+# 轮询数据库直到全部落库，统计端到端吞吐以及本进程消耗的 CPU 时间（每核心吞吐）。
+# 发布端在子进程中运行，其 CPU 开销不计入被测引擎。
+#
+# 用法示例（本地 broker 与数据库）：
+#   MQTT_BROKER=localhost DB_HOST=localhost python bench_ingest.py --engine async -n 50000
+
+BENCH_SENSOR_ID = 90000   # 专用传感器编号，避免与真实数据混淆
+BENCH_TOPIC = "greenhouse/bench"
+
+
+def publish_readings(count, broker, port):
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+    client.max_queued_messages_set(0)
+    client.connect(broker, port)
+    client.loop_start()
+    base = datetime.datetime(2000, 1, 1)
+    last = None
+    for i in range(count):
+        record = {
+            "sensor_id": BENCH_SENSOR_ID,
+            "timestamp": (base + datetime.timedelta(milliseconds=i)).isoformat(),
+            "temperature": 25.0,
+            "humidity": 60.0,
+            "soil_moisture": 500,
+            "is_anomaly": False,
+        }
+        last = client.publish(BENCH_TOPIC, json.dumps(record), qos=1)
+    last.wait_for_publish(timeout=60)
+    client.loop_stop()
+    client.disconnect()
+
+
+def count_rows(cur):
+    cur.execute("SELECT COUNT(*) FROM rawdata_from_sensors WHERE sensor_id = %s", (BENCH_SENSOR_ID,))
+    return cur.fetchone()[0]
+
+
+def start_engine(engine):
+    if engine == "async":
+        import async_ingest
+        target = async_ingest.listening
+        kwargs = {"client_id": "bench-async"}
+    else:
+        import listen
+        target = listen.listening
+        kwargs = {"client_id": "bench-threaded"}
+    threading.Thread(target=target, kwargs=kwargs, daemon=True).start()
+
+
+def run(engine, count, timeout):
+    conn = psycopg2.connect(config.DB_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("DELETE FROM rawdata_from_sensors WHERE sensor_id = %s", (BENCH_SENSOR_ID,))
+
+    start_engine(engine)
+    time.sleep(2)  # 等待引擎连上 broker 并完成订阅
+
+    publisher = multiprocessing.Process(target=publish_readings,
+                                        args=(count, config.MQTT_BROKER, config.MQTT_PORT))
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    publisher.start()
+
+    done = 0
+    while done < count and time.perf_counter() - wall_start < timeout:
+        time.sleep(0.2)
+        done = count_rows(cur)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    publisher.join()
+
+    cur.execute("DELETE FROM rawdata_from_sensors WHERE sensor_id = %s", (BENCH_SENSOR_ID,))
+    cur.close()
+    conn.close()
+
+    return {
+        "engine": engine,
+        "messages": count,
+        "ingested": done,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "msgs_per_s": round(done / wall, 1),
+        "msgs_per_cpu_s": round(done / cpu, 1) if cpu > 0 else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="入库引擎基准测试（需要可用的 broker 与数据库）")
+    parser.add_argument("--engine", "-e", choices=["threaded", "async"], default="async")
+    parser.add_argument("--count", "-n", type=int, default=20000, help="发布的消息条数")
+    parser.add_argument("--timeout", type=float, default=300, help="等待全部落库的最长时间（秒）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(json.dumps(run(args.engine, args.count, args.timeout), indent=2))
@@ -1,8 +1,16 @@
+import datetime
 import psycopg2
 from config import config
+import storage
+import querylayer
+
+# 下面的固定查询经 querylayer 执行：每个连接上只 PREPARE 一次，之后 EXECUTE（见 querylayer.py）。
+# 按天过滤写成半开区间 time_stamp >= 当天 AND time_stamp < 次日，(sensor_id, time_stamp) 索引可用；
+# 与 DATE(time_stamp) = 当天 结果相同。
+DAY_TYPES = {"day": "date", "sid": "int"}
 
 def calc_avg(cur):
-    cur.execute("""
+    querylayer.execute(cur, "calc_avg", """
         SELECT sensor_id, AVG(temperature) AS avg_temp, AVG(humidity) AS avg_humidity, AVG(soil_moisture) AS avg_soil_moisture
         FROM rawdata_from_sensors
         GROUP BY sensor_id
@@ -15,11 +23,11 @@ def calc_avg(cur):
 # This script calculates the average temperature, humidity and soil moisture from sensor data in entire duration.
 
 def calc_avg_day_sensor(cur, date, sensor_id):
-    cur.execute("""
+    querylayer.execute(cur, "calc_avg_day_sensor", """
         SELECT AVG(temperature) AS avg_temp, AVG(humidity) AS avg_humidity, AVG(soil_moisture) AS avg_soil_moisture
         FROM rawdata_from_sensors
-        WHERE DATE(time_stamp) = %s AND sensor_id = %s;
-    """, (date, sensor_id))
+        WHERE sensor_id = %(sid)s AND time_stamp >= %(day)s AND time_stamp < %(day)s::date + 1;
+    """, {"day": date, "sid": sensor_id}, DAY_TYPES)
     result = cur.fetchone()
     if result and all(val is not None for val in result):
         avg_temp, avg_humidity, avg_soil_moisture = result
@@ -29,13 +37,13 @@ def calc_avg_day_sensor(cur, date, sensor_id):
 # This script calculates the average temperature, humidity and soil moisture for a specific sensor on a specific date.
 
 def calc_min_max_day_sensor(cur, date, sensor_id):
-    cur.execute("""
+    querylayer.execute(cur, "calc_min_max_day_sensor", """
         SELECT MIN(temperature) AS min_temp, MAX(temperature) AS max_temp,
                MIN(humidity) AS min_humidity, MAX(humidity) AS max_humidity,
                MIN(soil_moisture) AS min_soil_moisture, MAX(soil_moisture) AS max_soil_moisture
         FROM rawdata_from_sensors
-        WHERE DATE(time_stamp) = %s AND sensor_id = %s;
-    """, (date, sensor_id))
+        WHERE sensor_id = %(sid)s AND time_stamp >= %(day)s AND time_stamp < %(day)s::date + 1;
+    """, {"day": date, "sid": sensor_id}, DAY_TYPES)
     result = cur.fetchone()
     if result and all(val is not None for val in result):
         min_temp, max_temp, min_humidity, max_humidity, min_soil_moisture, max_soil_moisture = result
@@ -46,16 +54,26 @@ def calc_min_max_day_sensor(cur, date, sensor_id):
         print(f"No data found for (Date: {date}, Sensor: {sensor_id})")
 # This script calculates the minimum and maximum temperature, humidity and soil moisture for a specific sensor on a specific date.
 
-def stats(cur, date, sensor_id):
-    cur.execute("""
-        SELECT COUNT(*), AVG(temperature) AS avg_temp, AVG(humidity) AS avg_humidity, AVG(soil_moisture) AS avg_soil_moisture,
-            MIN(temperature) AS min_temp, MIN(humidity) AS min_humidity, MIN(soil_moisture) AS min_soil_moisture,
-            MAX(temperature) AS max_temp, MAX(humidity) AS max_humidity, MAX(soil_moisture) AS max_soil_moisture,
-            STDDEV(temperature) AS std_temp, STDDEV(humidity) AS std_humidity, STDDEV(soil_moisture) AS std_soil_moisture
-        FROM rawdata_from_sensors
-        WHERE DATE(time_stamp) = %s AND sensor_id = %s;
-    """, (date, sensor_id))
-    result = cur.fetchone()
+STATS_COLUMNS = """
+    COUNT(*), AVG(temperature) AS avg_temp, AVG(humidity) AS avg_humidity, AVG(soil_moisture) AS avg_soil_moisture,
+    MIN(temperature) AS min_temp, MIN(humidity) AS min_humidity, MIN(soil_moisture) AS min_soil_moisture,
+    MAX(temperature) AS max_temp, MAX(humidity) AS max_humidity, MAX(soil_moisture) AS max_soil_moisture,
+    STDDEV(temperature) AS std_temp, STDDEV(humidity) AS std_humidity, STDDEV(soil_moisture) AS std_soil_moisture
+"""
+STATS_SQL = f"""
+    SELECT {STATS_COLUMNS}
+    FROM rawdata_from_sensors
+    WHERE sensor_id = %s AND time_stamp >= %s AND time_stamp < %s::date + 1;
+"""
+# 同一天多个传感器合并为一条查询，首列为 sensor_id
+STATS_MANY_SQL = f"""
+    SELECT sensor_id, {STATS_COLUMNS}
+    FROM rawdata_from_sensors
+    WHERE sensor_id = ANY(%s) AND time_stamp >= %s AND time_stamp < %s::date + 1
+    GROUP BY sensor_id;
+"""
+
+def _print_stats(date, sensor_id, result):
     if result and all(val is not None for val in result):
         count, avg_temp, avg_humidity, avg_soil_moisture, min_temp, min_humidity, min_soil_moisture, \
         max_temp, max_humidity, max_soil_moisture, std_temp, std_humidity, std_soil_moisture = result
@@ -63,11 +81,134 @@ def stats(cur, date, sensor_id):
     else:
         print(f"No data found for (Date: {date}, Sensor: {sensor_id})")
 
+def stats(cur, date, sensor_id):
+    querylayer.execute(cur, "calc_stats", STATS_SQL, (sensor_id, date, date), ("int", "date", "date"))
+    _print_stats(date, sensor_id, cur.fetchone())
+
+def stats_sensors(cur, date, sensor_ids):
+    results = querylayer.execute_batch(
+        cur, "calc_stats", STATS_SQL, [(sid, date, date) for sid in sensor_ids], ("int", "date", "date"),
+        grouped=("calc_stats_many", STATS_MANY_SQL, 0, ("int[]", "date", "date")))
+    for sensor_id, rows in zip(sensor_ids, results):
+        _print_stats(date, sensor_id, rows[0] if rows else None)
+# Same output as stats() for several sensors on one date, fetched in one round trip instead of one query per sensor.
+
+# ─── 阶梯保持（LOCF）：发送端死区压缩后，没有新读数的时段沿用上一条读数，最多沿用 HOLD_MAX_S 秒 ───
+
+def time_weighted_stats(cur, sensor_id, start, end, hold_max_s=None):
+    hold = config.HOLD_MAX_S if hold_max_s is None else hold_max_s
+    querylayer.execute(cur, "calc_time_weighted", """
+        WITH pts AS (
+            (SELECT %(start)s::timestamp AS ts, time_stamp AS origin, temperature, humidity, soil_moisture
+             FROM rawdata_from_sensors
+             WHERE sensor_id = %(sid)s AND time_stamp < %(start)s
+               AND time_stamp >= %(start)s::timestamp - make_interval(secs => %(hold)s)
+             ORDER BY time_stamp DESC
+             LIMIT 1)
+            UNION ALL
+            SELECT time_stamp, time_stamp, temperature, humidity, soil_moisture
+            FROM rawdata_from_sensors
+            WHERE sensor_id = %(sid)s AND time_stamp >= %(start)s AND time_stamp < %(end)s
+        ), held AS (
+            SELECT temperature, humidity, soil_moisture,
+                   GREATEST(0, LEAST(
+                       EXTRACT(EPOCH FROM LEAD(ts, 1, LEAST(%(end)s::timestamp, LOCALTIMESTAMP)) OVER (ORDER BY ts) - ts),
+                       %(hold)s - EXTRACT(EPOCH FROM ts - origin)
+                   )) AS dur
+            FROM pts
+        )
+        SELECT SUM(dur),
+               SUM(temperature * dur) / NULLIF(SUM(dur), 0),
+               SUM(humidity * dur) / NULLIF(SUM(dur), 0),
+               SUM(soil_moisture * dur) / NULLIF(SUM(dur), 0)
+        FROM held;
+    """, {"sid": sensor_id, "start": start, "end": end, "hold": hold},
+        {"sid": "int", "start": "timestamp", "end": "timestamp", "hold": "float8"})
+    return cur.fetchone()
+# Time-weighted averages over [start, end): each reading counts for as long as it stayed valid, so
+# deadband-compressed series (few rows while stable, many while changing) are not biased towards changes.
+
+def calc_time_weighted_day_sensor(cur, date, sensor_id, hold_max_s=None):
+    day = datetime.date.fromisoformat(str(date))
+    covered, avg_temp, avg_humidity, avg_soil_moisture = time_weighted_stats(
+        cur, sensor_id, day, day + datetime.timedelta(days=1), hold_max_s)
+    if covered:
+        print(f"Date: {date}, Sensor: {sensor_id} | Covered: {covered / 3600:.2f} h | Time-weighted Avg Temperature: {avg_temp:.2f}, Avg Humidity: {avg_humidity:.2f}, Avg Soil Moisture: {avg_soil_moisture:.2f}")
+    else:
+        print(f"No data found for (Date: {date}, Sensor: {sensor_id})")
+
+def fetch_step_series(cur, sensor_id, start, end, step_seconds, hold_max_s=None):
+    hold = config.HOLD_MAX_S if hold_max_s is None else hold_max_s
+    querylayer.execute(cur, "calc_step_series", """
+        SELECT g.t, r.temperature, r.humidity, r.soil_moisture, r.is_anomaly, r.time_stamp
+        FROM generate_series(%(start)s::timestamp, %(end)s::timestamp, make_interval(secs => %(step)s)) AS g(t)
+        LEFT JOIN LATERAL (
+            SELECT temperature, humidity, soil_moisture, is_anomaly, time_stamp
+            FROM rawdata_from_sensors
+            WHERE sensor_id = %(sid)s AND time_stamp <= g.t
+              AND time_stamp > g.t - make_interval(secs => %(hold)s)
+            ORDER BY time_stamp DESC
+            LIMIT 1
+        ) r ON TRUE
+        ORDER BY g.t;
+    """, {"sid": sensor_id, "start": start, "end": end, "step": step_seconds, "hold": hold},
+        {"sid": "int", "start": "timestamp", "end": "timestamp", "step": "float8", "hold": "float8"})
+    return cur.fetchall()
+# Resamples one sensor onto a regular grid, holding the last reading at each point (NULL once it is older
+# than hold_max_s). The LATERAL lookup walks the (sensor_id, time_stamp) unique index backwards.
+
+def calc_aggregate_stats(cur, sensor_id, start, end):
+    querylayer.execute(cur, "calc_aggregate_stats", """
+        SELECT SUM(count), SUM(anomalies),
+               SUM(temp_sum) / SUM(count), MIN(temp_min), MAX(temp_max),
+               SQRT(GREATEST(0, (SUM(temp_sumsq) - SUM(temp_sum) ^ 2 / SUM(count)) / NULLIF(SUM(count) - 1, 0))),
+               SUM(hum_sum) / SUM(count), MIN(hum_min), MAX(hum_max),
+               SQRT(GREATEST(0, (SUM(hum_sumsq) - SUM(hum_sum) ^ 2 / SUM(count)) / NULLIF(SUM(count) - 1, 0))),
+               SUM(soil_sum) / SUM(count), MIN(soil_min), MAX(soil_max),
+               SQRT(GREATEST(0, (SUM(soil_sumsq) - SUM(soil_sum) ^ 2 / SUM(count)) / NULLIF(SUM(count) - 1, 0)))
+        FROM sensor_aggregates
+        WHERE sensor_id = %s AND window_start >= %s AND window_start < %s;
+    """, (sensor_id, start, end), ("int", "timestamp", "timestamp"))
+    result = cur.fetchone()
+    if result and result[0]:
+        count, anomalies, avg_t, min_t, max_t, std_t, avg_h, min_h, max_h, std_h, avg_s, min_s, max_s, std_s = result
+        print(f"Sensor: {sensor_id} [{start}, {end}) from window summaries \n Count: {count}, Anomalies: {anomalies} \n Temp) Avg: {avg_t:.2f}, Min: {min_t:.2f}, Max: {max_t:.2f}, StdDev: {std_t or 0:.2f} \n Humidity) Avg: {avg_h:.2f}, Min: {min_h:.2f}, Max: {max_h:.2f}, StdDev: {std_h or 0:.2f} \n Soil Moisture) Avg: {avg_s:.2f}, Min: {min_s:.2f}, Max: {max_s:.2f}, StdDev: {std_s or 0:.2f}")
+    else:
+        print(f"No window summaries found for (Sensor: {sensor_id}, [{start}, {end}))")
+# Same statistics as stats(), merged from the sender's window summaries (sensor_aggregates) instead of raw rows.
+
+# ─── 经由存储接口（storage.py）的统计，本地 SQLite 与 Postgres 都可用 ───
+
+def calc_avg_storage(store):
+    for sensor_id, count, avg_temp, _, _, _, avg_humidity, _, _, _, avg_soil_moisture, _, _, _ in store.aggregate():
+        print(f"Sensor: {sensor_id}, Avg Temperature: {avg_temp:.2f}, Avg Humidity: {avg_humidity:.2f}, Avg Soil Moisture: {avg_soil_moisture:.2f}")
+# Same output as calc_avg(), computed through the storage interface.
+
+def stats_storage(store, date, sensor_id):
+    day = datetime.date.fromisoformat(str(date))
+    result = store.aggregate([sensor_id], day, day + datetime.timedelta(days=1))
+    if result and all(val is not None for val in result[0]):
+        _, count, avg_temp, min_temp, max_temp, std_temp, avg_humidity, min_humidity, max_humidity, std_humidity, \
+        avg_soil_moisture, min_soil_moisture, max_soil_moisture, std_soil_moisture = result[0]
+        print(f"Date: {date}, Sensor: {sensor_id} \n Count: {count} \n Temp) Avg: {avg_temp:.2f}, Min: {min_temp:.2f}, Max: {max_temp:.2f}, StdDev: {std_temp:.2f} \n Humidity) Avg: {avg_humidity:.2f}, Min: {min_humidity:.2f}, Max: {max_humidity:.2f}, StdDev: {std_humidity:.2f} \n Soil Moisture) Avg: {avg_soil_moisture:.2f}, Min: {min_soil_moisture:.2f}, Max: {max_soil_moisture:.2f}, StdDev: {std_soil_moisture:.2f}")
+    else:
+        print(f"No data found for (Date: {date}, Sensor: {sensor_id})")
+# Same output as stats(); the day filter is a half-open time_stamp range, so the (sensor_id, time_stamp) index applies.
+
 def fetch_sensor_data(cur):
     cur.execute("SELECT * FROM rawdata_from_sensors;")
     return cur.fetchall()
 
 def main():
+    if storage.is_local():
+        store = storage.open_storage()
+        try:
+            calc_avg_storage(store)
+            print("---")
+            stats_storage(store, '2025-06-05', 3)
+        finally:
+            store.close()
+        return
     conn = psycopg2.connect(config.DB_URL)
     cur = conn.cursor()
     try:
@@ -76,6 +217,7 @@ def main():
         # calc_avg_day_sensor(cur, '2025-06-05', 1)
         # calc_min_max_day_sensor(cur, '2025-06-05', 1)
         stats(cur, '2025-06-05', 3)
+        # stats_sensors(cur, '2025-06-05', [1, 2, 3])
     finally:
         cur.close()
         conn.close()
@@ -12,6 +12,95 @@ class Config:
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "innovatinsa-piwio-5432")
 
+    # 入库去重与批量写入配置
+    DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "100000"))
+    WRITER_BATCH_SIZE = int(os.getenv("WRITER_BATCH_SIZE", "500"))
+    WRITER_FLUSH_INTERVAL = float(os.getenv("WRITER_FLUSH_INTERVAL", "0.5"))
+    WRITER_RETRIES = int(os.getenv("WRITER_RETRIES", "5"))  # 批量写入失败后重连重试的次数（指数退避）
+    WRITER_SPILL_DIR = os.getenv("WRITER_SPILL_DIR", "spill")  # 重试仍失败的批次落盘目录，之后自动重放；为空表示不落盘
+
+    # MQTT 与多进程入库配置
+    MQTT_BROKER = os.getenv("MQTT_BROKER", "test.mosquitto.org")
+    MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))  # >1 时启用共享订阅多进程入库
+    INGEST_SHARE_GROUP = os.getenv("INGEST_SHARE_GROUP", "ingest")
+    INGEST_ORDERED = os.getenv("INGEST_ORDERED", "0") == "1"  # 按分区主题订阅，保证单传感器有序
+
+    # MQTT 持久会话与重连退避
+    MQTT_SESSION_EXPIRY = int(os.getenv("MQTT_SESSION_EXPIRY", "3600"))  # 断线后 broker 保留会话的秒数
+    MQTT_RECEIVE_MAXIMUM = int(os.getenv("MQTT_RECEIVE_MAXIMUM", "1000"))  # 允许同时在途的 QoS 1 消息数
+    MQTT_RECONNECT_MIN = float(os.getenv("MQTT_RECONNECT_MIN", "1"))
+    MQTT_RECONNECT_MAX = int(os.getenv("MQTT_RECONNECT_MAX", "60"))
+
+    # 入库引擎：threaded（paho + psycopg2）、async（asyncio + asyncpg）或 both（两者共享订阅分摊消息）
+    INGEST_MODE = os.getenv("INGEST_MODE", "threaded")
+    ASYNC_WRITERS = int(os.getenv("ASYNC_WRITERS", "4"))  # 并发写入协程数 = 连接池大小
+
+    # 入库限流：每个传感器的令牌桶 + 全局令牌桶，超速策略 drop / sample / aggregate
+    # 默认关闭（回放 --speed 0、车队模拟高频发送都会超过单传感器限额），RATE_LIMIT=true 开启
+    RATE_LIMIT = os.getenv("RATE_LIMIT", "false").lower() in ("1", "true", "yes")
+    RATE_SENSOR_PER_S = float(os.getenv("RATE_SENSOR_PER_S", "1"))
+    RATE_SENSOR_BURST = float(os.getenv("RATE_SENSOR_BURST", "10"))
+    RATE_GLOBAL_PER_S = float(os.getenv("RATE_GLOBAL_PER_S", "20000"))
+    RATE_GLOBAL_BURST = float(os.getenv("RATE_GLOBAL_BURST", "40000"))
+    RATE_POLICY = os.getenv("RATE_POLICY", "drop")
+    RATE_SAMPLE_EVERY = int(os.getenv("RATE_SAMPLE_EVERY", "10"))
+    RATE_WINDOW = float(os.getenv("RATE_WINDOW", "10"))
+
+    # 指标与日志
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 入库进程 /metrics 端口，0 表示关闭；多进程时工作进程 i 使用 METRICS_PORT+1+i
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "1000"))  # 逐行日志每 N 条抽样 1 条
+    LAG_ALERT_S = float(os.getenv("LAG_ALERT_S", "30"))  # 端到端提交延迟 p95 超过该值视为入库落后
+
+    # 阶梯保持重建：发送端开启死区压缩后，一条读数最多被沿用多久（应大于发送端心跳间隔）
+    HOLD_MAX_S = float(os.getenv("HOLD_MAX_S", "900"))
+
+    # 跳变告警：入库时按阈值评估读数，只在越限打开/恢复关闭时写 alerts 表（默认阈值与发送端内置阈值一致）
+    # 告警写 Postgres：本地 SQLite 库（STORAGE_URL=sqlite://...）时默认关闭；多进程入库需 --ordered（见 alerts.py）
+    ALERTS_ENABLED = os.getenv("ALERTS_ENABLED", "false" if os.getenv("STORAGE_URL", "").startswith("sqlite://")
+                               else "true").lower() in ("1", "true", "yes")
+    ALERT_TEMP_MIN = float(os.getenv("ALERT_TEMP_MIN", "15"))
+    ALERT_TEMP_MAX = float(os.getenv("ALERT_TEMP_MAX", "30"))
+    ALERT_HUM_MIN = float(os.getenv("ALERT_HUM_MIN", "30"))
+    ALERT_HUM_MAX = float(os.getenv("ALERT_HUM_MAX", "80"))
+    ALERT_SOIL_MIN = float(os.getenv("ALERT_SOIL_MIN", "100"))
+    ALERT_SOIL_MAX = float(os.getenv("ALERT_SOIL_MAX", "700"))
+    ALERT_FLUSH_S = float(os.getenv("ALERT_FLUSH_S", "30"))  # 打开中告警的峰值回写间隔
+
+    # 运行时剖析（见 profiling.py）：PROFILE 为空时关闭，可选 cpu,sample,mem,timers 或 all
+    PROFILE = os.getenv("PROFILE", "")
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "60"))  # 定时写报告的间隔（秒），0 表示只在 SIGUSR1 时写
+    PROFILE_CPU_WINDOW = float(os.getenv("PROFILE_CPU_WINDOW", "10"))  # 每次 cProfile 剖析的秒数
+    PROFILE_SAMPLE_HZ = float(os.getenv("PROFILE_SAMPLE_HZ", "100"))  # 调用栈采样频率
+
+    # 列式冷归档（见 archive.py）
+    ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+    ARCHIVE_GROUP_SIZE = int(os.getenv("ARCHIVE_GROUP_SIZE", "100"))  # 每个目录包含的 sensor_id 区间大小
+    ARCHIVE_CHUNK_ROWS = int(os.getenv("ARCHIVE_CHUNK_ROWS", "65536"))  # 每块行数，块是读取与剪枝的最小单位
+    ARCHIVE_CODEC = os.getenv("ARCHIVE_CODEC", "zlib")  # zlib 或 none（不压缩，读取零拷贝）
+    ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "1"))  # 早于今天多少天的日期视为已结束
+
+    # API 响应格式与压缩（见 formats.py）
+    API_FETCH_ROWS = int(os.getenv("API_FETCH_ROWS", "10000"))  # 服务器端游标每次取的行数
+    API_COMPRESS_MIN_BYTES = int(os.getenv("API_COMPRESS_MIN_BYTES", "1024"))  # 小于该大小的非流式响应不压缩
+    API_GZIP_LEVEL = int(os.getenv("API_GZIP_LEVEL", "6"))
+    API_BROTLI_QUALITY = int(os.getenv("API_BROTLI_QUALITY", "5"))  # 需安装 brotli 包
+
+    # 读数存储（见 storage.py）：为空时使用下面的 Postgres（DB_URL）；sqlite:///edge.db 为本地嵌入式库（边缘节点 / 测试）
+    # 本地库模式下窗口汇总仍写 Postgres；告警默认关闭，显式设置 ALERTS_ENABLED=true 时同样写 Postgres
+    STORAGE_URL = os.getenv("STORAGE_URL", "")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # WAL 下 NORMAL 断电最多丢最后几个事务，FULL 每次提交都落盘
+    FORWARD_URL = os.getenv("FORWARD_URL", "")  # 本地库模式下转发的上游 Postgres 连接串，为空不转发
+    FORWARD_BATCH_ROWS = int(os.getenv("FORWARD_BATCH_ROWS", "5000"))
+    FORWARD_INTERVAL = float(os.getenv("FORWARD_INTERVAL", "5"))  # 没有积压时的转发间隔（秒）
+    FORWARD_RETAIN_HOURS = float(os.getenv("FORWARD_RETAIN_HOURS", "0"))  # 已转发的行在本地保留多久，0 表示一直保留
+
+    # 接收端固定 SQL 的服务器端预备语句（见 querylayer.py）；经 pgbouncer 事务级连接池连接时设为 false
+    DB_PREPARE = os.getenv("DB_PREPARE", "true").lower() in ("1", "true", "yes")
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # API 复用的数据库连接数上限，超出时临时新建连接
+
     # 连接字符串
     @property
     def DB_URL(self):
@@ -4,6 +4,21 @@ import psycopg2
 from psycopg2 import sql
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from config import config
+from aggregates import CREATE_TABLE_SQL as CREATE_AGGREGATES_SQL
+from alerts import CREATE_TABLE_SQL as CREATE_ALERTS_SQL
+
+# 发送端数据库规则来源（sersor-controller-sender/rules.py）读取的阈值列与 传感器 → 植物 对应表；
+# 列为 NULL 表示沿用默认阈值，只增加缺少的列，不改动已有数据
+RULES_SCHEMA_SQL = """
+    ALTER TABLE plants
+        ADD COLUMN IF NOT EXISTS temp_min DOUBLE PRECISION, ADD COLUMN IF NOT EXISTS temp_max DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS hum_min  DOUBLE PRECISION, ADD COLUMN IF NOT EXISTS hum_max  DOUBLE PRECISION,
+        ADD COLUMN IF NOT EXISTS soil_min DOUBLE PRECISION, ADD COLUMN IF NOT EXISTS soil_max DOUBLE PRECISION;
+    CREATE TABLE IF NOT EXISTS sensors (
+        sensor_id INTEGER PRIMARY KEY,
+        plant_id  INTEGER
+    );
+"""
 
 
 class DatabaseManager:
@@ -124,6 +139,86 @@ class DatabaseManager:
             if cursor:
                 cursor.close()
 
+    def ensure_constraints(self):
+        """确保 (sensor_id, time_stamp) 唯一，作为入库去重的兜底"""
+        cursor = None
+        try:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_rawdata_sensor_ts "
+                "ON rawdata_from_sensors (sensor_id, time_stamp)"
+            )
+            self.conn.commit()
+            return True
+        except Exception as e:
+            # 表中已有重复数据时建索引会失败，需先清理历史重复行
+            print(f"failed to create unique index: {e}")
+            if self.conn:
+                self.conn.rollback()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+
+    def ensure_aggregate_table(self):
+        """创建发送端预聚合窗口汇总表 sensor_aggregates（结构见 aggregates.py）"""
+        cursor = None
+        try:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            cursor = self.conn.cursor()
+            cursor.execute(CREATE_AGGREGATES_SQL)
+            self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"failed to create sensor_aggregates: {e}")
+            if self.conn:
+                self.conn.rollback()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+
+    def ensure_alert_table(self):
+        """创建跳变告警表 alerts 及其索引（结构见 alerts.py）"""
+        cursor = None
+        try:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            cursor = self.conn.cursor()
+            cursor.execute(CREATE_ALERTS_SQL)
+            self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"failed to create alerts: {e}")
+            if self.conn:
+                self.conn.rollback()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+
+    def ensure_rule_tables(self):
+        """补上发送端阈值规则用到的 plants 阈值列与 sensors 表（结构见 RULES_SCHEMA_SQL）"""
+        cursor = None
+        try:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            cursor = self.conn.cursor()
+            cursor.execute(RULES_SCHEMA_SQL)
+            self.conn.commit()
+            return True
+        except Exception as e:
+            print(f"failed to create rule columns: {e}")
+            if self.conn:
+                self.conn.rollback()
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+
     def initialize_database(self):
         """初始化数据库"""
         # 创建数据库
@@ -136,6 +231,10 @@ class DatabaseManager:
 
         # 检查表是否存在
         if self.check_tables():
+            self.ensure_constraints()
+            self.ensure_aggregate_table()
+            self.ensure_alert_table()
+            self.ensure_rule_tables()
             print("database initialized")
             return True
 
@@ -146,6 +245,10 @@ class DatabaseManager:
             # 执行初始化数据脚本
             #init_path = os.path.join(os.path.dirname(__file__), "..", "sql", "init.sql")
             #self.execute_sql_file(init_path)
+            self.ensure_constraints()
+            self.ensure_aggregate_table()
+            self.ensure_alert_table()
+            self.ensure_rule_tables()
             print("initializing success!")
             return True
 
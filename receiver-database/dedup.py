@@ -0,0 +1,48 @@
+import threading
+from collections import OrderedDict
+
+
+class RecentKeyCache:
+    """最近出现过的 (sensor_id, timestamp) 键的有界 LRU 缓存，用于入库前快速去重"""
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0     # 命中次数（判定为重复）
+        self.misses = 0   # 未命中次数（首次出现）
+
+    def seen(self, key, record=True):
+        """key 最近出现过则返回 True（重复消息）；否则（record=True 时）记录下来并返回 False。
+        record=False 只做判断，写入成功后再用 mark() 记录"""
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            if record:
+                self._add(key)
+            return False
+
+    def mark(self, keys):
+        """记录已写入的键"""
+        with self._lock:
+            for key in keys:
+                self._add(key)
+
+    def _add(self, key):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        if len(self._keys) > self.max_size:
+            # 淘汰最久未出现的键
+            self._keys.popitem(last=False)
+
+    def forget(self, keys):
+        """移除这些键（写入最终失败时调用），broker 重投的同一条读数可以再次入库"""
+        with self._lock:
+            for key in keys:
+                self._keys.pop(key, None)
+
+    def stats(self):
+        return {"size": len(self._keys), "hits": self.hits, "misses": self.misses}
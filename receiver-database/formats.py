@@ -0,0 +1,236 @@
+import datetime
+import io
+import json
+import zlib
+import numpy as np
+from flask import Response
+from config import config
+
+# API 响应的格式协商与压缩（/sensor-data 使用）。
+#
+# 格式（?format= 优先，其次按 Accept 头协商）：
+#   json      application/json                       每行一个对象的数组（默认，与旧版输出一致）
+#   columnar  application/vnd.sensor-data.columnar+json
+#             {"columns": [...], "count": n, "data": {"列名": [...], ...}}，每列一个数组，图表客户端直接使用
+#   ndjson    application/x-ndjson                   第一行 {"columns": [...]}，之后每行一个值数组，边查边发
+#   npy       application/x-npy                      NumPy .npy 结构化数组（np.load 直接读取），time_stamp 为 datetime64[us]，缺失读数为 NaN
+# columnar / ndjson 中的时间为 ISO 8601 字符串。
+#
+# 压缩：按 Accept-Encoding 选择 br（需安装 brotli 包，未安装时忽略）或 gzip；流式响应边生成边压缩。
+# 非流式响应（包括其它路由）由 compress_response 在 after_request 中压缩，小于 API_COMPRESS_MIN_BYTES 的不压缩。
+#
+# 新格式使用服务器端游标（命名游标）每次取 API_FETCH_ROWS 行，行元组直接序列化，不构造逐行字典。
+
+FORMATS = {
+    "json": "application/json",
+    "columnar": "application/vnd.sensor-data.columnar+json",
+    "ndjson": "application/x-ndjson",
+    "npy": "application/x-npy",
+}
+RESPONSE_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "ndjson": "application/x-ndjson",
+    "npy": "application/x-npy",
+}
+
+# npy 格式的列类型，与 archive.COLUMNS 一致
+NPY_DTYPE = np.dtype([
+    ("sensor_id", "<i4"),
+    ("time_stamp", "<M8[us]"),
+    ("temperature", "<f8"),
+    ("humidity", "<f8"),
+    ("soil_moisture", "<f8"),
+    ("is_anomaly", "u1"),
+])
+
+_brotli = None
+
+
+def _load_brotli():
+    """brotli 为可选依赖，第一次需要时才导入；未安装返回 None"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+
+# ─── 协商 ───────────────────────────────────────────────────────────────────
+
+def negotiate_format(request):
+    """返回格式名；?format= 取值未知时抛 ValueError"""
+    fmt = request.args.get("format")
+    if fmt is not None:
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+        return fmt
+    best = request.accept_mimetypes.best_match(list(FORMATS.values()), default=FORMATS["json"])
+    for name, mimetype in FORMATS.items():
+        if mimetype == best:
+            return name
+    return "json"
+
+
+def negotiate_encoding(request):
+    """返回 'br'、'gzip' 或 None（不压缩）"""
+    accepted = request.accept_encodings
+    if accepted["br"] and _load_brotli() is not None:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def _compressor(encoding):
+    if encoding == "br":
+        c = _load_brotli().Compressor(quality=config.API_BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(config.API_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 输出 gzip 格式
+    return c.compress, c.flush
+
+
+def compress_stream(chunks, encoding):
+    if encoding is None:
+        yield from chunks
+        return
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        out = compress(chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def compress_response(response, request):
+    """after_request 中调用：压缩已完整生成的响应体"""
+    if (response.is_streamed or response.direct_passthrough or response.status_code < 200
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < config.API_COMPRESS_MIN_BYTES:
+        return response
+    encoding = negotiate_encoding(request)
+    if encoding is None:
+        return response
+    compress, finish = _compressor(encoding)
+    response.set_data(compress(body) + finish())
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+# ─── 序列化（输入为 fetchmany 得到的行块）─────────────────────────────────────
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_json_default).encode
+
+
+def iter_ndjson(columns, blocks):
+    yield (_dumps({"columns": columns}) + "\n").encode("utf-8")
+    for rows in blocks:
+        # 行元组直接按数组序列化；NaN 不是合法 JSON，读数 NULL 本来就是 None
+        yield "".join([_dumps(row) + "\n" for row in rows]).encode("utf-8")
+
+
+def iter_columnar(columns, blocks):
+    data = [[] for _ in columns]
+    count = 0
+    for rows in blocks:
+        count += len(rows)
+        for values, col in zip(zip(*rows), data):
+            col.extend(values)
+    yield _dumps({"columns": columns, "count": count}).encode("utf-8")[:-1] + b',"data":{'
+    for i, (name, values) in enumerate(zip(columns, data)):
+        prefix = "," if i else ""
+        yield (prefix + _dumps(name) + ":" + _dumps(values)).encode("utf-8")
+        data[i] = None  # 已发送的列尽早释放
+    yield b"}}"
+
+
+def _to_structured(rows):
+    out = np.empty(len(rows), dtype=NPY_DTYPE)
+    for name, values in zip(NPY_DTYPE.names, zip(*rows)):
+        if name == "is_anomaly":
+            out[name] = [bool(a) for a in values]
+        else:
+            out[name] = np.array(values, dtype=NPY_DTYPE[name])  # None 转为 NaN / NaT
+    return out
+
+
+def iter_npy(blocks):
+    # .npy 头部需要总行数，先把每块转换为紧凑的结构化数组（每行 41 字节），最后写头部并逐块输出
+    arrays = [_to_structured(rows) for rows in blocks if rows]
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {
+        "descr": np.lib.format.dtype_to_descr(NPY_DTYPE),
+        "fortran_order": False,
+        "shape": (sum(len(a) for a in arrays),),
+    })
+    yield header.getvalue()
+    for arr in arrays:
+        yield arr.tobytes()
+
+
+# ─── 流式响应 ────────────────────────────────────────────────────────────────
+
+def _fetch_blocks(conn, sql, params, columns_out):
+    """命名游标分块读取；生成器结束或客户端断开时关闭游标与连接"""
+    cur = conn.cursor(name="api_export")
+    try:
+        cur.itersize = config.API_FETCH_ROWS
+        cur.execute(sql, params)
+        first = cur.fetchmany(config.API_FETCH_ROWS)
+        columns_out.extend(desc[0] for desc in cur.description)
+        yield first
+        while True:
+            rows = cur.fetchmany(config.API_FETCH_ROWS)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cur.close()
+        conn.rollback()
+        conn.close()
+
+
+def stream_query(conn, sql, params, fmt, encoding):
+    """把查询结果按 fmt 流式输出为 Response（fmt 为 columnar / ndjson / npy）"""
+    columns = []
+    return stream_blocks(columns, _fetch_blocks(conn, sql, params, columns), fmt, encoding)
+
+
+def stream_blocks(columns, blocks, fmt, encoding):
+    """blocks 为行块生成器（如 storage.scan()）；columns 可以在取到第一块后才填充"""
+    # 先取第一块：查询出错时在返回响应前抛出，由调用方返回 500 而不是半截的 200
+    first = next(blocks, [])
+
+    def all_blocks():
+        yield first
+        yield from blocks
+
+    if fmt == "ndjson":
+        body = iter_ndjson(columns, all_blocks())
+    elif fmt == "columnar":
+        body = iter_columnar(columns, all_blocks())
+    else:
+        body = iter_npy(all_blocks())
+
+    response = Response(compress_stream(body, encoding), mimetype=RESPONSE_TYPES[fmt])
+    response.vary.add("Accept")
+    response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.call_on_close(blocks.close)
+    if fmt == "npy":
+        response.headers["Content-Disposition"] = "attachment; filename=sensor-data.npy"
+    return response
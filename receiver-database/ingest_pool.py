@@ -0,0 +1,130 @@
+import argparse
+import logging
+import multiprocessing
+import time
+import listen
+import aggregates
+from config import config
+from lag import lag_tracker
+from profiling import profiler
+
+# 多进程入库：N 个工作进程各自用唯一的 client_id 连接 broker，
+# 通过 MQTT v5 共享订阅 $share/<group>/greenhouse/# 由 broker 在组内分发消息，
+# 每个进程有自己的去重缓存、写入线程和数据库连接，因此吞吐随进程数扩展。
+#
+# 有序模式（ordered=True）：发送端按 sensor_id % workers 把读数发到 greenhouse/<name>/<分区号>，
+# 第 i 个进程独占分区 i（每个分区单独一个共享组），同一传感器的消息只会进入同一个进程，
+# 而进程内的写入线程按队列顺序落库，从而保证单传感器有序。
+# 分区主题收不到窗口汇总（<主题前缀>/summary），所有进程另外加入共享组 <group>-summary 订阅汇总主题，
+# 每条汇总只由其中一个进程写入。
+
+RESTART_BACKOFF_MAX = 60   # 连续崩溃时的最大重启间隔（秒）
+STABLE_UPTIME = 30         # 运行超过该时间视为稳定，重置退避
+
+
+def worker_client_id(group, index):
+    return f"{listen.CLIENT_ID}-{group}-{index}"
+
+
+def worker_topic(group, index, ordered=False):
+    if ordered:
+        return [f"$share/{group}-p{index}/greenhouse/+/{index}",
+                f"$share/{group}-summary/{aggregates.SUMMARY_TOPIC}"]
+    return f"$share/{group}/{listen.TOPIC}"
+
+
+def _worker_main(group, index, ordered, broker, port):
+    listen.MQTT_BROKER = broker
+    listen.MQTT_PORT = port
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format=f'%(asctime)s - ingest-{index} - %(levelname)s - %(message)s'
+    )
+    profiler.start_from_config(config, name=f"ingest-{index}")
+    if not ordered:
+        lag_tracker.disable_gap_detection("无序共享订阅：同一传感器的消息分散在多个入库进程")
+        if config.ALERTS_ENABLED:
+            # 告警状态在进程内，需要同一传感器的读数都进入同一个进程
+            logging.warning("无序共享订阅下关闭跳变告警，需要告警请使用 --ordered")
+            config.ALERTS_ENABLED = False
+    try:
+        listen.listening(client_id=worker_client_id(group, index),
+                         topic=worker_topic(group, index, ordered),
+                         metrics_port=config.METRICS_PORT + 1 + index if config.METRICS_PORT else 0)
+    except KeyboardInterrupt:
+        pass
+
+
+def supervise(workers=None, group=None, ordered=None, broker=None, port=None):
+    """启动 workers 个入库进程并守护它们，进程退出后按指数退避重启"""
+    workers = workers or config.INGEST_WORKERS
+    broker = broker or listen.MQTT_BROKER
+    port = port or listen.MQTT_PORT
+    group = group or config.INGEST_SHARE_GROUP
+    ordered = config.INGEST_ORDERED if ordered is None else ordered
+
+    procs = {}
+    started_at = {}
+    failures = {i: 0 for i in range(workers)}
+    restart_at = {}
+
+    def spawn(i):
+        p = multiprocessing.Process(target=_worker_main, args=(group, i, ordered, broker, port),
+                                    name=f"ingest-{i}")
+        p.start()
+        procs[i] = p
+        started_at[i] = time.monotonic()
+        logging.info(f"入库进程 ingest-{i} 已启动 (pid={p.pid})")
+
+    for i in range(workers):
+        spawn(i)
+
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for i, p in procs.items():
+                if p.is_alive() or i in restart_at:
+                    continue
+                if now - started_at[i] >= STABLE_UPTIME:
+                    failures[i] = 0
+                delay = min(2 ** failures[i], RESTART_BACKOFF_MAX)
+                failures[i] += 1
+                restart_at[i] = now + delay
+                logging.warning(f"入库进程 ingest-{i} 退出 (exitcode={p.exitcode})，{delay} 秒后重启")
+            for i, at in list(restart_at.items()):
+                if now >= at:
+                    del restart_at[i]
+                    spawn(i)
+    except KeyboardInterrupt:
+        logging.info("停止所有入库进程...")
+    finally:
+        for p in procs.values():
+            if p.is_alive():
+                p.terminate()
+        for p in procs.values():
+            p.join(timeout=5)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="多进程 MQTT 共享订阅入库")
+    parser.add_argument("--workers", "-w", type=int, default=config.INGEST_WORKERS,
+                        help="入库进程数")
+    parser.add_argument("--group", "-g", type=str, default=config.INGEST_SHARE_GROUP,
+                        help="共享订阅组名")
+    parser.add_argument("--ordered", action="store_true", default=config.INGEST_ORDERED,
+                        help="按分区主题订阅，保证单传感器有序（发送端需使用相同分区数）")
+    parser.add_argument("--broker", "-b", type=str, default=None,
+                        help="MQTT Broker 地址（本地测试可用 localhost）")
+    parser.add_argument("--port", "-p", type=int, default=None,
+                        help="MQTT Broker 端口")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    args = parse_args()
+    supervise(args.workers, args.group, args.ordered, args.broker, args.port)
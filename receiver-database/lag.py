@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from collections import deque
+from config import config
+import metrics
+
+# 端到端延迟与丢包跟踪：
+#   发送端为每条读数附带 seq（按传感器递增）与 publish_ts（发送时刻，Unix 秒）；
+#   接收端记录收到时刻与提交到数据库的时刻，计算 receive_lag / commit_lag，
+#   并根据 seq 的跳变统计每个传感器的缺口（可能丢失的条数）与乱序/重复。
+# 延迟依赖发送端与接收端时钟同步（NTP），跨机器时会包含时钟偏差。
+# 缺口统计要求本进程收到该传感器的全部消息：无序的共享订阅（多进程入库未加 --ordered，或 INGEST_MODE=both）
+# 会把同一传感器的消息分到多个进程/引擎，各自看到的序号都有跳变，此时关闭缺口统计，/lag 中相应字段为 null。
+
+E2E_RECEIVE_LAG = metrics.Histogram("ingest_e2e_receive_lag_seconds", "Publish to receive latency")
+E2E_COMMIT_LAG = metrics.Histogram("ingest_e2e_commit_lag_seconds", "Publish to database commit latency")
+
+
+def _percentiles(values, qs=(50, 90, 95, 99)):
+    if not values:
+        return {f"p{q}": None for q in qs}
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    return {f"p{q}": round(ordered[min(last, int(round(q / 100 * last)))], 4) for q in qs}
+
+
+class _SensorState:
+    __slots__ = ("last_seq", "received", "gaps", "lost", "out_of_order",
+                 "restarts", "last_lag", "max_lag", "recent_lags")
+
+    def __init__(self):
+        self.last_seq = None
+        self.received = 0
+        self.gaps = 0           # 出现序号跳变的次数
+        self.lost = 0           # 跳过的序号总数（可能丢失的条数）
+        self.out_of_order = 0   # 序号回退（乱序或重投）
+        self.restarts = 0       # 序号回到 1，视为发送端重启
+        self.last_lag = None
+        self.max_lag = 0.0
+        self.recent_lags = deque(maxlen=256)
+
+
+class LagTracker:
+    def __init__(self, window=10000):
+        self.gap_detection = True
+        self.gap_detection_off_reason = None
+        self._sensors = {}
+        self._receive_lags = deque(maxlen=window)
+        self._commit_lags = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def disable_gap_detection(self, reason):
+        self.gap_detection = False
+        self.gap_detection_off_reason = reason
+
+    def observe_receive(self, sensor_id, seq, publish_ts, recv_ts=None):
+        recv_ts = time.time() if recv_ts is None else recv_ts
+        with self._lock:
+            state = self._sensors.get(sensor_id)
+            if state is None:
+                state = self._sensors[sensor_id] = _SensorState()
+            state.received += 1
+            if seq is not None and self.gap_detection:
+                last = state.last_seq
+                if last is None or seq == last + 1:
+                    state.last_seq = seq
+                elif seq == 1:
+                    state.restarts += 1
+                    state.last_seq = seq
+                elif seq > last + 1:
+                    state.gaps += 1
+                    state.lost += seq - last - 1
+                    state.last_seq = seq
+                else:
+                    # 重复消息已在去重阶段过滤，序号回退说明是迟到的消息，之前按丢失计入的要扣回
+                    state.out_of_order += 1
+                    state.lost = max(0, state.lost - 1)
+            if publish_ts is not None:
+                lag = recv_ts - publish_ts
+                self._receive_lags.append(lag)
+                E2E_RECEIVE_LAG.observe(lag)
+
+    def observe_commit(self, sensor_id, publish_ts, commit_ts):
+        lag = commit_ts - publish_ts
+        with self._lock:
+            self._commit_lags.append(lag)
+            state = self._sensors.get(sensor_id)
+            if state is not None:
+                state.last_lag = lag
+                state.max_lag = max(state.max_lag, lag)
+                state.recent_lags.append(lag)
+        E2E_COMMIT_LAG.observe(lag)
+
+    def summary(self):
+        """全局延迟分位数 + 丢包汇总；commit_lag p95 超过 LAG_ALERT_S 时 behind 为 True"""
+        with self._lock:
+            commit = _percentiles(self._commit_lags)
+            receive = _percentiles(self._receive_lags)
+            lost = sum(s.lost for s in self._sensors.values())
+            received = sum(s.received for s in self._sensors.values())
+            sensors_with_gaps = sum(1 for s in self._sensors.values() if s.gaps)
+        p95 = commit["p95"]
+        if not self.gap_detection:
+            lost = sensors_with_gaps = None
+        return {
+            "behind": p95 is not None and p95 > config.LAG_ALERT_S,
+            "alert_threshold_s": config.LAG_ALERT_S,
+            "receive_lag_s": receive,
+            "commit_lag_s": commit,
+            "sensors": len(self._sensors),
+            "received": received,
+            "lost": lost,
+            "loss_ratio": None if lost is None else (round(lost / (received + lost), 6) if received + lost else 0.0),
+            "sensors_with_gaps": sensors_with_gaps,
+            "gap_detection": self.gap_detection,
+            "gap_detection_off_reason": self.gap_detection_off_reason,
+        }
+
+    def per_sensor(self):
+        gaps = self.gap_detection
+        with self._lock:
+            return {
+                sensor_id: {
+                    "last_seq": s.last_seq if gaps else None,
+                    "received": s.received,
+                    "gaps": s.gaps if gaps else None,
+                    "lost": s.lost if gaps else None,
+                    "out_of_order": s.out_of_order if gaps else None,
+                    "restarts": s.restarts if gaps else None,
+                    "last_commit_lag_s": None if s.last_lag is None else round(s.last_lag, 4),
+                    "max_commit_lag_s": round(s.max_lag, 4),
+                    "commit_lag_s": _percentiles(s.recent_lags),
+                }
+                for sensor_id, s in self._sensors.items()
+            }
+
+
+# 进程内共享的跟踪器
+lag_tracker = LagTracker()
+
+
+def _lag_route():
+    body = {"summary": lag_tracker.summary(), "sensors": lag_tracker.per_sensor()}
+    return "application/json", json.dumps(body)
+
+
+# 入库进程的指标服务上提供 GET /lag，便于在入库落后时告警
+metrics.register_route("/lag", _lag_route)
+metrics.register_stats("ingest_lag", lag_tracker.summary)
@@ -1,38 +1,89 @@
+import functools
 import os
+import random
+import threading
 import paho.mqtt.client as mqtt
-import psycopg2
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import json
 import time
 import logging
 from dotenv import load_dotenv
+from config import config
+from dedup import RecentKeyCache
+from writer import BatchWriter
+import ratelimit
+import metrics
+from lag import lag_tracker
+from aggregates import AggregateWriter, is_summary_topic
+from alerts import alert_monitor
+from profiling import profiler
+import storage
 
 # MQTT配置
-MQTT_BROKER = "test.mosquitto.org"
-MQTT_PORT = 1883
+MQTT_BROKER = config.MQTT_BROKER
+MQTT_PORT = config.MQTT_PORT
 TOPIC = "greenhouse/#"
 CLIENT_ID = "mqtt-listener"
 
-# MySQL配置 - 确保这些变量正确设置
-DB_HOST = "innovatinsa.piwio.fr"
-DB_PORT = 5432
-DB_NAME = "group02"  # 这里需要填写实际的数据库名称
-DB_USER = "postgres"
-DB_PASSWORD = "innovatinsa-piwio-5432"
 load_dotenv()  # 确保.env文件中有正确的值
 
+# 最近消息键缓存（快速去重）与批量写入线程
+dedup_cache = RecentKeyCache(config.DEDUP_CACHE_SIZE)
+writer = BatchWriter(dedup=dedup_cache)  # 写入最终失败的行从去重缓存移除，重投时可再次入库
+aggregate_writer = AggregateWriter()  # 发送端预聚合的窗口汇总，直接写入 sensor_aggregates
+admission = ratelimit.from_config()  # 单传感器 + 全局限流，挡在写入线程之前
+STATS_LOG_INTERVAL = 60  # 秒
+_last_stats_log = time.monotonic()
+
+# 断线恢复统计（从断开到重新连上的耗时）
+reconnect_stats = {"disconnects": 0, "recoveries": 0,
+                   "last_recover_s": None, "max_recover_s": 0.0, "total_recover_s": 0.0}
+_disconnected_at = None
+
 
 def on_connect(client, userdata, flags, reason_code, properties):
     """修复：添加了 reason_code 和 properties 参数"""
+    global _disconnected_at
     if reason_code == 0:
-        print("Connected to MQTT Broker!")
-        client.subscribe(TOPIC)
+        if _disconnected_at is not None:
+            elapsed = time.monotonic() - _disconnected_at
+            _disconnected_at = None
+            reconnect_stats["recoveries"] += 1
+            reconnect_stats["last_recover_s"] = round(elapsed, 3)
+            reconnect_stats["max_recover_s"] = max(reconnect_stats["max_recover_s"], round(elapsed, 3))
+            reconnect_stats["total_recover_s"] += elapsed
+            logging.info(f"成功重连! 恢复耗时 {elapsed:.2f} 秒，会话保留: {flags.session_present}")
+        topics = userdata["topic"]
+        if isinstance(topics, str):
+            topics = [topics]
+        print(f"Connected to MQTT Broker! 订阅 {', '.join(topics)}")
+        # QoS 1 订阅：持久会话期间 broker 会为我们缓存断线时发布的消息
+        client.subscribe([(topic, 1) for topic in topics])
     else:
         print(f"Connection failed with code {reason_code}")
 
 
+def _ack_for(client, msg):
+    """QoS 1 手动确认：读数提交到数据库（或落盘到溢出文件）后才向 broker 确认，进程崩溃时未确认的消息会重投"""
+    qos = getattr(msg, "qos", 0)
+    if client is None or not qos:
+        return None
+    return functools.partial(client.ack, msg.mid, qos)
+
+
 def on_message(client, userdata, msg):
+    recv_ts = time.time()
+    metrics.MQTT_RECEIVED.inc()
+    profiler.tick("ingest")
+    ack = _ack_for(client, msg)
     try:
-        payload = json.loads(msg.payload.decode())
+        with metrics.DECODE_SECONDS.time(), profiler.stage("decode"):
+            payload = json.loads(msg.payload.decode())
+        if is_summary_topic(msg.topic):
+            aggregate_writer.submit(payload, ack)
+            ack = None  # 由汇总写入线程在提交或落盘后确认
+            return
         #id = payload.get("id")
         sensor_id = payload.get("sensor_id")
         #plant_id = payload.get("plant_id")
@@ -42,69 +93,95 @@ def on_message(client, userdata, msg):
         humidity = payload.get("humidity")
         soil_moisture = payload.get("soil_moisture")
         is_anomaly = payload.get("is_anomaly")
-
-        save_to_db(sensor_id, time_stamp,
-                   temperature, humidity, soil_moisture, is_anomaly)
+        if sensor_id is None or time_stamp is None:
+            # 两列都是 NOT NULL 且构成唯一键，缺失时在这里拒收，不进入写入批次
+            raise ValueError(f"读数缺少 sensor_id 或 timestamp: {payload}")
+
+        # QoS 1 重投、重连或回放会带来同一条读数，命中缓存则不再写库
+        publish_ts = payload.get("publish_ts")
+
+        if not dedup_cache.seen((sensor_id, time_stamp)):
+            lag_tracker.observe_receive(sensor_id, payload.get("seq"), publish_ts, recv_ts)
+            if config.ALERTS_ENABLED:
+                # 在限流之前评估，被限流丢弃或合并的读数同样参与告警状态跳变
+                with profiler.stage("alerts"):
+                    alert_monitor.observe(sensor_id, time_stamp, temperature, humidity, soil_moisture)
+            reading = (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+            with profiler.stage("admit_submit"):
+                for row in admission.admit(reading):
+                    if row is reading:
+                        writer.submit(row, publish_ts, ack)
+                        ack = None  # 由写入线程在提交后确认
+                    else:
+                        # 限流合并出的行不对应某一次发送，不参与端到端延迟统计
+                        writer.submit(row)
+        log_stats()
+    except ValueError as e:
+        metrics.DECODE_ERRORS.inc()
+        logging.error(f"消息处理失败: {e}")
     except Exception as e:
         logging.error(f"消息处理失败: {e}")
+    finally:
+        # 重复、被限流丢弃与无法解析的消息处理完即确认
+        if ack is not None:
+            ack()
 
 
-def save_to_db(sensor_id, time_stamp,
-               temperature, humidity, soil_moisture, is_anomaly):
-    db = None
-    try:
-        if not DB_NAME:
-            raise ValueError("数据库名称未配置")
-
-        db = psycopg2.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            port=DB_PORT
-        )
-        cursor = db.cursor()
-        # 不插入 id，让数据库自增
-        sql = """
-            INSERT INTO rawdata_from_sensors
-            (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """
-        cursor.execute(sql, (sensor_id, time_stamp,
-                             temperature, humidity, soil_moisture, is_anomaly))
-        new_id = cursor.fetchone()[0]
-        db.commit()
-        print(f"插入成功，生成的 id 为: {new_id}")
-    except psycopg2.Error as e:
-        logging.error(f"数据库错误: {e}")
-        if db:
-            db.rollback()
-    except Exception as e:
-        logging.error(f"保存到数据库失败: {e}")
-    finally:
-        if db:
-            db.close()
+def get_stats():
+    """去重缓存命中/未命中计数与写入计数"""
+    return {"dedup": dedup_cache.stats(), "writer": writer.stats(),
+            "admission": admission.stats(), "reconnect": dict(reconnect_stats),
+            "aggregates": aggregate_writer.stats()}
 
 
+def log_stats():
+    global _last_stats_log
+    now = time.monotonic()
+    if now - _last_stats_log >= STATS_LOG_INTERVAL:
+        _last_stats_log = now
+        logging.info(f"入库统计: {get_stats()}")
 
-def on_disconnect(client, userdata, flags, reason_code, properties):
-    """修复：添加了 reason_code 和 properties 参数"""
-    logging.warning(f"连接断开! 原因代码: {reason_code}. 尝试重连...")
-    reconnect_delay = 1
+
+metrics.register_stats("ingest", get_stats)
+
+
+def drain_admission():
+    """定时取出限流合并行（传感器安静下来后也按窗口写入），并清理空闲的令牌桶"""
     while True:
-        try:
-            client.reconnect()
-            print("成功重连!")
-            return
-        except Exception as e:
-            logging.error(f"重连失败: {e}")
-            time.sleep(min(reconnect_delay, 60))
-            reconnect_delay *= 2
+        time.sleep(min(1.0, admission.window))
+        for row in admission.drain():
+            writer.submit(row)
 
 
-def listening():
-    client = mqtt.Client(client_id=CLIENT_ID, callback_api_version=mqtt.CallbackAPIVersion.VERSION2)
+def on_disconnect(client, userdata, flags, reason_code, properties):
+    """只记录断线并设置退避，重连由 loop_forever 在网络线程外异步完成，不阻塞回调"""
+    global _disconnected_at
+    if _disconnected_at is None:
+        _disconnected_at = time.monotonic()
+        reconnect_stats["disconnects"] += 1
+    logging.warning(f"连接断开! 原因代码: {reason_code}. 尝试重连...")
+    # 每次断线随机抖动起始退避，避免多个入库进程同时重连造成风暴；之后由 paho 指数翻倍到上限
+    client.reconnect_delay_set(min_delay=config.MQTT_RECONNECT_MIN * random.uniform(1, 2),
+                               max_delay=config.MQTT_RECONNECT_MAX)
+
+
+def listening(client_id=CLIENT_ID, topic=TOPIC, metrics_port=None):
+    """client_id 在同一 broker 上必须唯一；topic 可以是 $share/<group>/... 共享订阅（需 MQTT v5），也可以是主题列表"""
+    metrics.start_http_server(config.METRICS_PORT if metrics_port is None else metrics_port)
+    if config.WRITER_SPILL_DIR:
+        # 按 client_id 区分溢出文件：多进程入库时工作进程重启后重放的是自己的文件
+        writer.spill_path = os.path.join(config.WRITER_SPILL_DIR, f"{client_id}.jsonl")
+        aggregate_writer.spill_path = os.path.join(config.WRITER_SPILL_DIR, f"{client_id}.summaries.jsonl")
+    writer.start()
+    aggregate_writer.start()
+    if admission.enabled:
+        threading.Thread(target=drain_admission, name="admission-drain", daemon=True).start()
+    if config.ALERTS_ENABLED:
+        alert_monitor.start()
+    client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5,
+                         userdata={"topic": topic},
+                         callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+                         manual_ack=True)
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
@@ -115,15 +192,26 @@ def listening():
     # 启用TLS（如果需要）
     # client.tls_set()
 
-    client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
-    client.loop_forever()
+    client.reconnect_delay_set(min_delay=config.MQTT_RECONNECT_MIN * random.uniform(1, 2),
+                               max_delay=config.MQTT_RECONNECT_MAX)
+
+    # 持久会话：clean_start=False + 会话过期时间，短暂断线期间的 QoS 1 消息由 broker 缓存，
+    # 重连后以突发方式补齐，而不是留下数据空洞
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = config.MQTT_SESSION_EXPIRY
+    properties.ReceiveMaximum = config.MQTT_RECEIVE_MAXIMUM
+    client.connect_async(MQTT_BROKER, MQTT_PORT, keepalive=60,
+                         clean_start=False, properties=properties)
+    client.loop_forever(retry_first_connection=True)
 
 
 if __name__ == "__main__":
     logging.basicConfig(
-        level=logging.INFO,
+        level=config.LOG_LEVEL,
         format='%(asctime)s - %(levelname)s - %(message)s'
     )
+    profiler.start_from_config(config, name="listen")
+    storage.start_forwarder()
     try:
         listening()
     except KeyboardInterrupt:
@@ -1,13 +1,41 @@
+import argparse
 import threading
 import listen
 import calc
+import ingest_pool
+from config import config
 
 from database import db_manager
+import storage
+from profiling import profiler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="接收端：入库 + 定时统计")
+    parser.add_argument("--profile", type=str, default=None,
+                        help="开启运行时剖析：cpu,sample,mem,timers 或 all（默认读取环境变量 PROFILE，空为关闭）")
+    parser.add_argument("--profile-dir", type=str, default=None,
+                        help="剖析报告目录（默认 PROFILE_DIR=profiles）")
+    parser.add_argument("--profile-interval", type=float, default=None,
+                        help="定时写剖析报告的间隔（秒，0 表示只在 SIGUSR1 时写；默认 PROFILE_INTERVAL=60）")
+    return parser.parse_args()
+
 
 def main():
+    args = parse_args()
     print("programme running...")
+    # 命令行参数写回 config：多进程入库时每个工作进程各自按 config.PROFILE_* 启动剖析，报告目录按进程名区分
+    for key, value in (("PROFILE", args.profile), ("PROFILE_DIR", args.profile_dir),
+                       ("PROFILE_INTERVAL", args.profile_interval)):
+        if value is not None:
+            setattr(config, key, value)
+    profiler.start_from_config(config, name="receiver")
     # 初始化数据库
-    if not db_manager.initialize_database():
+    if storage.is_local():
+        # 边缘节点：本地 SQLite 建表，新行由转发线程批量写到上游
+        storage.open_storage().close()
+        storage.start_forwarder()
+    elif not db_manager.initialize_database():
         print("❌ initializing failed, programme exits")
         return
 
@@ -15,8 +43,34 @@ def main():
     print("🖥️ 应用程序运"
           "行中...")
     # 你的业务逻辑代码
-    thread_listen = threading.Thread(target=listen.listening)
     thread_calc = threading.Thread(target=calc.main)
+    if config.INGEST_WORKERS > 1:
+        # 多进程共享订阅入库，由守护函数负责重启退出的工作进程；
+        # 守护函数在主线程运行，Ctrl+C 的 KeyboardInterrupt 才能到达它并结束所有工作进程
+        thread_calc.daemon = True  # 工作进程全部结束后不再等待统计线程，进程随之退出
+        thread_calc.start()
+        ingest_pool.supervise()
+        print("🛑 应用程序结束")
+        return
+    if config.INGEST_MODE in ("async", "both") and storage.is_local():
+        print("❌ INGEST_MODE=async/both 只支持 Postgres，本地存储（STORAGE_URL=sqlite://...）请使用 threaded")
+        return
+    if config.INGEST_MODE == "async":
+        import async_ingest  # 可选依赖 aiomqtt / asyncpg，仅在启用时导入
+        thread_listen = threading.Thread(target=async_ingest.listening)
+    elif config.INGEST_MODE == "both":
+        import async_ingest
+        from lag import lag_tracker
+        lag_tracker.disable_gap_detection("INGEST_MODE=both：同一传感器的消息分散在两个入库引擎")
+        # 两个引擎并行时加入同一个共享订阅组，由 broker 分摊消息，避免重复入库
+        shared_topic = f"$share/{config.INGEST_SHARE_GROUP}/{listen.TOPIC}"
+        thread_async = threading.Thread(target=async_ingest.listening,
+                                        kwargs={"topic": shared_topic})
+        thread_async.start()
+        thread_listen = threading.Thread(target=listen.listening,
+                                         kwargs={"topic": shared_topic})
+    else:
+        thread_listen = threading.Thread(target=listen.listening)
 
     thread_listen.start()
     thread_calc.start()
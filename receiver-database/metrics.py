@@ -0,0 +1,191 @@
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import config
+
+# 轻量级指标：计数器与直方图只做整数/浮点累加，不加锁（依赖 GIL，极少量竞争误差可接受），
+# 以 Prometheus 文本格式在 /metrics 导出。每个进程一份注册表，多进程入库时每个进程各开一个端口。
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_stats_sources = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labels, n=1):
+        self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist, labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}   # labels -> [各桶计数..., 超出最大桶的计数, 总和, 总数]
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def time(self, *labels):
+        """with hist.time(): ... 记录代码块耗时（秒）"""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, ("le", bound))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {series[-2]}")
+            lines.append(f"{self.name}_count{label_str} {series[-1]}")
+        return lines
+
+
+def register_stats(prefix, fn):
+    """把 stats() 风格的字典按数值字段导出为 <prefix>_<字段> 指标（嵌套字典逐层展开）"""
+    _stats_sources.append((prefix, fn))
+
+
+def _flatten(prefix, stats, lines):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            _flatten(name, value, lines)
+        elif isinstance(value, bool):
+            lines.append(f"{name} {int(value)}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"{name} {value}")
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for prefix, fn in _stats_sources:
+        try:
+            _flatten(prefix, fn(), lines)
+        except Exception as e:
+            logging.error(f"导出指标 {prefix} 失败: {e}")
+    return "\n".join(lines) + "\n"
+
+
+# ─── 入库与 API 公共指标 ──────────────────────────────────────────────────────
+MQTT_RECEIVED = Counter("ingest_mqtt_messages_total", "MQTT messages received")
+DECODE_ERRORS = Counter("ingest_decode_errors_total", "Messages that failed to decode")
+DECODE_SECONDS = Histogram("ingest_decode_seconds", "JSON decode time per message")
+QUEUE_WAIT_SECONDS = Histogram("ingest_queue_wait_seconds", "Time the oldest row of a batch waited in the writer queue")
+BATCH_ROWS = Histogram("ingest_batch_rows", "Rows per database batch",
+                       buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+DB_INSERT_SECONDS = Histogram("ingest_db_insert_seconds", "Batch INSERT execution time")
+DB_COMMIT_SECONDS = Histogram("ingest_db_commit_seconds", "Batch COMMIT time")
+WRITER_REJECTED = Counter("ingest_rejected_rows_total", "Rows rejected by the writer because of data errors")
+API_REQUESTS = Counter("api_requests_total", "API requests", ("endpoint", "status"))
+API_REQUEST_SECONDS = Histogram("api_request_seconds", "API request handling time", ("endpoint",))
+
+
+# ─── 抽样日志 ────────────────────────────────────────────────────────────────
+_log_counts = {}
+
+
+def log_sampled(key, level, msg, every=None):
+    """同一 key 的日志每 every 条只输出 1 条，避免逐行打印成为热点；级别未开启时几乎零开销"""
+    if not logging.getLogger().isEnabledFor(level):
+        return
+    every = every or config.LOG_SAMPLE_EVERY
+    n = _log_counts.get(key, 0) + 1
+    _log_counts[key] = n
+    if n % every == 1 or every == 1:
+        logging.log(level, f"{msg} (每 {every} 条抽样 1 条，累计 {n})")
+
+
+# ─── 独立进程的 /metrics HTTP 服务（入库进程使用；Flask API 自带 /metrics 路由）────────
+_routes = {"/metrics": lambda: (CONTENT_TYPE, render())}
+_server_started = False
+
+
+def register_route(path, fn):
+    """注册额外的只读端点，fn 返回 (content_type, body)"""
+    _routes[path] = fn
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        route = _routes.get(self.path.split("?", 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, body = route()
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port):
+    """在后台线程启动指标服务；同一进程只启动一次，port 为 0 表示不启用"""
+    global _server_started
+    if not port or _server_started:
+        return
+    server = ThreadingHTTPServer(("0.0.0.0", port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    _server_started = True
+    logging.info(f"指标服务已启动: http://0.0.0.0:{port}/metrics")
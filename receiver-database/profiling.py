@@ -0,0 +1,12 @@
+import os
+import sys
+
+# 剖析器与发送端共用一份实现（仓库根目录 common/profiling.py，说明见该文件），这里只负责导入。
+# 入库进程中被剖析的循环：ingest（MQTT 消息回调 / async 引擎的消息循环）与 writer（每批写库）；
+# 启动：profiler.start_from_config(config, name=...)，按 config.PROFILE_* 开启。
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)
+
+from common.profiling import MODES, Profiler, parse_modes, profiler  # noqa: E402,F401
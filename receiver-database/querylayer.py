@@ -0,0 +1,226 @@
+import contextlib
+import logging
+import re
+import threading
+import weakref
+import psycopg2
+import psycopg2.pool
+from config import config
+import metrics
+
+# 接收端固定 SQL 的执行层：同一条语句在每个连接上只 PREPARE 一次，之后用 EXECUTE 执行，
+# 服务器不再对每次调用重复解析与规划（规划器对前几次执行使用按参数的定制计划，之后可能切换为通用计划）。
+#
+# 调用方保留原来的 SQL 文本（%s 或 %(name)s 占位符），只是把 cur.execute(sql, params) 换成
+#     querylayer.execute(cur, "语句名", sql, params, types=("int", "date"))
+# 之后照常 cur.fetchone() / cur.fetchall()。types 为 PREPARE 的参数类型：按位置参数时为元组，
+# 命名参数时为 {参数名: 类型}；不给时由服务器推断。
+#
+# 预备语句只在连接存活期间有效，API 用 connection() 从连接池取连接，请求之间复用。
+#
+# 多组参数的独立查询（例如很多传感器的统计）用 execute_batch：
+#   - 连接是 psycopg 3 时在 pipeline 中连续发送，所有结果一次往返取回；
+#   - psycopg2 下提供了 grouped（同一查询的 sensor_id = ANY(...) 版本）时合并为一条语句，按首列拆分结果；
+#   - 否则逐条 EXECUTE（仍然省去解析与规划）。
+#
+# 每条语句的执行次数与耗时记录在 db_query_seconds{statement="..."}（/metrics 导出）。
+# 经 pgbouncer 等事务级连接池连接时服务器端预备语句不可用，设置 DB_PREPARE=false 退回普通查询。
+# 服务器端游标（DECLARE ... CURSOR）不能包装 EXECUTE，流式导出仍直接执行 SQL。
+
+QUERY_SECONDS = metrics.Histogram("db_query_seconds", "Receiver SQL execution time by statement", ("statement",))
+PREPARES = metrics.Counter("db_prepares_total", "Server-side PREPAREs issued", ("statement",))
+
+_PLACEHOLDER = re.compile(r"%%|%\((\w+)\)s|%s")
+_statements = {}
+_prepared = weakref.WeakKeyDictionary()   # 连接 -> 已在该连接上 PREPARE 的语句名
+_lock = threading.Lock()
+PREPARED_SQL = "SELECT name FROM pg_prepared_statements"
+
+
+class Statement:
+    def __init__(self, name, sql, types):
+        self.name = name
+        self.sql = sql
+        keys = []
+
+        def to_dollar(match):
+            if match.group(0) == "%%":
+                return "%"
+            key = match.group(1)
+            if key is None:
+                keys.append(len(keys))
+                return f"${len(keys)}"
+            if key not in keys:
+                keys.append(key)
+            return f"${keys.index(key) + 1}"
+
+        self.dollar_sql = _PLACEHOLDER.sub(to_dollar, sql.strip().rstrip(";"))
+        self.keys = keys
+        if isinstance(types, dict):
+            types = [types[k] for k in keys]
+        self.types = tuple(types or ())
+        if self.types and len(self.types) != len(keys):
+            raise ValueError(f"语句 {name} 有 {len(keys)} 个参数，但声明了 {len(self.types)} 个类型")
+        # 声明了类型时参数显式转换：psycopg2 把字符串和列表渲染为文本 / 数组字面量，EXECUTE 只做赋值转换
+        if self.types:
+            args = ", ".join(f"%s::{t}" for t in self.types)
+        else:
+            args = ", ".join(["%s"] * len(keys))
+        self.execute_sql = f"EXECUTE {name} ({args})" if keys else f"EXECUTE {name}"
+
+    def prepare_sql(self):
+        types = f" ({', '.join(self.types)})" if self.types else ""
+        return f"PREPARE {self.name}{types} AS {self.dollar_sql}"
+
+    def args(self, params):
+        if params is None:
+            return []
+        if isinstance(params, dict):
+            return [params[k] for k in self.keys]
+        return list(params)
+
+
+def statement(name, sql, types=None):
+    """登记一条语句（同名只登记一次）"""
+    stmt = _statements.get(name)
+    if stmt is None:
+        with _lock:
+            stmt = _statements.get(name)
+            if stmt is None:
+                stmt = _statements[name] = Statement(name, sql, types)
+    return stmt
+
+
+def _is_psycopg3(conn):
+    return type(conn).__module__.startswith("psycopg.")
+
+
+def _prepared_names(cur):
+    conn = cur.connection
+    names = _prepared.get(conn)
+    if names is None:
+        # 第一次使用该连接时读取已有的预备语句（例如连接被复用），避免重复 PREPARE 报错
+        cur.execute(PREPARED_SQL)
+        names = _prepared[conn] = {row[0] for row in cur.fetchall()}
+    return names
+
+
+def execute(cur, name, sql, params=None, types=None):
+    """以预备语句执行；执行后照常从 cur 取结果"""
+    stmt = statement(name, sql, types)
+    conn = cur.connection
+    if _is_psycopg3(conn):
+        # psycopg 3 自带按协议的预备语句
+        with QUERY_SECONDS.time(name):
+            cur.execute(sql, params, prepare=config.DB_PREPARE)
+        return cur
+    if not config.DB_PREPARE:
+        with QUERY_SECONDS.time(name):
+            cur.execute(sql, params)
+        return cur
+
+    names = _prepared_names(cur)
+    if name not in names:
+        cur.execute(stmt.prepare_sql())
+        names.add(name)
+        PREPARES.inc(name)
+    try:
+        with QUERY_SECONDS.time(name):
+            cur.execute(stmt.execute_sql, stmt.args(params))
+    except Exception as e:
+        # 连接上的预备语句不见了（例如会话被 DISCARD ALL），下次重新 PREPARE
+        if getattr(e, "pgcode", None) == "26000":
+            names.discard(name)
+            logging.warning(f"预备语句 {name} 不存在，下次执行时重新 PREPARE")
+        raise
+    return cur
+
+
+def execute_batch(cur, name, sql, param_list, types=None, grouped=None):
+    """多组参数执行同一条查询，返回与 param_list 一一对应的结果行列表。
+
+    grouped: (语句名, SQL, 参数下标, types)，SQL 是把第“参数下标”个参数换成数组（sensor_id = ANY(...)）
+    并在首列返回该参数值的版本；只有其它参数都相同时才合并。"""
+    param_list = [tuple(p) for p in param_list]
+    if not param_list:
+        return []
+    conn = cur.connection
+    if _is_psycopg3(conn):
+        cursors = []
+        with QUERY_SECONDS.time(f"{name}[pipeline]"), conn.pipeline():
+            for params in param_list:
+                c = conn.cursor()
+                c.execute(sql, params, prepare=config.DB_PREPARE)
+                cursors.append(c)
+        results = []
+        for c in cursors:
+            results.append(c.fetchall())
+            c.close()
+        return results
+
+    if grouped is not None:
+        g_name, g_sql, index, g_types = grouped
+        rest = {p[:index] + p[index + 1:] for p in param_list}
+        if len(rest) == 1:
+            keys = list(dict.fromkeys(p[index] for p in param_list))
+            params = list(param_list[0])
+            params[index] = keys
+            execute(cur, g_name, g_sql, params, g_types)
+            by_key = {}
+            for row in cur.fetchall():
+                by_key.setdefault(row[0], []).append(row[1:])
+            return [by_key.get(p[index], []) for p in param_list]
+
+    results = []
+    for params in param_list:
+        execute(cur, name, sql, params, types)
+        results.append(cur.fetchall())
+    return results
+
+
+def stats():
+    """每条语句的执行次数、总耗时与平均耗时（毫秒）"""
+    out = {}
+    for labels, series in QUERY_SECONDS._series.items():
+        count, total = series[-1], series[-2]
+        out[labels[0]] = {"count": count, "total_ms": round(total * 1000, 3),
+                          "mean_ms": round(total * 1000 / count, 3) if count else 0.0}
+    return out
+
+
+# /metrics 上按语句导出 db_query_<语句名>_count / _total_ms / _mean_ms（耗时分布见 db_query_seconds）
+metrics.register_stats("db_query", stats)
+
+
+# ─── API 连接池 ──────────────────────────────────────────────────────────────
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(0, config.DB_POOL_SIZE, config.DB_URL)
+    return _pool
+
+
+@contextlib.contextmanager
+def connection():
+    """从连接池借一个连接（上面的预备语句随连接保留）；池已借完时临时新建，用完关闭"""
+    pool = _get_pool()
+    try:
+        conn, pooled = pool.getconn(), True
+    except psycopg2.pool.PoolError:
+        conn, pooled = psycopg2.connect(config.DB_URL), False
+    try:
+        yield conn
+    finally:
+        try:
+            conn.rollback()  # 只读请求也会开启事务，归还前结束，避免连接长时间 idle in transaction
+        except psycopg2.Error:
+            conn.close()
+        if pooled:
+            pool.putconn(conn, close=bool(conn.closed))
+        else:
+            conn.close()
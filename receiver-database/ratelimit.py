@@ -0,0 +1,173 @@
+import threading
+import time
+from config import config
+
+# 入库准入控制：每个 sensor_id 一个令牌桶，写入线程前再加一个全局令牌桶。
+# 默认关闭（RATE_LIMIT=false），关闭时 admit() 原样放行。
+# 单个传感器超速时按策略处理：
+#   drop      — 直接丢弃超出部分
+#   sample    — 超出部分每 sample_every 条放行 1 条
+#   aggregate — 超出部分在每个窗口内合并为 1 条（数值取平均，缺失值不参与，异常标记取“或”），窗口结束时写入
+# 合并行在消息到达时顺带取出，入库引擎另外定时调用 drain()，传感器安静下来后合并行也会按时写入。
+# 行格式与 BatchWriter 一致：(sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+
+POLICIES = ("drop", "sample", "aggregate")
+IDLE_SWEEP_S = 60   # 清理空闲令牌桶的间隔（秒）
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = None
+
+    def take(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def idle(self, now):
+        """已经回满，与新建的桶等价，可以丢弃"""
+        return self.last is None or self.tokens + (now - self.last) * self.rate >= self.burst
+
+
+class AdmissionControl:
+    """admit() 与 drain() 可以在不同线程调用（MQTT 回调线程与定时取出线程）"""
+
+    def __init__(self, sensor_rate, sensor_burst, global_rate, global_burst,
+                 policy="drop", sample_every=10, window=10.0, enabled=True):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的限流策略: {policy}")
+        self.enabled = enabled
+        self.sensor_rate = sensor_rate
+        self.sensor_burst = sensor_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.policy = policy
+        self.sample_every = sample_every
+        self.window = window
+        self._buckets = {}
+        self._throttled_seq = {}   # sample 策略：每个传感器被限流的消息序号
+        # aggregate 策略：sensor_id -> [窗口结束时间, 温度和, 温度条数, 湿度和, 湿度条数, 土壤和, 土壤条数, 是否异常, 最新时间戳]
+        self._aggregates = {}
+        self._next_drain = 0.0
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"admitted": 0, "dropped": 0, "sampled": 0,
+                         "aggregated": 0, "global_dropped": 0, "evicted_buckets": 0}
+        self.throttled_by_sensor = {}
+
+    def admit(self, row, now=None):
+        """返回本次应写入的行列表（通常 0 或 1 行，aggregate 策略在窗口结束时可能多出合并行）"""
+        if not self.enabled:
+            return [row]
+        now = time.monotonic() if now is None else now
+        sensor_id = row[0]
+        with self._lock:
+            out = self._drain(now)
+
+            bucket = self._buckets.get(sensor_id)
+            if bucket is None:
+                bucket = self._buckets[sensor_id] = TokenBucket(self.sensor_rate, self.sensor_burst)
+
+            if bucket.take(now):
+                self._admit_global(row, now, out)
+                return out
+
+            self.throttled_by_sensor[sensor_id] = self.throttled_by_sensor.get(sensor_id, 0) + 1
+            if self.policy == "sample":
+                seq = self._throttled_seq.get(sensor_id, 0) + 1
+                self._throttled_seq[sensor_id] = seq
+                if seq % self.sample_every == 0:
+                    self.counters["sampled"] += 1
+                    self._admit_global(row, now, out)
+                else:
+                    self.counters["dropped"] += 1
+            elif self.policy == "aggregate":
+                self._accumulate(row, now)
+                self.counters["aggregated"] += 1
+            else:
+                self.counters["dropped"] += 1
+            return out
+
+    def drain(self, now=None):
+        """取出已到窗口结束时间的合并行，并清理空闲的令牌桶；由入库引擎定时调用"""
+        if not self.enabled:
+            return []
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            out = self._drain(now)
+            if now >= self._next_sweep:
+                self._next_sweep = now + IDLE_SWEEP_S
+                self._evict_idle(now)
+            return out
+
+    def _drain(self, now):
+        out = []
+        if not self._aggregates or now < self._next_drain:
+            return out
+        next_drain = 0.0
+        for sensor_id, agg in list(self._aggregates.items()):
+            if now < agg[0]:
+                # 下一次取出的时间取最早结束的窗口，其它传感器的合并行不会被推迟
+                next_drain = agg[0] if not next_drain else min(next_drain, agg[0])
+                continue
+            del self._aggregates[sensor_id]
+            _, t_sum, t_n, h_sum, h_n, s_sum, s_n, anomaly, time_stamp = agg
+            self._admit_global((sensor_id, time_stamp,
+                                round(t_sum / t_n, 2) if t_n else None,
+                                round(h_sum / h_n, 2) if h_n else None,
+                                int(round(s_sum / s_n)) if s_n else None,
+                                anomaly), now, out)
+        self._next_drain = next_drain
+        return out
+
+    def _accumulate(self, row, now):
+        sensor_id, time_stamp, t, h, s, anomaly = row
+        agg = self._aggregates.get(sensor_id)
+        if agg is None:
+            agg = self._aggregates[sensor_id] = [now + self.window, 0.0, 0, 0.0, 0, 0.0, 0, False, time_stamp]
+            if not self._next_drain or self._next_drain > agg[0]:
+                self._next_drain = agg[0]
+        # 缺失的读数（None）不参与平均
+        for i, value in ((1, t), (3, h), (5, s)):
+            if value is not None:
+                agg[i] += value
+                agg[i + 1] += 1
+        agg[7] = agg[7] or bool(anomaly)
+        agg[8] = time_stamp
+
+    def _evict_idle(self, now):
+        idle = [sid for sid, bucket in self._buckets.items()
+                if bucket.idle(now) and sid not in self._aggregates]
+        for sensor_id in idle:
+            del self._buckets[sensor_id]
+            self._throttled_seq.pop(sensor_id, None)
+        self.counters["evicted_buckets"] += len(idle)
+
+    def _admit_global(self, row, now, out):
+        if self.global_bucket.take(now):
+            self.counters["admitted"] += 1
+            out.append(row)
+        else:
+            self.counters["global_dropped"] += 1
+
+    def stats(self, top=10):
+        noisiest = sorted(self.throttled_by_sensor.items(), key=lambda kv: kv[1], reverse=True)[:top]
+        return {"enabled": self.enabled, "policy": self.policy, **self.counters,
+                "buckets": len(self._buckets),
+                "pending_aggregates": len(self._aggregates),
+                "top_throttled_sensors": noisiest}
+
+
+def from_config():
+    """按 config 创建准入控制器（每个入库引擎各持有一个）"""
+    return AdmissionControl(config.RATE_SENSOR_PER_S, config.RATE_SENSOR_BURST,
+                            config.RATE_GLOBAL_PER_S, config.RATE_GLOBAL_BURST,
+                            policy=config.RATE_POLICY, sample_every=config.RATE_SAMPLE_EVERY,
+                            window=config.RATE_WINDOW, enabled=config.RATE_LIMIT)
@@ -0,0 +1,53 @@
+import json
+import logging
+import os
+
+# 溢出文件（JSON Lines）：数据库暂时不可用、重试仍失败的记录追加到这里，数据库恢复后重放。
+# 读数行与窗口汇总消息各用一个文件，入库引擎（BatchWriter、AggregateWriter、async_ingest）共用下面的读写函数。
+# 重放时先把文件改名为 <path>.replay 再读出，重放期间新的失败记录写回 <path>；
+# 进程在重放中途退出时，启动后先继续重放 .replay 文件。
+# 数据错误被拒收的记录写进同目录的 *.rejected.jsonl，只用于人工排查，不会重放。
+
+
+def rejected_path(path):
+    if not path:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}.rejected{ext}"
+
+
+def append(path, records):
+    """追加并 fsync，返回是否落盘；path 为空时不落盘"""
+    if not path:
+        return False
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    except OSError as e:
+        logging.error(f"写入溢出文件 {path} 失败: {e}")
+        return False
+    return True
+
+
+def take(path):
+    """取出待重放的全部记录（列表）；没有时返回 []。重放结束后调用 done()"""
+    if not path:
+        return []
+    replay_path = path + ".replay"
+    if not os.path.exists(replay_path):
+        if not os.path.exists(path):
+            return []
+        os.replace(path, replay_path)
+    with open(replay_path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def done(path):
+    try:
+        os.remove(path + ".replay")
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,438 @@
+import abc
+import datetime
+import logging
+import math
+import sqlite3
+import threading
+import time
+import psycopg2
+from config import config
+import metrics
+import querylayer
+
+# 读数存储接口：批量写入、按范围扫描、按传感器聚合、每个传感器的最新读数。
+# 两个实现：
+#   PostgresStorage  远程 Postgres（psycopg2），与原来的写库 / 查询 SQL 一致；
+#   SQLiteStorage    本地嵌入式 SQLite，WAL 模式，每批一个事务；边缘节点先落本地盘，由 Forwarder 批量转发到上游，
+#                    测试与压测也不再需要外部数据库。
+# 用 STORAGE_URL 选择：postgresql://...（为空时使用 DB_URL）或 sqlite:///相对路径.db、sqlite:////绝对路径.db。
+#
+# 行格式与 BatchWriter 一致：(sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)。
+# 扫描结果中 time_stamp 为 datetime，is_anomaly 为 bool（两种后端一致）。
+# SQLite 中 time_stamp 存为定长文本 "YYYY-MM-DD HH:MM:SS.ffffff"，按文本比较即按时间比较；
+# 带时区的时间戳与 Postgres TIMESTAMP 列的处理一致，直接丢弃时区保留本地时间。
+#
+# 告警、窗口汇总、阶梯重采样等查询仍直接使用 Postgres。
+
+COLUMNS = ("sensor_id", "time_stamp", "temperature", "humidity", "soil_moisture", "is_anomaly")
+METRICS = ("temperature", "humidity", "soil_moisture")
+# aggregate() 每行的字段：sensor_id、条数，以及每个指标的 平均 / 最小 / 最大 / 样本标准差
+AGGREGATE_COLUMNS = ("sensor_id", "count") + tuple(
+    f"{m}_{stat}" for m in METRICS for stat in ("avg", "min", "max", "std"))
+
+# 写库时两种后端可能抛出的异常，调用方统一捕获
+ERRORS = (psycopg2.Error, sqlite3.Error)
+# 由某一行的数据本身引起、重试不会成功的错误（时间戳无法解析、类型转换失败、违反 NOT NULL 等）；
+# 其它错误（连接断开、数据库锁、磁盘满等）按暂时性错误重试
+DATA_ERRORS = (ValueError, TypeError, psycopg2.DataError, psycopg2.IntegrityError,
+               sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+FORWARDED_ROWS = metrics.Counter("ingest_forwarded_rows_total", "Rows forwarded from local storage upstream")
+FORWARD_SECONDS = metrics.Histogram("ingest_forward_seconds", "Upstream forward batch time")
+
+
+class Storage(abc.ABC):
+    """存储接口（抽象基类，缺少任一方法的后端在创建时即报错）；写入方法不提交，调用方在一批写完后 commit()，出错时 rollback()"""
+
+    @abc.abstractmethod
+    def ensure_schema(self):
+        ...
+
+    @abc.abstractmethod
+    def insert_rows(self, rows):
+        """批量写入，唯一键 (sensor_id, time_stamp) 冲突的行跳过；返回实际写入的行数"""
+
+    @abc.abstractmethod
+    def scan(self, sensor_ids=None, start=None, end=None, block_rows=None):
+        """按 (sensor_id, time_stamp) 顺序分块返回 [start, end) 内的行，每块最多 block_rows 行"""
+
+    @abc.abstractmethod
+    def aggregate(self, sensor_ids=None, start=None, end=None):
+        """按传感器聚合 [start, end) 内的读数，返回 AGGREGATE_COLUMNS 顺序的元组列表（按 sensor_id 排序）"""
+
+    @abc.abstractmethod
+    def latest(self, sensor_ids=None):
+        """每个传感器时间最新的一行，按 sensor_id 排序"""
+
+    @abc.abstractmethod
+    def commit(self):
+        ...
+
+    @abc.abstractmethod
+    def rollback(self):
+        ...
+
+    @abc.abstractmethod
+    def close(self):
+        ...
+
+    @property
+    @abc.abstractmethod
+    def closed(self):
+        ...
+
+
+def _where(sensor_ids, start, end, sensor_sql, param):
+    conds, params = [], []
+    if sensor_ids is not None:
+        conds.append(sensor_sql(sensor_ids))
+        params.extend(list(sensor_ids) if param == "?" else [list(sensor_ids)])
+    if start is not None:
+        conds.append(f"time_stamp >= {param}")
+        params.append(start)
+    if end is not None:
+        conds.append(f"time_stamp < {param}")
+        params.append(end)
+    return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+
+# ─── Postgres ───────────────────────────────────────────────────────────────
+
+# 每批按列传入数组，语句文本与批大小无关，每个连接只预备一次（见 querylayer.py）；
+# soil_moisture 按 float8 传入，列为 INTEGER 时由赋值转换取整
+PG_INSERT_SQL = """
+    INSERT INTO rawdata_from_sensors
+    (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+    SELECT * FROM unnest(%s::int[], %s::timestamp[], %s::float8[], %s::float8[], %s::float8[], %s::bool[])
+    ON CONFLICT DO NOTHING
+"""
+PG_INSERT_TYPES = ("int[]", "timestamp[]", "float8[]", "float8[]", "float8[]", "bool[]")
+
+
+class PostgresStorage(Storage):
+    def __init__(self, db_url=None):
+        self.db_url = db_url or config.DB_URL
+        self.conn = psycopg2.connect(self.db_url)
+        self._scans = 0
+
+    def ensure_schema(self):
+        # 建库、建表与唯一索引由 database.DatabaseManager 负责
+        from database import db_manager
+        return db_manager.ensure_constraints()
+
+    def insert_rows(self, rows):
+        if not rows:
+            return 0
+        columns = [list(col) for col in zip(*rows)]
+        with self.conn.cursor() as cur:
+            querylayer.execute(cur, "insert_rawdata", PG_INSERT_SQL, columns, PG_INSERT_TYPES)
+            return cur.rowcount
+
+    def scan(self, sensor_ids=None, start=None, end=None, block_rows=None):
+        block_rows = block_rows or config.API_FETCH_ROWS
+        where, params = _where(sensor_ids, start, end, lambda ids: "sensor_id = ANY(%s)", "%s")
+        self._scans += 1
+        with self.conn.cursor(name=f"storage_scan_{self._scans}") as cur:
+            cur.itersize = block_rows
+            cur.execute(f"SELECT {', '.join(COLUMNS)} FROM rawdata_from_sensors{where} "
+                        f"ORDER BY sensor_id, time_stamp", params)
+            while True:
+                rows = cur.fetchmany(block_rows)
+                if not rows:
+                    break
+                yield rows
+
+    def aggregate(self, sensor_ids=None, start=None, end=None):
+        where, params = _where(sensor_ids, start, end, lambda ids: "sensor_id = ANY(%s)", "%s")
+        selects = ", ".join(f"AVG({m}), MIN({m}), MAX({m}), STDDEV({m})" for m in METRICS)
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT sensor_id, COUNT(*), {selects} FROM rawdata_from_sensors{where} "
+                        f"GROUP BY sensor_id ORDER BY sensor_id", params)
+            return cur.fetchall()
+
+    def latest(self, sensor_ids=None):
+        where, params = _where(sensor_ids, None, None, lambda ids: "sensor_id = ANY(%s)", "%s")
+        with self.conn.cursor() as cur:
+            # DISTINCT ON 沿唯一索引 (sensor_id, time_stamp) 取每组第一行
+            cur.execute(f"SELECT DISTINCT ON (sensor_id) {', '.join(COLUMNS)} FROM rawdata_from_sensors{where} "
+                        f"ORDER BY sensor_id, time_stamp DESC", params)
+            return cur.fetchall()
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        if not self.conn.closed:
+            self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def closed(self):
+        return bool(self.conn.closed)
+
+
+# ─── SQLite ─────────────────────────────────────────────────────────────────
+
+SQLITE_SCHEMA_SQL = """
+    CREATE TABLE IF NOT EXISTS rawdata_from_sensors (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        sensor_id     INTEGER NOT NULL,
+        time_stamp    TEXT NOT NULL,
+        temperature   REAL,
+        humidity      REAL,
+        soil_moisture REAL,
+        is_anomaly    INTEGER
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_rawdata_sensor_ts ON rawdata_from_sensors (sensor_id, time_stamp);
+    CREATE INDEX IF NOT EXISTS idx_rawdata_time ON rawdata_from_sensors (time_stamp);
+    CREATE TABLE IF NOT EXISTS forward_state (
+        name    TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    );
+"""
+
+SQLITE_INSERT_SQL = """
+    INSERT OR IGNORE INTO rawdata_from_sensors
+    (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def _ts(value):
+    """时间戳统一为定长文本；接受 datetime、date 或 ISO 8601 字符串"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+def _row_in(row):
+    sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly = row
+    return (sensor_id, _ts(time_stamp), temperature, humidity, soil_moisture,
+            None if is_anomaly is None else int(bool(is_anomaly)))
+
+
+def _row_out(row):
+    sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly = row
+    return (sensor_id, datetime.datetime.fromisoformat(time_stamp), temperature, humidity, soil_moisture,
+            None if is_anomaly is None else bool(is_anomaly))
+
+
+def _std(n, s, sq):
+    if n is None or n < 2:
+        return None
+    return math.sqrt(max(0.0, (sq - s * s / n) / (n - 1)))
+
+
+class SQLiteStorage(Storage):
+    """连接可以在创建它的线程之外使用，但同一时间只能有一个线程使用；不同线程请各自创建实例（WAL 允许并发读写）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+        self._closed = False
+
+    def ensure_schema(self):
+        self.conn.executescript(SQLITE_SCHEMA_SQL)
+        self.conn.commit()
+        return True
+
+    def insert_rows(self, rows):
+        cur = self.conn.executemany(SQLITE_INSERT_SQL, map(_row_in, rows))
+        return cur.rowcount
+
+    def scan(self, sensor_ids=None, start=None, end=None, block_rows=None):
+        block_rows = block_rows or config.API_FETCH_ROWS
+        where, params = _where(sensor_ids, _ts(start), _ts(end),
+                               lambda ids: f"sensor_id IN ({', '.join('?' * len(ids))})", "?")
+        cur = self.conn.execute(f"SELECT {', '.join(COLUMNS)} FROM rawdata_from_sensors{where} "
+                                f"ORDER BY sensor_id, time_stamp", params)
+        try:
+            while True:
+                rows = cur.fetchmany(block_rows)
+                if not rows:
+                    break
+                yield [_row_out(r) for r in rows]
+        finally:
+            cur.close()
+
+    def aggregate(self, sensor_ids=None, start=None, end=None):
+        where, params = _where(sensor_ids, _ts(start), _ts(end),
+                               lambda ids: f"sensor_id IN ({', '.join('?' * len(ids))})", "?")
+        # SQLite 没有内置 STDDEV，取 条数 / 和 / 平方和 在 Python 中计算
+        selects = ", ".join(f"COUNT({m}), SUM({m}), SUM({m} * {m}), MIN({m}), MAX({m})" for m in METRICS)
+        rows = self.conn.execute(f"SELECT sensor_id, COUNT(*), {selects} FROM rawdata_from_sensors{where} "
+                                 f"GROUP BY sensor_id ORDER BY sensor_id", params).fetchall()
+        results = []
+        for row in rows:
+            out = [row[0], row[1]]
+            for i in range(len(METRICS)):
+                n, s, sq, lo, hi = row[2 + 5 * i: 7 + 5 * i]
+                out += [s / n if n else None, lo, hi, _std(n, s, sq)]
+            results.append(tuple(out))
+        return results
+
+    def latest(self, sensor_ids=None):
+        where, params = _where(sensor_ids, None, None,
+                               lambda ids: f"sensor_id IN ({', '.join('?' * len(ids))})", "?")
+        rows = self.conn.execute(f"""
+            SELECT {', '.join('r.' + c for c in COLUMNS)}
+            FROM (SELECT sensor_id, MAX(time_stamp) AS ts FROM rawdata_from_sensors{where} GROUP BY sensor_id) m
+            JOIN rawdata_from_sensors r ON r.sensor_id = m.sensor_id AND r.time_stamp = m.ts
+            ORDER BY r.sensor_id
+        """, params).fetchall()
+        return [_row_out(r) for r in rows]
+
+    # 转发用：按自增 id 取尚未转发的行，自增 id 不会复用，删除旧行后也不会跳过新行
+    def pending(self, after_id, limit):
+        return self.conn.execute(f"SELECT id, {', '.join(COLUMNS)} FROM rawdata_from_sensors "
+                                 f"WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)).fetchall()
+
+    def forward_mark(self, name):
+        row = self.conn.execute("SELECT last_id FROM forward_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def set_forward_mark(self, name, last_id):
+        self.conn.execute("INSERT INTO forward_state (name, last_id) VALUES (?, ?) "
+                          "ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id", (name, last_id))
+
+    def backlog(self, after_id):
+        return self.conn.execute("SELECT COUNT(*) FROM rawdata_from_sensors WHERE id > ?", (after_id,)).fetchone()[0]
+
+    def prune(self, up_to_id, before):
+        """删除已转发且早于 before 的行，返回删除行数"""
+        cur = self.conn.execute("DELETE FROM rawdata_from_sensors WHERE id <= ? AND time_stamp < ?",
+                                (up_to_id, _ts(before)))
+        return cur.rowcount
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        if not self._closed:
+            self.conn.rollback()
+
+    def close(self):
+        self._closed = True
+        self.conn.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+
+def open_storage(url=None):
+    """按连接串创建存储：sqlite:///路径 为 SQLite，其它按 Postgres 连接串处理"""
+    url = url or config.STORAGE_URL or config.DB_URL
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        path = path[1:] if path.startswith("/") else path
+        storage = SQLiteStorage(path or ":memory:")
+        storage.ensure_schema()
+        return storage
+    return PostgresStorage(url)
+
+
+def is_local(url=None):
+    return (url or config.STORAGE_URL or "").startswith("sqlite://")
+
+
+def start_forwarder():
+    """本地库模式且配置了 FORWARD_URL 时启动转发线程（每个本地库只应有一个进程转发），否则返回 None"""
+    if not (is_local() and config.FORWARD_URL):
+        return None
+    forwarder = Forwarder()
+    forwarder.start()
+    metrics.register_stats("forwarder", forwarder.stats)
+    logging.info(f"本地存储 {config.STORAGE_URL} 的新行将转发到上游")
+    return forwarder
+
+
+# ─── 边缘转发 ────────────────────────────────────────────────────────────────
+
+class Forwarder:
+    """后台线程：把本地 SQLite 中尚未转发的行按 id 顺序每批 FORWARD_BATCH_ROWS 行写入上游 Postgres。
+    上游提交成功后才推进本地转发位置，断网期间数据留在本地，恢复后按顺序补发；
+    上游按唯一键跳过重复行，提交后、推进位置前崩溃导致的重发不会重复入库。"""
+
+    NAME = "upstream"
+
+    def __init__(self, local_url=None, upstream_url=None, batch_rows=None, interval=None, retain_hours=None):
+        self.local_url = local_url or config.STORAGE_URL
+        self.upstream_url = upstream_url or config.FORWARD_URL
+        self.batch_rows = batch_rows or config.FORWARD_BATCH_ROWS
+        self.interval = interval or config.FORWARD_INTERVAL
+        self.retain_hours = config.FORWARD_RETAIN_HOURS if retain_hours is None else retain_hours
+        self.local = None
+        self.upstream = None
+        self._thread = None
+        self.forwarded = 0
+        self.failed_batches = 0
+        self.pruned = 0
+        self.mark = 0
+        self.backlog = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="forwarder", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        delay = self.interval
+        while True:
+            try:
+                sent = self.forward_once()
+                delay = self.interval
+                if sent >= self.batch_rows:
+                    continue  # 还有积压，立即发下一批
+            except ERRORS as e:
+                self.failed_batches += 1
+                logging.warning(f"转发到上游失败: {e}，{delay:.0f} 秒后重试")
+                if self.upstream is not None:
+                    try:
+                        self.upstream.rollback()
+                    except ERRORS:
+                        pass
+                    if self.upstream.closed:
+                        self.upstream = None
+                delay = min(delay * 2, config.MQTT_RECONNECT_MAX)
+            time.sleep(delay)
+
+    def forward_once(self):
+        """转发一批，返回转发的行数"""
+        if self.local is None:
+            self.local = open_storage(self.local_url)
+            self.mark = self.local.forward_mark(self.NAME)
+        rows = self.local.pending(self.mark, self.batch_rows)
+        if rows:
+            if self.upstream is None:
+                self.upstream = open_storage(self.upstream_url)
+            with FORWARD_SECONDS.time():
+                # 本地行的 is_anomaly 为 0/1、time_stamp 为文本，先转换为与 Postgres 列类型一致的值
+                self.upstream.insert_rows([_row_out(r[1:]) for r in rows])
+                self.upstream.commit()
+            self.mark = rows[-1][0]
+            self.local.set_forward_mark(self.NAME, self.mark)
+            self.local.commit()
+            self.forwarded += len(rows)
+            FORWARDED_ROWS.inc(n=len(rows))
+            metrics.log_sampled("forwarder.batch", logging.INFO, f"已转发 {len(rows)} 行到上游", every=100)
+        if self.retain_hours > 0:
+            before = datetime.datetime.now() - datetime.timedelta(hours=self.retain_hours)
+            self.pruned += self.local.prune(self.mark, before)
+            self.local.commit()
+        self.backlog = self.local.backlog(self.mark)
+        return len(rows)
+
+    def stats(self):
+        return {"forwarded": self.forwarded, "backlog": self.backlog, "last_id": self.mark,
+                "failed_batches": self.failed_batches, "pruned": self.pruned}
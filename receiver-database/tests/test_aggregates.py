@@ -0,0 +1,90 @@
+import math
+
+import pytest
+
+import aggregates
+from aggregates import summary_key, summary_rows
+
+
+def summary(values, anomalies=0, start="2025-06-05T14:20:00", end="2025-06-05T14:25:00"):
+    """按发送端 aggregator.py 的格式为传感器 5 构造一条汇总，values 为 [(t, h, s), ...]"""
+    return {
+        "type": "summary", "zone": 0, "window_start": start, "window_end": end,
+        "sensor_ids": [5], "count": [len(values)], "anomalies": [anomalies],
+        "sum": [[sum(v[i] for v in values) for i in range(3)]],
+        "sumsq": [[sum(v[i] * v[i] for v in values) for i in range(3)]],
+        "min": [[min(v[i] for v in values) for i in range(3)]],
+        "max": [[max(v[i] for v in values) for i in range(3)]],
+    }
+
+
+def as_dict(row):
+    return dict(zip(aggregates.COLUMNS, row))
+
+
+def merge(a, b):
+    """按 MERGE_SQL 的规则合并同一主键的两行"""
+    merged = dict(a)
+    merged["window_end"] = max(a["window_end"], b["window_end"])
+    for col in ("count", "anomalies"):
+        merged[col] = a[col] + b[col]
+    for m in aggregates.METRICS:
+        merged[f"{m}_sum"] = a[f"{m}_sum"] + b[f"{m}_sum"]
+        merged[f"{m}_sumsq"] = a[f"{m}_sumsq"] + b[f"{m}_sumsq"]
+        merged[f"{m}_min"] = min(a[f"{m}_min"], b[f"{m}_min"])
+        merged[f"{m}_max"] = max(a[f"{m}_max"], b[f"{m}_max"])
+    return merged
+
+
+def test_summary_rows_follow_columns():
+    rows = summary_rows(summary([(20.0, 50.0, 400.0), (22.0, 54.0, 410.0)], anomalies=1))
+    assert len(rows) == 1
+    row = as_dict(rows[0])
+    assert (row["sensor_id"], row["zone"], row["count"], row["anomalies"]) == (5, 0, 2, 1)
+    assert (row["temp_sum"], row["temp_sumsq"], row["temp_min"], row["temp_max"]) == (42.0, 884.0, 20.0, 22.0)
+    assert row["soil_max"] == 410.0
+
+
+@pytest.mark.parametrize("payload", [
+    {"zone": 0},
+    {**summary([(20.0, 50.0, 400.0)]), "count": [1, 2]},
+    ["not", "a", "dict"],
+])
+def test_summary_rows_rejects_malformed(payload):
+    with pytest.raises(ValueError):
+        summary_rows(payload)
+
+
+def test_summary_key_separates_parts_from_redelivery():
+    first = summary([(20.0, 50.0, 400.0)])
+    second = summary([(21.0, 51.0, 405.0), (23.0, 52.0, 415.0)])
+    assert summary_key(first) == summary_key(dict(first))
+    assert summary_key(first) != summary_key(second)
+
+
+def test_split_window_merges_to_full_window_stats():
+    readings = [(20.0, 50.0, 400.0), (24.0, 58.0, 420.0), (19.0, 49.0, 380.0),
+                (26.0, 61.0, 450.0), (22.0, 55.0, 410.0)]
+    # 发送端重启：同一窗口分两次发出
+    a = as_dict(summary_rows(summary(readings[:2], end="2025-06-05T14:22:00"))[0])
+    b = as_dict(summary_rows(summary(readings[2:], anomalies=1))[0])
+    merged = merge(a, b)
+    whole = as_dict(summary_rows(summary(readings, anomalies=1))[0])
+    for col, value in whole.items():
+        assert merged[col] == pytest.approx(value), col
+
+    # avg = sum / count，stddev = sqrt((sumsq - sum^2 / count) / (count - 1))
+    n = merged["count"]
+    temps = [r[0] for r in readings]
+    mean = sum(temps) / n
+    assert merged["temp_sum"] / n == pytest.approx(mean)
+    std = math.sqrt((merged["temp_sumsq"] - merged["temp_sum"] ** 2 / n) / (n - 1))
+    assert std == pytest.approx(math.sqrt(sum((t - mean) ** 2 for t in temps) / (n - 1)))
+
+
+def test_merge_sql_covers_every_metric_column():
+    for col in aggregates.COLUMNS[4:]:
+        assert f"{col} = " in aggregates.MERGE_SQL
+    assert "temp_sum = sensor_aggregates.temp_sum + EXCLUDED.temp_sum" in aggregates.MERGE_SQL
+    assert "soil_min = LEAST(sensor_aggregates.soil_min, EXCLUDED.soil_min)" in aggregates.MERGE_SQL
+    assert "hum_max = GREATEST(sensor_aggregates.hum_max, EXCLUDED.hum_max)" in aggregates.MERGE_SQL
@@ -0,0 +1,62 @@
+from alerts import AlertMonitor
+
+LIMITS = {"temperature": (15.0, 30.0), "humidity": (30.0, 80.0), "soil_moisture": (100.0, 700.0)}
+
+
+def drain(monitor):
+    events = []
+    while not monitor.events.empty():
+        events.append(monitor.events.get_nowait())
+    return events
+
+
+def observe_temp(monitor, ts, temperature):
+    monitor.observe(1, ts, temperature, 50.0, 400)
+
+
+def test_open_peak_close():
+    m = AlertMonitor(db_url="postgresql://unused", limits=LIMITS)
+    observe_temp(m, "2025-06-05T10:00:00", 25.0)
+    assert drain(m) == []
+
+    observe_temp(m, "2025-06-05T10:01:00", 31.0)
+    assert drain(m) == [("open", (1, "temperature", "high", 30.0, "2025-06-05T10:01:00", 31.0, 31.0))]
+
+    observe_temp(m, "2025-06-05T10:02:00", 34.0)
+    observe_temp(m, "2025-06-05T10:03:00", 32.0)
+    state = m._open[(1, "temperature")]
+    assert (state.peak, state.readings, state.dirty) == (34.0, 3, True)
+    assert drain(m) == []            # 峰值变化不产生事件，由写库线程定时回写
+
+    observe_temp(m, "2025-06-05T10:04:00", 28.0)
+    assert drain(m) == [("close", ("2025-06-05T10:04:00", 28.0, 34.0, 3, 1, "temperature"))]
+    assert (1, "temperature") not in m._open
+    assert (m.counters["opened"], m.counters["closed"]) == (1, 1)
+
+
+def test_low_peak_tracks_minimum():
+    m = AlertMonitor(db_url="postgresql://unused", limits=LIMITS)
+    observe_temp(m, "t1", 14.0)
+    observe_temp(m, "t2", 10.0)
+    observe_temp(m, "t3", 12.0)
+    assert m._open[(1, "temperature")].peak == 10.0
+
+
+def test_jump_to_other_side_closes_and_reopens():
+    m = AlertMonitor(db_url="postgresql://unused", limits=LIMITS)
+    observe_temp(m, "t1", 35.0)
+    observe_temp(m, "t2", 5.0)
+    kinds = [(kind, args[2] if kind == "open" else None) for kind, args in drain(m)]
+    assert kinds == [("open", "high"), ("close", None), ("open", "low")]
+    assert m._open[(1, "temperature")].direction == "low"
+
+
+def test_stale_and_non_numeric_readings_ignored():
+    m = AlertMonitor(db_url="postgresql://unused", limits=LIMITS)
+    observe_temp(m, "2025-06-05T10:05:00", 25.0)
+    observe_temp(m, "2025-06-05T10:00:00", 40.0)      # 迟到的旧读数
+    assert m.counters["stale"] == 1
+    m.observe(1, "2025-06-05T10:06:00", "n/a", None, True)
+    m.observe(1, "2025-06-05T10:07:00", float("nan"), {"x": 1}, 400)
+    assert drain(m) == []
+    assert m._open == {}
@@ -0,0 +1,36 @@
+from dedup import RecentKeyCache
+
+
+def test_seen_records_first_occurrence():
+    cache = RecentKeyCache(10)
+    assert cache.seen((1, "2025-06-05T10:00:00")) is False
+    assert cache.seen((1, "2025-06-05T10:00:00")) is True
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+def test_seen_without_record_then_mark():
+    cache = RecentKeyCache(10)
+    assert cache.seen("a", record=False) is False
+    assert cache.seen("a", record=False) is False
+    cache.mark(["a"])
+    assert cache.seen("a") is True
+
+
+def test_evicts_least_recently_seen():
+    cache = RecentKeyCache(2)
+    cache.seen("a")
+    cache.seen("b")
+    cache.seen("a")      # a 变为最近出现
+    cache.seen("c")      # 淘汰 b
+    assert cache.stats()["size"] == 2
+    assert cache.seen("a", record=False) is True
+    assert cache.seen("b", record=False) is False
+
+
+def test_forget_allows_redelivery():
+    cache = RecentKeyCache(10)
+    cache.seen("a")
+    cache.seen("b")
+    cache.forget(["a", "missing"])
+    assert cache.seen("a") is False
+    assert cache.seen("b") is True
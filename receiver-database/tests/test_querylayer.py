@@ -0,0 +1,37 @@
+import pytest
+
+from querylayer import Statement
+
+
+def test_positional_placeholders():
+    stmt = Statement("q_pos", "SELECT * FROM t WHERE a = %s AND b > %s;", None)
+    assert stmt.dollar_sql == "SELECT * FROM t WHERE a = $1 AND b > $2"
+    assert stmt.execute_sql == "EXECUTE q_pos (%s, %s)"
+    assert stmt.prepare_sql() == "PREPARE q_pos AS SELECT * FROM t WHERE a = $1 AND b > $2"
+    assert stmt.args((1, 2)) == [1, 2]
+
+
+def test_named_placeholders_reuse_position():
+    stmt = Statement("q_named", "SELECT %(start)s, %(sid)s, %(start)s", {"start": "timestamp", "sid": "int"})
+    assert stmt.dollar_sql == "SELECT $1, $2, $1"
+    assert stmt.keys == ["start", "sid"]
+    assert stmt.types == ("timestamp", "int")
+    assert stmt.execute_sql == "EXECUTE q_named (%s::timestamp, %s::int)"
+    assert stmt.prepare_sql() == "PREPARE q_named (timestamp, int) AS SELECT $1, $2, $1"
+    assert stmt.args({"sid": 7, "start": "2025-06-05", "unused": 0}) == ["2025-06-05", 7]
+
+
+def test_literal_percent_unescaped():
+    stmt = Statement("q_like", "SELECT * FROM t WHERE name LIKE 'a%%' AND id = %s", None)
+    assert stmt.dollar_sql == "SELECT * FROM t WHERE name LIKE 'a%' AND id = $1"
+
+
+def test_no_parameters():
+    stmt = Statement("q_none", "SELECT 1", None)
+    assert stmt.execute_sql == "EXECUTE q_none"
+    assert stmt.args(None) == []
+
+
+def test_type_count_mismatch():
+    with pytest.raises(ValueError):
+        Statement("q_bad", "SELECT %s, %s", ["int"])
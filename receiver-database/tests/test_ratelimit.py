@@ -0,0 +1,81 @@
+import pytest
+
+import ratelimit
+from ratelimit import AdmissionControl, TokenBucket
+
+
+def row(sensor_id, ts, t=20.0, h=50.0, s=400, anomaly=False):
+    return (sensor_id, ts, t, h, s, anomaly)
+
+
+def test_token_bucket_burst_then_refill():
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take(0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.take(0.4) is False    # 只回了 0.8 个令牌
+    assert bucket.take(0.5) is True
+    assert not bucket.idle(0.5)
+    assert bucket.idle(2.0)             # 1.5 秒回满 3 个令牌
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        AdmissionControl(1, 1, 100, 100, policy="bogus")
+
+
+def test_disabled_passes_everything():
+    ac = AdmissionControl(1, 1, 1, 1, enabled=False)
+    r = row(1, "t0")
+    assert [ac.admit(r, now=0.0) for _ in range(5)] == [[r]] * 5
+    assert ac.drain(now=100.0) == []
+
+
+def test_drop_policy_per_sensor():
+    ac = AdmissionControl(sensor_rate=1, sensor_burst=2, global_rate=100, global_burst=100)
+    out = [ac.admit(row(1, f"t{i}"), now=0.0) for i in range(4)]
+    assert [len(o) for o in out] == [1, 1, 0, 0]
+    # 其它传感器有自己的桶
+    assert ac.admit(row(2, "t0"), now=0.0) == [row(2, "t0")]
+    assert ac.counters["admitted"] == 3
+    assert ac.counters["dropped"] == 2
+    assert ac.stats()["top_throttled_sensors"] == [(1, 2)]
+
+
+def test_global_bucket_caps_all_sensors():
+    ac = AdmissionControl(sensor_rate=100, sensor_burst=100, global_rate=1, global_burst=2)
+    admitted = sum(len(ac.admit(row(sid, "t0"), now=0.0)) for sid in range(5))
+    assert admitted == 2
+    assert ac.counters["global_dropped"] == 3
+
+
+def test_sample_policy_lets_every_nth_through():
+    ac = AdmissionControl(1, 1, 100, 100, policy="sample", sample_every=3)
+    out = [ac.admit(row(1, f"t{i}"), now=0.0) for i in range(7)]
+    # 第 1 条用掉令牌，之后被限流的第 3、6 条放行
+    assert [len(o) for o in out] == [1, 0, 0, 1, 0, 0, 1]
+    assert ac.counters["sampled"] == 2
+
+
+def test_aggregate_policy_merges_window():
+    ac = AdmissionControl(1, 1, 100, 100, policy="aggregate", window=10.0)
+    assert len(ac.admit(row(1, "t0"), now=0.0)) == 1
+    assert ac.admit(row(1, "t1", t=20.0, h=None, s=400), now=0.1) == []
+    assert ac.admit(row(1, "t2", t=22.0, h=60.0, s=500, anomaly=True), now=0.2) == []
+    assert ac.drain(now=5.0) == []
+    assert ac.drain(now=10.1) == [(1, "t2", 21.0, 60.0, 450, True)]
+    assert ac.stats()["pending_aggregates"] == 0
+
+
+def test_idle_buckets_evicted_on_sweep():
+    ac = AdmissionControl(sensor_rate=1, sensor_burst=2, global_rate=100, global_burst=100)
+    ac.admit(row(1, "t0"), now=0.0)
+    ac.admit(row(2, "t0"), now=0.0)
+    ac.drain(now=0.5)                    # 两个桶都还没回满
+    assert ac.stats()["buckets"] == 2
+    ac.admit(row(2, "t1"), now=ratelimit.IDLE_SWEEP_S)
+    ac.admit(row(2, "t2"), now=ratelimit.IDLE_SWEEP_S)
+    ac.drain(now=ratelimit.IDLE_SWEEP_S + 0.5)
+    assert ac.counters["evicted_buckets"] == 1
+    assert ac.stats()["buckets"] == 1
+    # 被清理的传感器再次出现时按新桶处理，突发额度完整
+    assert len(ac.admit(row(1, "t1"), now=ratelimit.IDLE_SWEEP_S + 1)) == 1
+    assert len(ac.admit(row(1, "t2"), now=ratelimit.IDLE_SWEEP_S + 1)) == 1
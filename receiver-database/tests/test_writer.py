@@ -0,0 +1,78 @@
+import json
+import sqlite3
+
+import pytest
+
+import spill
+from config import config
+from dedup import RecentKeyCache
+from writer import BatchWriter
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, "MQTT_RECONNECT_MIN", 0.001)
+    monkeypatch.setattr(config, "MQTT_RECONNECT_MAX", 0.002)
+    monkeypatch.setattr(config, "WRITER_RETRIES", 1)
+
+
+def reading(sensor_id, second, temperature=21.5):
+    return (sensor_id, f"2025-06-05T10:00:{second:02d}", temperature, 55.0, 420, False)
+
+
+def stored(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT sensor_id, temperature FROM rawdata_from_sensors "
+                            "ORDER BY sensor_id, time_stamp").fetchall()
+
+
+def test_unavailable_database_spills_then_replays(tmp_path):
+    spill_path = str(tmp_path / "spill" / "listener.jsonl")
+    acked = []
+    writer = BatchWriter(db_url=f"sqlite:///{tmp_path}/missing/ingest.db", spill_path=spill_path)
+    rows = [reading(1, 0), reading(2, 0)]
+    assert writer._write(rows, acks=[lambda: acked.append(1), lambda: acked.append(2)]) is False
+    assert writer.stats()["spilled"] == 2
+    assert acked == [1, 2]          # 落盘即确认
+    with open(spill_path, encoding="utf-8") as f:
+        assert [tuple(json.loads(line)) for line in f] == rows
+
+    db_path = tmp_path / "ingest.db"
+    writer.db_url = f"sqlite:///{db_path}"
+    writer._replay_spill()
+    assert writer.stats()["replayed"] == 2
+    assert stored(db_path) == [(1, 21.5), (2, 21.5)]
+    assert spill.take(spill_path) == []
+
+
+def test_failed_spill_forgets_dedup_keys(tmp_path):
+    cache = RecentKeyCache(10)
+    rows = [reading(1, 0), reading(1, 1)]
+    for row in rows:
+        cache.seen((row[0], row[1]))
+    writer = BatchWriter(db_url=f"sqlite:///{tmp_path}/missing/ingest.db", dedup=cache)
+    assert writer._write(rows) is False
+    assert writer.stats()["failed"] == 2
+    assert cache.stats()["size"] == 0   # broker 重投时可以再次入库
+
+
+def test_poison_row_rejected_rest_committed(tmp_path):
+    db_path = tmp_path / "ingest.db"
+    spill_path = str(tmp_path / "listener.jsonl")
+    acked = []
+    writer = BatchWriter(db_url=f"sqlite:///{db_path}", spill_path=spill_path)
+    rows = [reading(1, 0), reading(2, 0), (3, "not-a-timestamp", 20.0, 50.0, 400, False), reading(4, 0)]
+    writer._write(rows, acks=[lambda i=i: acked.append(i) for i in range(len(rows))])
+    assert stored(db_path) == [(1, 21.5), (2, 21.5), (4, 21.5)]
+    assert writer.stats()["rejected"] == 1
+    assert sorted(acked) == [0, 1, 2, 3]
+    with open(spill.rejected_path(spill_path), encoding="utf-8") as f:
+        assert [json.loads(line)[0] for line in f] == [3]
+    assert spill.take(spill_path) == []  # 拒收的行不重放
+
+
+def test_duplicates_counted_as_conflicts(tmp_path):
+    writer = BatchWriter(db_url=f"sqlite:///{tmp_path / 'ingest.db'}")
+    assert writer._write([reading(1, 0)]) is True
+    assert writer._write([reading(1, 0), reading(1, 1)]) is True
+    assert (writer.stats()["inserted"], writer.stats()["conflicts"]) == (2, 1)
@@ -0,0 +1,193 @@
+import logging
+import queue
+import threading
+import time
+from config import config
+import metrics
+import spill
+import storage
+from lag import lag_tracker
+from profiling import profiler
+
+
+class BatchWriter:
+    """后台写入线程：从队列攒批，每批一个事务批量写入，复用同一个存储连接（Postgres 或本地 SQLite，见 storage.py）
+
+    连接或数据库暂时不可用时回滚、重连并按指数退避重试 WRITER_RETRIES 次；仍失败的批次追加到溢出文件（见 spill.py），
+    之后每次写入成功时（以及启动时）重放。溢出也失败时把这些行的键从去重缓存中移除，broker 重投时可以再次入库。
+    由数据本身引起的错误（storage.DATA_ERRORS）不重试：把批次二分后分别写入，最终只把出错的那一行
+    写进拒收文件（溢出文件同目录的 *.rejected.jsonl）并计数，同批的其它行照常入库。
+    每行可以带一个 ack 回调（QoS 1 手动确认），只在提交成功、落盘或拒收之后调用。"""
+
+    def __init__(self, db_url=None, batch_size=None, flush_interval=None, max_queue=100000,
+                 dedup=None, spill_path=None):
+        self.db_url = db_url or config.STORAGE_URL or config.DB_URL
+        self.batch_size = batch_size or config.WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or config.WRITER_FLUSH_INTERVAL
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dedup = dedup
+        self.spill_path = spill_path
+        self.retries = config.WRITER_RETRIES
+        self.storage = None
+        self._thread = None
+        self._next_replay = 0.0
+        self.inserted = 0    # 实际写入的行数
+        self.conflicts = 0   # 被唯一约束拦下的重复行数
+        self.retried = 0     # 重试的批次数
+        self.spilled = 0     # 落盘到溢出文件的行数
+        self.replayed = 0    # 从溢出文件重放的行数
+        self.failed = 0      # 写入与落盘都失败的行数（已从去重缓存移除，等待 broker 重投）
+        self.rejected = 0    # 数据错误被拒收的行数
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="batch-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row, publish_ts=None, ack=None):
+        """row: (sensor_id, time_stamp, temperature, humidity, soil_moisture, is_anomaly)；
+        publish_ts 为发送端时间戳，提交后用于计算端到端延迟；ack 在该行提交或落盘后调用"""
+        self.queue.put((time.monotonic(), row, publish_ts, ack))
+
+    def _run(self):
+        self._replay_spill()
+        while True:
+            enqueued_at, row, publish_ts, ack = self.queue.get()
+            metrics.QUEUE_WAIT_SECONDS.observe(time.monotonic() - enqueued_at)
+            rows = [row]
+            stamps = [publish_ts]
+            acks = [ack]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    _, row, publish_ts, ack = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                rows.append(row)
+                stamps.append(publish_ts)
+                acks.append(ack)
+            profiler.tick("writer")
+            with profiler.stage("db_flush"):
+                ok = self._write(rows, stamps, acks)
+            if ok and time.monotonic() >= self._next_replay:
+                self._replay_spill()
+
+    def _connect(self):
+        if self.storage is None or self.storage.closed:
+            self.storage = storage.open_storage(self.db_url)
+        return self.storage
+
+    def _write(self, rows, stamps=(), acks=()):
+        """写入一批（暂时性错误时重试，数据错误时二分），成功、落盘或拒收后确认；返回是否写入了数据库"""
+        delay = config.MQTT_RECONNECT_MIN
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.retried += 1
+                time.sleep(delay)
+                delay = min(delay * 2, config.MQTT_RECONNECT_MAX)
+            try:
+                self._flush(rows, stamps)
+            except storage.DATA_ERRORS as e:
+                return self._write_split(rows, stamps, acks, e)
+            except Exception as e:
+                # 包括连接失败与数据库锁；写入线程不能退出，否则队列写满后会阻塞 MQTT 网络线程
+                logging.error(f"批量写入失败（{len(rows)} 条）: {e}")
+                continue
+            _ack_all(acks)
+            return True
+        if spill.append(self.spill_path, rows):
+            self.spilled += len(rows)
+            logging.warning(f"{len(rows)} 条写入失败的行已落盘到 {self.spill_path}，数据库恢复后重放")
+            _ack_all(acks)
+        else:
+            self.failed += len(rows)
+            if self.dedup is not None:
+                self.dedup.forget((row[0], row[1]) for row in rows)
+        return False
+
+    def _write_split(self, rows, stamps, acks, error):
+        """数据错误：单行时拒收，多行时二分后分别写入，出错的行不会连累同批的其它行"""
+        if len(rows) == 1:
+            self.rejected += 1
+            metrics.WRITER_REJECTED.inc()
+            logging.error(f"拒收无法写入的行 {rows[0]}: {error}")
+            spill.append(spill.rejected_path(self.spill_path), rows)
+            _ack_all(acks)
+            return False
+        stamps = list(stamps) or [None] * len(rows)
+        acks = list(acks) or [None] * len(rows)
+        mid = len(rows) // 2
+        first = self._write(rows[:mid], stamps[:mid], acks[:mid])
+        second = self._write(rows[mid:], stamps[mid:], acks[mid:])
+        return first and second
+
+    def _flush(self, rows, stamps=()):
+        """写入并提交一批，失败时丢弃连接并抛出原异常"""
+        store = None
+        try:
+            store = self._connect()
+            # 唯一约束 (sensor_id, time_stamp) 冲突的行直接跳过，作为去重的兜底
+            with metrics.DB_INSERT_SECONDS.time():
+                inserted = store.insert_rows(rows)
+            with metrics.DB_COMMIT_SECONDS.time():
+                store.commit()
+        except Exception:
+            self._discard_connection(store)
+            raise
+        commit_ts = time.time()
+        for row, publish_ts in zip(rows, stamps):
+            if publish_ts is not None:
+                lag_tracker.observe_commit(row[0], publish_ts, commit_ts)
+        metrics.BATCH_ROWS.observe(len(rows))
+        self.inserted += inserted
+        self.conflicts += len(rows) - inserted
+        metrics.log_sampled("writer.flush", logging.DEBUG,
+                            f"批量写入 {inserted}/{len(rows)} 条", every=100)
+
+    def _discard_connection(self, store):
+        if store is None:
+            return
+        try:
+            if not store.closed:
+                store.rollback()
+        except storage.ERRORS:
+            pass
+        try:
+            store.close()  # 下次写入重新连接
+        except storage.ERRORS:
+            pass
+        self.storage = None
+
+    def _replay_spill(self):
+        """重放溢出文件；重放失败的批次由 _write 重新落盘"""
+        self._next_replay = time.monotonic() + config.MQTT_RECONNECT_MAX
+        rows = [tuple(row) for row in spill.take(self.spill_path)]
+        if not rows:
+            return
+        logging.info(f"重放溢出文件中的 {len(rows)} 行")
+        for i in range(0, len(rows), self.batch_size):
+            batch = rows[i:i + self.batch_size]
+            if self._write(batch):
+                self.replayed += len(batch)
+        spill.done(self.spill_path)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "inserted": self.inserted,
+            "conflicts": self.conflicts,
+            "retried": self.retried,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def _ack_all(acks):
+    for ack in acks:
+        if ack is not None:
+            ack()
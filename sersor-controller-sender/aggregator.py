@@ -0,0 +1,109 @@
+# aggregator.py
+
+"""
+aggregator.py
+
+边缘预聚合：在发送端按固定窗口累计每个传感器的 条数 / 和 / 平方和 / 最小值 / 最大值，
+窗口结束时每个分区（zone）只发布一条汇总消息；窗口内只有异常读数会逐条原样发布。
+
+接收端由和与平方和即可还原窗口内的平均值与标准差（与逐条入库再 AVG/STDDEV 结果一致），
+多个窗口还可以继续相加合并，因此长期趋势不损失统计精度，流量约为逐条发送的 1/窗口轮数。
+
+窗口按 Unix 时间对齐到 window_sec 的整数倍（例如 300 秒窗口对齐到整 5 分钟），
+收到属于下一个窗口的读数时关闭当前窗口并返回汇总。
+
+汇总消息格式（发布到 <主题前缀>/summary）：
+    {
+        "type": "summary",
+        "zone": 0,
+        "window_start": "2025-06-05T14:20:00",
+        "window_end":   "2025-06-05T14:25:00",
+        "sensor_ids": [1, 2, ...],
+        "count":      [30, 30, ...],
+        "anomalies":  [0, 1, ...],
+        "sum":   [[t, h, s], ...],     # 每个传感器一行，列依次为温度、湿度、土壤含水量
+        "sumsq": [[t, h, s], ...],
+        "min":   [[t, h, s], ...],
+        "max":   [[t, h, s], ...]
+    }
+"""
+
+import datetime
+
+import numpy as np
+
+
+class WindowAggregator:
+    """
+    参数：
+        sensor_ids (array-like): 形状 (Z, S)，每个分区的传感器编号。
+        window_sec (float)     : 窗口长度（秒）。
+        zone_ids   (array-like): 形状 (Z,)，汇总消息中的分区编号，默认 0..Z-1。
+    """
+
+    def __init__(self, sensor_ids, window_sec: float, zone_ids=None):
+        self.sensor_ids = np.asarray(sensor_ids, dtype=np.int64)
+        num_zones, num_sensors = self.sensor_ids.shape
+        self.zone_ids = np.arange(num_zones) if zone_ids is None else np.asarray(zone_ids)
+        self.window_sec = float(window_sec)
+        self.window_start = None
+        self.count = np.zeros((num_zones, num_sensors), dtype=np.int64)
+        self.anomalies = np.zeros((num_zones, num_sensors), dtype=np.int64)
+        self.sum = np.zeros((num_zones, num_sensors, 3))
+        self.sumsq = np.zeros((num_zones, num_sensors, 3))
+        self.min = np.full((num_zones, num_sensors, 3), np.inf)
+        self.max = np.full((num_zones, num_sensors, 3), -np.inf)
+
+    def add(self, values, is_anomaly, ts: float) -> list:
+        """
+        累计一轮读数。values 形状 (Z, S, 3)，is_anomaly 形状 (Z, S)，ts 为这一轮的 Unix 时间戳。
+        若 ts 已进入下一个窗口，先关闭当前窗口，返回各分区的汇总消息（字典列表），否则返回 []。
+        """
+        window_start = ts - ts % self.window_sec
+        summaries = []
+        if self.window_start is not None and window_start != self.window_start:
+            summaries = self.flush()
+        if self.window_start is None:
+            self.window_start = window_start
+
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        self.anomalies += np.asarray(is_anomaly, dtype=np.int64)
+        self.sum += values
+        self.sumsq += values * values
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+        return summaries
+
+    def flush(self) -> list:
+        """关闭当前窗口（退出时也可调用以发出不完整窗口），返回各分区的汇总并清零"""
+        if self.window_start is None or not self.count.any():
+            self.window_start = None
+            return []
+        start = datetime.datetime.fromtimestamp(self.window_start)
+        end = start + datetime.timedelta(seconds=self.window_sec)
+        summaries = []
+        for zi, zone in enumerate(self.zone_ids):
+            seen = self.count[zi] > 0
+            summaries.append({
+                "type": "summary",
+                "zone": int(zone),
+                "window_start": start.isoformat(),
+                "window_end": end.isoformat(),
+                "sensor_ids": self.sensor_ids[zi, seen].tolist(),
+                "count": self.count[zi, seen].tolist(),
+                "anomalies": self.anomalies[zi, seen].tolist(),
+                "sum": np.round(self.sum[zi, seen], 4).tolist(),
+                "sumsq": np.round(self.sumsq[zi, seen], 4).tolist(),
+                "min": self.min[zi, seen].tolist(),
+                "max": self.max[zi, seen].tolist(),
+            })
+
+        self.window_start = None
+        self.count[:] = 0
+        self.anomalies[:] = 0
+        self.sum[:] = 0.0
+        self.sumsq[:] = 0.0
+        self.min[:] = np.inf
+        self.max[:] = -np.inf
+        return summaries
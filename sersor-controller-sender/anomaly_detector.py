@@ -7,8 +7,11 @@ anomaly_detector.py
   1. 单个传感器值是否超出预设的“正常范围”；
   2. 本轮所有传感器的平均值是否超出预设的“正常平均范围”。
 
+阈值来自 rules.py（内置默认值，或规则文件/数据库 plants 表编译出的按传感器查找表），
+本模块不再自行硬编码阈值。
+
 提供函数：
-    detect_anomalies(batch) -> (single_alerts, avg_alert)
+    detect_anomalies(batch, rules=None) -> (single_alerts, avg_alert)
 
     - batch: list of dict，每个 dict 示例：
         {
@@ -25,26 +28,25 @@ anomaly_detector.py
 
     - avg_alert: list of tuples，列出所有平均值超限信息，示例：
         [("avg_temperature", avg_value), ("avg_humidity", avg_value), ...]
+
+    detect_anomalies_arrays(temps, hums, soils, limits=None, avg_limits=None) -> (single_mask, avgs, avg_mask)
+    多分区向量化版本，输入形状 (Z, S) 的读数矩阵；limits / avg_limits 为从编译规则中取出的阈值数组。
 """
 
-# 单个传感器可接受阈值（请根据大棚实际情况自行调整）
-TEMP_MIN = 15.0       # 温度最低阈值 (℃)
-TEMP_MAX = 30.0       # 温度最高阈值 (℃)
-HUM_MIN  = 30.0       # 湿度最低阈值 (%RH)
-HUM_MAX  = 80.0       # 湿度最高阈值 (%RH)
-SOIL_MIN = 100.0      # 土壤含水量最低阈值（单位自定）
-SOIL_MAX = 700.0      # 土壤含水量最高阈值（单位自定）
+import numpy as np
 
-# 平均值可接受阈值（可以与单传感器阈值相同，也可以做适度收紧或放宽）
-AVG_TEMP_MIN  = 17.0  # 平均温度最低阈值 (℃)
-AVG_TEMP_MAX  = 28.0  # 平均温度最高阈值 (℃)
-AVG_HUM_MIN   = 40.0  # 平均湿度最低阈值 (%RH)
-AVG_HUM_MAX   = 75.0  # 平均湿度最高阈值 (%RH)
-AVG_SOIL_MIN  = 200.0 # 平均土壤含水量最低阈值（单位自定）
-AVG_SOIL_MAX  = 600.0 # 平均土壤含水量最高阈值（单位自定）
+from rules import DEFAULT_LIMITS, DEFAULT_RULES, METRICS
 
+# 内置默认阈值（保留原名供其他模块引用；实际检测使用传入的编译规则）
+TEMP_MIN, TEMP_MAX = DEFAULT_LIMITS["temperature"]
+HUM_MIN, HUM_MAX = DEFAULT_LIMITS["humidity"]
+SOIL_MIN, SOIL_MAX = DEFAULT_LIMITS["soil_moisture"]
+AVG_TEMP_MIN, AVG_TEMP_MAX = DEFAULT_LIMITS["avg_temperature"]
+AVG_HUM_MIN, AVG_HUM_MAX = DEFAULT_LIMITS["avg_humidity"]
+AVG_SOIL_MIN, AVG_SOIL_MAX = DEFAULT_LIMITS["avg_soil_moisture"]
 
-def detect_anomalies(batch):
+
+def detect_anomalies(batch, rules=None):
     """
     检测一批传感器读数中的异常，包括两个方面：
       1. 单个传感器是否超出对应的阈值范围；
@@ -60,6 +62,8 @@ def detect_anomalies(batch):
               "soil_moisture": 512,
               "is_anomaly": False
             }
+        rules (CompiledRules): 编译后的阈值规则（RuleSet.current()），默认使用内置阈值。
+            单传感器阈值按 sensor_id 查表，平均值阈值取分区 0。
 
     返回：
         single_alerts (list of tuples): 单传感器超限警告列表。
@@ -70,64 +74,56 @@ def detect_anomalies(batch):
             形如 [("avg_temperature", avg_val), ("avg_humidity", avg_val), ...]。
             如果平均温度、湿度、土壤含水量都在阈值内，则返回空列表 []。
     """
-    single_alerts = []
-    temps = []
-    hums  = []
-    soils = []
-
-    # 遍历所有记录，检查单个传感器值是否超出阈值
-    for rec in batch:
-        sid = rec.get("sensor_id")
-        t   = rec.get("temperature")
-        h   = rec.get("humidity")
-        s   = rec.get("soil_moisture")
-
-        # 收集到列表，稍后用于计算平均值
-        temps.append(t)
-        hums.append(h)
-        soils.append(s)
-
-        # 温度阈值检测
-        if t < TEMP_MIN or t > TEMP_MAX:
-            single_alerts.append((sid, "temperature", t))
-        # 湿度阈值检测
-        if h < HUM_MIN or h > HUM_MAX:
-            single_alerts.append((sid, "humidity", h))
-        # 土壤含水量阈值检测
-        if s < SOIL_MIN or s > SOIL_MAX:
-            single_alerts.append((sid, "soil_moisture", s))
-
-    # 计算平均值
-    if temps:
-        avg_t = sum(temps) / len(temps)
-    else:
-        avg_t = None
+    if not batch:
+        return [], []
+    rules = DEFAULT_RULES if rules is None else rules
+
+    # 收集成 (N, 3) 数组，按 sensor_id 一次性查表得到每条记录的阈值
+    sensor_ids = [rec.get("sensor_id") for rec in batch]
+    values = np.array([[rec.get(k) for k in METRICS] for rec in batch], dtype=np.float64)
+    lo, hi = rules.sensor_limits(sensor_ids)
+    single_mask = (values < lo) | (values > hi)
+
+    # 单传感器超限：按记录顺序、温度/湿度/土壤顺序输出原始值
+    single_alerts = [(sensor_ids[i], METRICS[j], batch[i].get(METRICS[j]))
+                     for i, j in zip(*np.nonzero(single_mask))]
+
+    # 平均值超限（单温室模式为分区 0）
+    avg_t, avg_h, avg_s = values.mean(axis=0)
+    avg_lo, avg_hi = rules.zone_limits(0)
+    avg_alert = []
+    if avg_t < avg_lo[0] or avg_t > avg_hi[0]:
+        avg_alert.append(("avg_temperature", round(float(avg_t), 2)))
+    if avg_h < avg_lo[1] or avg_h > avg_hi[1]:
+        avg_alert.append(("avg_humidity", round(float(avg_h), 2)))
+    if avg_s < avg_lo[2] or avg_s > avg_hi[2]:
+        avg_alert.append(("avg_soil_moisture", int(avg_s)))
 
-    if hums:
-        avg_h = sum(hums) / len(hums)
-    else:
-        avg_h = None
+    return single_alerts, avg_alert
 
-    if soils:
-        avg_s = sum(soils) / len(soils)
-    else:
-        avg_s = None
 
-    avg_alert = []
-    # 平均温度阈值检测
-    if avg_t is not None:
-        if avg_t < AVG_TEMP_MIN or avg_t > AVG_TEMP_MAX:
-            avg_alert.append(("avg_temperature", round(avg_t, 2)))
-    # 平均湿度阈值检测
-    if avg_h is not None:
-        if avg_h < AVG_HUM_MIN or avg_h > AVG_HUM_MAX:
-            avg_alert.append(("avg_humidity", round(avg_h, 2)))
-    # 平均土壤含水量阈值检测
-    if avg_s is not None:
-        if avg_s < AVG_SOIL_MIN or avg_s > AVG_SOIL_MAX:
-            avg_alert.append(("avg_soil_moisture", int(avg_s)))
+def detect_anomalies_arrays(temps, hums, soils, limits=None, avg_limits=None):
+    """
+    向量化检测多个分区的一轮读数。
 
-    return single_alerts, avg_alert
+    参数：
+        temps, hums, soils (np.ndarray): 形状 (Z, S)，Z 个分区、每区 S 个传感器。
+        limits     (tuple): (lo, hi)，可广播到 (Z, S, 3)，通常为 CompiledRules.sensor_limits(sensor_ids)；
+                            传感器集合固定时调用方在规则版本变化时才需要重新查表。默认内置阈值。
+        avg_limits (tuple): (avg_lo, avg_hi)，可广播到 (Z, 3)，通常为 CompiledRules.zone_limits(zone_ids)。
+
+    返回：
+        single_mask (np.ndarray[bool]): 形状 (Z, S, 3)，最后一维依次为温度/湿度/土壤是否超出单传感器阈值。
+        avgs        (np.ndarray)      : 形状 (Z, 3)，每个分区本轮的平均温度/湿度/土壤含水量。
+        avg_mask    (np.ndarray[bool]): 形状 (Z, 3)，平均值是否超出平均阈值。
+    """
+    lo, hi = (DEFAULT_RULES.default_lo, DEFAULT_RULES.default_hi) if limits is None else limits
+    avg_lo, avg_hi = (DEFAULT_RULES.default_avg_lo, DEFAULT_RULES.default_avg_hi) if avg_limits is None else avg_limits
+    values = np.stack([temps, hums, soils], axis=-1).astype(np.float64)
+    single_mask = (values < lo) | (values > hi)
+    avgs = values.mean(axis=1)
+    avg_mask = (avgs < avg_lo) | (avgs > avg_hi)
+    return single_mask, avgs, avg_mask
 
 
 # 如果直接运行此模块，将对一个示例 batch 进行检测并打印结果
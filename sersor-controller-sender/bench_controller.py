@@ -0,0 +1,59 @@
+# bench_controller.py
+
+"""
+bench_controller.py
+
+基准测试：ZoneController 每轮更新多个分区基准的耗时。
+平均值按正态分布生成，约有一部分分区超出阈值，以覆盖补偿与决策记录路径。
+
+用法：
+    python bench_controller.py --zones 10000 --rounds 200 [--ki 0.1 --kd 0.05]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from controller import ZoneController
+
+
+def bench(num_zones: int, rounds: int, kp: float, ki: float, kd: float) -> dict:
+    rng = np.random.default_rng(0)
+    bases = np.tile([25.0, 60.0, 500.0], (num_zones, 1))
+    ctrl = ZoneController(num_zones, kp=kp, ki=ki, kd=kd)
+
+    # 预先生成每轮的平均值，计时只覆盖控制器本身
+    avgs = rng.normal([25.0, 60.0, 500.0], [3.0, 10.0, 80.0], size=(rounds, num_zones, 3))
+
+    timings = np.empty(rounds)
+    decisions_total = 0
+    for r in range(rounds):
+        started = time.perf_counter()
+        bases, decisions = ctrl.update(bases, avgs[r])
+        timings[r] = time.perf_counter() - started
+        decisions_total += len(decisions)
+
+    return {
+        "zones": num_zones,
+        "rounds": rounds,
+        "mean_ms": round(timings.mean() * 1000, 3),
+        "p50_ms": round(np.percentile(timings, 50) * 1000, 3),
+        "p99_ms": round(np.percentile(timings, 99) * 1000, 3),
+        "decisions_per_round": round(decisions_total / rounds, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ZoneController 基准测试")
+    parser.add_argument("--zones", "-z", type=int, default=10000, help="分区数（默认 10000）")
+    parser.add_argument("--rounds", "-r", type=int, default=200, help="轮数（默认 200）")
+    parser.add_argument("--kp", type=float, default=1.0)
+    parser.add_argument("--ki", type=float, default=0.0)
+    parser.add_argument("--kd", type=float, default=0.0)
+    args = parser.parse_args()
+
+    result = bench(args.zones, args.rounds, args.kp, args.ki, args.kd)
+    print(f"分区 {result['zones']} × {result['rounds']} 轮：每轮平均 {result['mean_ms']} ms，"
+          f"p50 {result['p50_ms']} ms，p99 {result['p99_ms']} ms，"
+          f"平均每轮 {result['decisions_per_round']} 条决策记录")
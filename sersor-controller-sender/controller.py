@@ -5,24 +5,162 @@ controller.py
 
 负责“根据检测结果调整基准温度/湿度/土壤含水量”的模块，带有：
   - 最大补偿能力限制（max_comp_*）
-  - 当需要补偿量超过最大能力时，打印“请人工干预”警告
+  - 当需要补偿量超过最大能力时，给出“请人工干预”警告
+
+核心是表驱动、向量化的 ZoneController：
+  - METRIC_TABLE 每行描述一个指标（告警键、平均阈值、补偿步长、最大补偿、单位），
+    温度/湿度/土壤不再各写一段 if/elif；
+  - 一次调用即可更新任意多个分区（zone）的基准，输入输出均为 (Z, 3) 数组；
+  - 补偿量 = P/I/D 三项之和，按步长向上取整后再限幅到最大补偿能力；
+    默认 kp=1、ki=kd=0，即“所需补偿多少就补多少，但不超过最大能力”；
+  - 积分项与上一轮误差按分区保存，指标回到阈值内时积分清零（防积分饱和）；
+  - 不打印，返回结构化决策记录（numpy 结构化数组，每个“分区×指标”的动作一行）；
+  - 平均值阈值来自 rules.py，规则热加载后用 set_limits() 换上新的分区阈值，积分状态保留。
 
 函数：
     update_baselines(
         base_temp, base_hum, base_soil,
         avg_alert,
         temp_step=0.1, hum_step=0.2, soil_step=2.0,
-        max_temp_comp=3.0, max_hum_comp=5.0, max_soil_comp=20.0
+        max_temp_comp=3.0, max_hum_comp=5.0, max_soil_comp=20.0,
+        verbose=True, rules=None
     ) -> (new_base_temp, new_base_hum, new_base_soil)
+    单温室的兼容接口，内部使用 1 个分区的 ZoneController，verbose 时把决策记录打印成原来的提示。
+
+    format_decision(record) -> str
+    把一条决策记录格式化为控制台提示。
 """
 
-# 平均值正常阈值（保持与 anomaly_detector.py 一致）
-AVG_TEMP_MIN   = 17.0   # 平均温度最低阈值 (℃)
-AVG_TEMP_MAX   = 28.0   # 平均温度最高阈值 (℃)
-AVG_HUM_MIN    = 40.0   # 平均湿度最低阈值 (%RH)
-AVG_HUM_MAX    = 75.0   # 平均湿度最高阈值 (%RH)
-AVG_SOIL_MIN   = 200.0  # 平均土壤含水量最低阈值（单位自定）
-AVG_SOIL_MAX   = 600.0  # 平均土壤含水量最高阈值（单位自定）
+import numpy as np
+
+from rules import DEFAULT_LIMITS
+
+# 平均值正常阈值的内置默认值（与 anomaly_detector.py 同源于 rules.DEFAULT_LIMITS）
+AVG_TEMP_MIN, AVG_TEMP_MAX = DEFAULT_LIMITS["avg_temperature"]
+AVG_HUM_MIN, AVG_HUM_MAX = DEFAULT_LIMITS["avg_humidity"]
+AVG_SOIL_MIN, AVG_SOIL_MAX = DEFAULT_LIMITS["avg_soil_moisture"]
+
+# 指标表：(告警键, 中文名, 平均下限, 平均上限, 默认步长, 默认最大补偿, 单位)
+# 行顺序即数组最后一维的顺序：0 = 温度，1 = 湿度，2 = 土壤含水量
+METRIC_TABLE = (
+    ("avg_temperature",   "温度",       AVG_TEMP_MIN, AVG_TEMP_MAX, 0.1, 3.0,  " ℃"),
+    ("avg_humidity",      "湿度",       AVG_HUM_MIN,  AVG_HUM_MAX,  0.2, 5.0,  "%RH"),
+    ("avg_soil_moisture", "土壤含水量", AVG_SOIL_MIN, AVG_SOIL_MAX, 2.0, 20.0, ""),
+)
+METRIC_INDEX = {row[0]: i for i, row in enumerate(METRIC_TABLE)}
+
+# 决策记录：每个发生补偿的“分区×指标”一行
+DECISION_DTYPE = np.dtype([
+    ("zone",     np.int64),    # 分区下标
+    ("metric",   np.int8),     # METRIC_TABLE 行号
+    ("avg",      np.float64),  # 本轮平均值
+    ("required", np.float64),  # 回到阈值所需补偿（正数上调，负数下调）
+    ("applied",  np.float64),  # 实际补偿量（已按步长取整并限幅）
+    ("old_base", np.float64),
+    ("new_base", np.float64),
+    ("manual",   np.bool_),    # 所需补偿超过最大能力，需要人工干预
+])
+
+
+def _per_zone(value, default, num_zones):
+    """把 (3,) 或 (Z, 3) 的参数统一广播成 (Z, 3)"""
+    value = default if value is None else value
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (num_zones, 3))
+
+
+class ZoneController:
+    """
+    多分区基准控制器。
+
+    参数：
+        num_zones (int): 分区数 Z。
+        lo / hi  (array-like): 平均值下限/上限，形状 (3,) 或 (Z, 3)，默认取 METRIC_TABLE。
+        step     (array-like): 补偿步长，形状 (3,) 或 (Z, 3)；补偿量按步长向上取整。
+        max_comp (array-like): 每轮最大补偿能力，形状 (3,) 或 (Z, 3)。
+        kp / ki / kd (float) : 比例/积分/微分系数，默认 1/0/0。
+        integral_limit (array-like): 积分项绝对值上限，默认等于 max_comp。
+    """
+
+    def __init__(self, num_zones, lo=None, hi=None, step=None, max_comp=None,
+                 kp=1.0, ki=0.0, kd=0.0, integral_limit=None):
+        table = np.array([row[2:6] for row in METRIC_TABLE], dtype=np.float64)
+        self.num_zones = num_zones
+        self.lo = _per_zone(lo, table[:, 0], num_zones)
+        self.hi = _per_zone(hi, table[:, 1], num_zones)
+        self.step = _per_zone(step, table[:, 2], num_zones)
+        self.max_comp = _per_zone(max_comp, table[:, 3], num_zones)
+        self.integral_limit = _per_zone(integral_limit, self.max_comp, num_zones)
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.integral = np.zeros((num_zones, 3))
+        self.prev_error = np.zeros((num_zones, 3))
+
+    def set_limits(self, lo, hi):
+        """换上新的平均值阈值（例如 CompiledRules.zone_limits(zone_ids)），形状 (3,) 或 (Z, 3)"""
+        self.lo = _per_zone(lo, None, self.num_zones)
+        self.hi = _per_zone(hi, None, self.num_zones)
+
+    def update(self, bases, avgs):
+        """
+        参数：
+            bases (np.ndarray): 形状 (Z, 3)，当前基准。
+            avgs  (np.ndarray): 形状 (Z, 3)，本轮平均值；NaN 表示该指标本轮无数据，不做控制。
+
+        返回：
+            (new_bases, decisions)：new_bases 形状 (Z, 3)；decisions 为 DECISION_DTYPE 结构化数组。
+        """
+        bases = np.asarray(bases, dtype=np.float64)
+        avgs = np.asarray(avgs, dtype=np.float64)
+
+        # 误差：回到阈值区间所需的补偿（超上限为负，低于下限为正，区间内或无数据为 0）
+        error = np.where(avgs > self.hi, self.hi - avgs, np.where(avgs < self.lo, self.lo - avgs, 0.0))
+        out_of_range = error != 0.0
+
+        # PID：区间内积分清零，避免回到正常后继续推动基准
+        self.integral = np.where(out_of_range,
+                                 np.clip(self.integral + error, -self.integral_limit, self.integral_limit),
+                                 0.0)
+        u = self.kp * error
+        if self.ki:
+            u = u + self.ki * self.integral
+        if self.kd:
+            u = u + self.kd * (error - self.prev_error)
+        self.prev_error = error
+
+        # 按步长向上取整（减去微小量避免浮点误差多进一步），再限幅到最大补偿能力
+        u = np.sign(u) * np.ceil(np.abs(u) / self.step - 1e-9) * self.step
+        applied = np.where(out_of_range, np.clip(u, -self.max_comp, self.max_comp), 0.0)
+        new_bases = bases + applied
+
+        zone_idx, metric_idx = np.nonzero(out_of_range)
+        decisions = np.empty(len(zone_idx), dtype=DECISION_DTYPE)
+        decisions["zone"] = zone_idx
+        decisions["metric"] = metric_idx
+        decisions["avg"] = avgs[zone_idx, metric_idx]
+        decisions["required"] = error[zone_idx, metric_idx]
+        decisions["applied"] = applied[zone_idx, metric_idx]
+        decisions["old_base"] = bases[zone_idx, metric_idx]
+        decisions["new_base"] = new_bases[zone_idx, metric_idx]
+        decisions["manual"] = np.abs(decisions["required"]) > self.max_comp[zone_idx, metric_idx]
+        return new_bases, decisions
+
+
+def format_decision(record) -> str:
+    """把一条决策记录格式化为与原先一致的控制台提示"""
+    _, name, _, _, _, _, unit = METRIC_TABLE[int(record["metric"])]
+    avg = float(record["avg"])
+    required = abs(float(record["required"]))
+    applied = abs(float(record["applied"]))
+    above = record["required"] < 0
+    # 所需补偿 = 阈值 - 平均值，由此还原本次生效的阈值（规则可能按分区不同）
+    limit = round(avg + float(record["required"]), 6)
+    if record["manual"]:
+        # 需要人工干预时实际补偿已被限幅到最大补偿能力
+        return (f"⚠️ 平均{name} = {avg:.2f}{unit}， {'超出上限' if above else '低于下限'} {limit}{unit}，"
+                f"所需补偿 {required:.2f}{unit} ＞ 最大可补偿 {applied:.2f}{unit}；"
+                f"已补偿 {applied:.2f}{unit}，剩余 {required - applied:.2f}{unit} 无法自动消解，请人工干预！")
+    return (f"🔧 平均{name} = {avg:.2f}{unit} {'＞' if above else '＜'} {limit}{unit}，"
+            f"已补偿 {applied:.2f}{unit}，新基准{name} {float(record['old_base']):.2f}{unit} → "
+            f"{float(record['new_base']):.2f}{unit}")
 
 
 def update_baselines(
@@ -35,118 +173,50 @@ def update_baselines(
     soil_step: float = 2.0,
     max_temp_comp: float = 3.0,
     max_hum_comp: float = 5.0,
-    max_soil_comp: float = 20.0
+    max_soil_comp: float = 20.0,
+    verbose: bool = True,
+    rules=None
 ) -> tuple:
     """
-    根据平均值告警调整基准，并在“需要补偿量 > 最大可补偿量”时打印人工干预告警。
+    根据平均值告警调整基准，并在“需要补偿量 > 最大可补偿量”时提示人工干预。
 
     参数：
         base_temp      (float): 当前基准温度 (℃)。
         base_hum       (float): 当前基准湿度 (%RH)。
         base_soil      (float): 当前基准土壤含水量（单位自定）。
         avg_alert      (list) : 平均值告警列表，形如 [("avg_temperature", val), ...]。
-        temp_step      (float): 温度单次补偿步长（单位℃），默认 0.1℃。
-        hum_step       (float): 湿度单次补偿步长（单位%RH），默认 0.2%RH。
-        soil_step      (float): 土壤含水量单次补偿步长（单位自定），默认 2 单位。
+        temp_step      (float): 温度补偿步长（单位℃），补偿量按步长向上取整，默认 0.1℃。
+        hum_step       (float): 湿度补偿步长（单位%RH），默认 0.2%RH。
+        soil_step      (float): 土壤含水量补偿步长（单位自定），默认 2 单位。
         max_temp_comp  (float): 温度每轮最大补偿能力（单位℃），默认 3.0℃。
         max_hum_comp   (float): 湿度每轮最大补偿能力（单位%RH），默认 5.0%RH。
         max_soil_comp  (float): 土壤含水量每轮最大补偿能力（单位自定），默认 20 单位。
+        verbose        (bool) : 是否把决策记录打印为控制台提示，默认 True。
+        rules (CompiledRules) : 编译后的阈值规则，平均值阈值取分区 0；默认使用内置阈值。
 
     返回：
         (new_base_temp, new_base_hum, new_base_soil)
     """
-
-    # 记录当前值以便后面对比
-    old_temp, old_hum, old_soil = base_temp, base_hum, base_soil
-
-    # 遍历 avg_alert，针对每一类平均值超限做“所需补偿”与“最大补偿”比较
-    for (key, val) in avg_alert:
-
-        if key == "avg_temperature":
-            # 计算“实际所需补偿量”：
-            # 若 avg 温度 > 上限，要降低： required = avg - AVG_TEMP_MAX；
-            # 若 avg 温度 < 下限，要提高： required = AVG_TEMP_MIN - avg
-            if val > AVG_TEMP_MAX:
-                required = val - AVG_TEMP_MAX
-                # 真正要补偿的量是 min(required, max_temp_comp)
-                to_comp = min(required, max_temp_comp)
-                base_temp -= to_comp
-                if required > max_temp_comp:
-                    print(f"⚠️ 平均温度 = {val:.2f} ℃， 超出上限 {AVG_TEMP_MAX} ℃，"
-                          f"所需补偿 {required:.2f} ℃ ＞ 最大可补偿 {max_temp_comp:.2f} ℃；"
-                          f"已补偿 {to_comp:.2f} ℃，剩余 {required - to_comp:.2f} ℃ 无法自动消解，请人工干预！")
-                else:
-                    print(f"🔧 平均温度 = {val:.2f} ℃ ＞ {AVG_TEMP_MAX} ℃，"
-                          f"已补偿 {to_comp:.2f} ℃，新基准温度 {old_temp:.2f} ℃ → {base_temp:.2f} ℃")
-            elif val < AVG_TEMP_MIN:
-                required = AVG_TEMP_MIN - val
-                to_comp = min(required, max_temp_comp)
-                base_temp += to_comp
-                if required > max_temp_comp:
-                    print(f"⚠️ 平均温度 = {val:.2f} ℃， 低于下限 {AVG_TEMP_MIN} ℃，"
-                          f"所需补偿 {required:.2f} ℃ ＞ 最大可补偿 {max_temp_comp:.2f} ℃；"
-                          f"已补偿 {to_comp:.2f} ℃，剩余 {required - to_comp:.2f} ℃ 无法自动消解，请人工干预！")
-                else:
-                    print(f"🔧 平均温度 = {val:.2f} ℃ ＜ {AVG_TEMP_MIN} ℃，"
-                          f"已补偿 {to_comp:.2f} ℃，新基准温度 {old_temp:.2f} ℃ → {base_temp:.2f} ℃")
-
-            # 更新 old_temp，以免下一次打印时显示错误的“旧值”
-            old_temp = base_temp
-
-        elif key == "avg_humidity":
-            if val > AVG_HUM_MAX:
-                required = val - AVG_HUM_MAX
-                to_comp = min(required, max_hum_comp)
-                base_hum -= to_comp
-                if required > max_hum_comp:
-                    print(f"⚠️ 平均湿度 = {val:.2f}%RH， 超出上限 {AVG_HUM_MAX}%RH，"
-                          f"所需补偿 {required:.2f}%RH ＞ 最大可补偿 {max_hum_comp:.2f}%RH；"
-                          f"已补偿 {to_comp:.2f}%RH，剩余 {required - to_comp:.2f}%RH 无法自动消解，请人工干预！")
-                else:
-                    print(f"🔧 平均湿度 = {val:.2f}%RH ＞ {AVG_HUM_MAX}%RH，"
-                          f"已补偿 {to_comp:.2f}%RH，新基准湿度 {old_hum:.2f}%RH → {base_hum:.2f}%RH")
-            elif val < AVG_HUM_MIN:
-                required = AVG_HUM_MIN - val
-                to_comp = min(required, max_hum_comp)
-                base_hum += to_comp
-                if required > max_hum_comp:
-                    print(f"⚠️ 平均湿度 = {val:.2f}%RH， 低于下限 {AVG_HUM_MIN}%RH，"
-                          f"所需补偿 {required:.2f}%RH ＞ 最大可补偿 {max_hum_comp:.2f}%RH；"
-                          f"已补偿 {to_comp:.2f}%RH，剩余 {required - to_comp:.2f}%RH 无法自动消解，请人工干预！")
-                else:
-                    print(f"🔧 平均湿度 = {val:.2f}%RH ＜ {AVG_HUM_MIN}%RH，"
-                          f"已补偿 {to_comp:.2f}%RH，新基准湿度 {old_hum:.2f}%RH → {base_hum:.2f}%RH")
-
-            old_hum = base_hum
-
-        elif key == "avg_soil_moisture":
-            if val > AVG_SOIL_MAX:
-                required = val - AVG_SOIL_MAX
-                to_comp = min(required, max_soil_comp)
-                base_soil -= to_comp
-                if required > max_soil_comp:
-                    print(f"⚠️ 平均土壤含水量 = {val:.2f}， 超出上限 {AVG_SOIL_MAX}，"
-                          f"所需补偿 {required:.2f} ＞ 最大可补偿 {max_soil_comp:.2f}；"
-                          f"已补偿 {to_comp:.2f}，剩余 {required - to_comp:.2f} 无法自动消解，请人工干预！")
-                else:
-                    print(f"🔧 平均土壤含水量 = {val:.2f} ＞ {AVG_SOIL_MAX}，"
-                          f"已补偿 {to_comp:.2f}，新基准土壤含水量 {old_soil:.2f} → {base_soil:.2f}")
-            elif val < AVG_SOIL_MIN:
-                required = AVG_SOIL_MIN - val
-                to_comp = min(required, max_soil_comp)
-                base_soil += to_comp
-                if required > max_soil_comp:
-                    print(f"⚠️ 平均土壤含水量 = {val:.2f}， 低于下限 {AVG_SOIL_MIN}，"
-                          f"所需补偿 {required:.2f} ＞ 最大可补偿 {max_soil_comp:.2f}；"
-                          f"已补偿 {to_comp:.2f}，剩余 {required - to_comp:.2f} 无法自动消解，请人工干预！")
-                else:
-                    print(f"🔧 平均土壤含水量 = {val:.2f} ＜ {AVG_SOIL_MIN}，"
-                          f"已补偿 {to_comp:.2f}，新基准土壤含水量 {old_soil:.2f} → {base_soil:.2f}")
-
-            old_soil = base_soil
-
-    # 完成所有平均值告警的补偿与提示后，返回新基准
-    return base_temp, base_hum, base_soil
+    avgs = np.full((1, 3), np.nan)
+    for key, val in avg_alert:
+        if key in METRIC_INDEX:
+            avgs[0, METRIC_INDEX[key]] = val
+
+    lo, hi = (None, None) if rules is None else rules.zone_limits(0)
+    ctrl = ZoneController(
+        1,
+        lo=lo,
+        hi=hi,
+        step=(temp_step, hum_step, soil_step),
+        max_comp=(max_temp_comp, max_hum_comp, max_soil_comp)
+    )
+    new_bases, decisions = ctrl.update([[base_temp, base_hum, base_soil]], avgs)
+    if verbose:
+        for record in decisions:
+            print(format_decision(record))
+
+    new_t, new_h, new_s = (float(v) for v in new_bases[0])
+    return new_t, new_h, new_s
 
 
 # 如果直接运行此模块，将演示 update_baselines() 的效果
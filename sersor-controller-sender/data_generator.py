@@ -7,6 +7,9 @@ data_generator.py
 传感器读数，其中包含随机噪声、小概率注入的异常，以及时间戳。
 
 现在每条记录在 "sensor_id" 前增加一个 "id" 字段，数值与 sensor_id 相同。
+
+generate_zone_arrays() 是面向多温室分区（zone）的向量化版本：一次生成
+(分区数, 每区传感器数) 的读数矩阵，用于大规模仿真（见 fleet_sim.py）。
 """
 
 import datetime
@@ -82,6 +85,46 @@ def generate_batch(
     return batch
 
 
+def generate_zone_arrays(
+    base_temp: np.ndarray,
+    base_hum: np.ndarray,
+    base_soil: np.ndarray,
+    sensors_per_zone: int = 30,
+    anomaly_rate: float = 0.05,
+    rng: np.random.Generator = None
+) -> tuple:
+    """
+    向量化生成多个分区的一轮读数，噪声与异常注入规则与 generate_batch() 相同。
+
+    参数：
+        base_temp / base_hum / base_soil (np.ndarray): 形状 (Z,)，每个分区的基准值。
+        sensors_per_zone (int): 每个分区的传感器数量 S。
+        anomaly_rate   (float): 注入异常的概率（0~1）。
+        rng (np.random.Generator): 随机数生成器，默认新建一个。
+
+    返回：
+        (temps, hums, soils, is_anom)：形状均为 (Z, S)；
+        temps/hums 已保留两位小数，soils 为整数，is_anom 为布尔。
+    """
+    rng = rng or np.random.default_rng()
+    shape = (len(base_temp), sensors_per_zone)
+
+    t = base_temp[:, None] + rng.normal(0, 1.5, shape)    # 温度 ±1.5℃
+    h = base_hum[:, None]  + rng.normal(0, 5, shape)      # 湿度 ±5%RH
+    s = base_soil[:, None] + rng.normal(0, 30, shape)     # 土壤含水量 ±30 单位
+
+    # 小概率注入异常：0 = 高温，1 = 低湿，2 = 干燥
+    is_anom = rng.random(shape) < anomaly_rate
+    typ = rng.integers(0, 3, shape)
+    t += np.where(is_anom & (typ == 0), rng.uniform(10, 15, shape), 0.0)
+    h -= np.where(is_anom & (typ == 1), rng.uniform(30, 50, shape), 0.0)
+    dry = is_anom & (typ == 2)
+    s -= np.where(dry, rng.uniform(200, 300, shape), 0.0)
+    s = np.where(dry, np.maximum(s, 0), s)   # 保证不为负
+
+    return np.round(t, 2), np.round(h, 2), s.astype(np.int64), is_anom
+
+
 # 如果直接运行此模块，会演示生成一次并打印结果
 if __name__ == "__main__":
     sample_batch = generate_batch(
@@ -0,0 +1,230 @@
+# fleet_sim.py
+
+"""
+fleet_sim.py
+
+多分区（zone）温室仿真：用于对接收端做大规模压测。
+
+  - 每个分区有自己的基准值、控制器状态和主题 "greenhouse/<zone>/sensors"；
+  - 分区按连续区间切分到进程池中的多个工作进程；
+  - 每个工作进程对自己负责的全部分区做向量化的 生成 → 检测 → 控制，
+    并通过本进程内一个持久 MQTT 连接发布；
+  - 每个工作进程按单调时钟在固定周期边界触发，跟不上时统计超时次数；
+  - aggregate_window > 0 时启用边缘预聚合：每个分区每个窗口发布一条汇总到 "greenhouse/<zone>/summary"，
+    窗口内只逐条发布异常读数（见 aggregator.py）；
+  - partitions > 0 时读数改按 sensor_id % partitions 发到 "greenhouse/<zone>/<分区号>"，
+    与接收端有序多进程入库（ingest_pool --ordered，订阅 greenhouse/+/<分区号>）配合使用。
+
+传感器编号全局唯一：sensor_id = zone * sensors_per_zone + i + 1（zone、i 均从 0 开始）。
+
+用法（通过 main.py）：
+    python main.py --zones 500 --sensors-per-zone 30 --rate 1 --workers 8 -b localhost
+"""
+
+import datetime
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from data_generator import generate_zone_arrays
+from anomaly_detector import detect_anomalies_arrays
+from controller import ZoneController
+from aggregator import WindowAggregator
+from rules import RuleSet
+from mqtt_sender import MqttPublisher
+
+REPORT_EVERY_SEC = 10.0  # 每个工作进程打印统计的间隔
+
+
+def shard_zones(num_zones: int, workers: int) -> list:
+    """把 [0, num_zones) 切成 workers 段连续区间，返回 [(start, stop), ...]（去掉空区间）"""
+    bounds = np.linspace(0, num_zones, workers + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def run_shard(
+    zone_start: int,
+    zone_stop: int,
+    sensors_per_zone: int,
+    rate: float,
+    anomaly_rate: float,
+    broker: str,
+    port: int,
+    qos: int,
+    duration: float,
+    aggregate_window: float = 0.0,
+    rules_source: str = None,
+    rules_interval: float = 5.0,
+    partitions: int = 0
+) -> dict:
+    """
+    工作进程主循环：负责 [zone_start, zone_stop) 这些分区，每 1/rate 秒生成并发布一轮。
+    duration > 0 时运行指定秒数后返回统计；否则一直运行。
+    """
+    zones = np.arange(zone_start, zone_stop)
+    num_zones = len(zones)
+    rng = np.random.default_rng([os.getpid(), zone_start])
+
+    # 每个分区独立的基准值（在默认基准附近随机分布）与控制器状态
+    bases = np.column_stack([
+        rng.normal(25.0, 1.0, num_zones),
+        rng.normal(60.0, 3.0, num_zones),
+        rng.normal(500.0, 20.0, num_zones),
+    ])
+    sensor_ids = zones[:, None] * sensors_per_zone + np.arange(1, sensors_per_zone + 1)
+    controller = ZoneController(num_zones)
+    seq = np.zeros((num_zones, sensors_per_zone), dtype=np.int64)
+    if partitions > 0:
+        topics = [[f"greenhouse/{z}/{int(sid) % partitions}" for sid in row] for z, row in zip(zones, sensor_ids)]
+    else:
+        topics = [[f"greenhouse/{z}/sensors"] * sensors_per_zone for z in zones]
+    # 阈值规则：每个工作进程各自加载并热更新；传感器与分区集合固定，
+    # 只在规则版本变化时重新查表，平时每轮直接复用阈值数组
+    rule_set = RuleSet(rules_source, check_interval=rules_interval)
+    rules_version = None
+    limits = avg_limits = None
+
+    aggregator = None
+    if aggregate_window > 0:
+        aggregator = WindowAggregator(sensor_ids, aggregate_window, zone_ids=zones)
+
+    publisher = MqttPublisher(broker=broker, port=port, qos=qos)
+    interval = 1.0 / rate
+    stats = {"zones": num_zones, "rounds": 0, "messages": 0, "failed": 0, "overruns": 0, "manual_alerts": 0,
+             "summaries": 0}
+    started = time.monotonic()
+    next_tick = started
+    next_report = started + REPORT_EVERY_SEC
+
+    try:
+        while duration <= 0 or time.monotonic() - started < duration:
+            # ─── 生成 → 检测 → 控制（全部向量化）─────────────────────────────
+            temps, hums, soils, is_anom = generate_zone_arrays(
+                bases[:, 0], bases[:, 1], bases[:, 2],
+                sensors_per_zone=sensors_per_zone,
+                anomaly_rate=anomaly_rate,
+                rng=rng
+            )
+            rules = rule_set.current()
+            if rules.version != rules_version:
+                rules_version = rules.version
+                limits = rules.sensor_limits(sensor_ids)
+                avg_limits = rules.zone_limits(zones)
+                controller.set_limits(*avg_limits)
+            _, avgs, _ = detect_anomalies_arrays(temps, hums, soils, limits, avg_limits)
+            bases, decisions = controller.update(bases, avgs)
+            stats["manual_alerts"] += int(decisions["manual"].sum())
+
+            # ─── 发布：每条读数一条消息，发往所属分区的主题 ─────────────────────
+            now_dt = datetime.datetime.now()
+            timestamp = now_dt.isoformat(timespec="milliseconds")
+            publish_ts = time.time()
+            send_mask = None
+            if aggregator is not None:
+                # 预聚合模式：窗口结束时每个分区一条汇总，逐条只发异常读数
+                values = np.stack([temps, hums, soils], axis=-1)
+                for summary in aggregator.add(values, is_anom, now_dt.timestamp()):
+                    publish_summary(publisher, summary, stats)
+                send_mask = is_anom
+            # seq 只对实际逐条发布的读数递增，接收端按 seq 断档统计丢失
+            if send_mask is None:
+                seq += 1
+            else:
+                seq[send_mask] += 1
+            for zi in range(num_zones):
+                zone_topics = topics[zi]
+                for si in range(sensors_per_zone):
+                    if send_mask is not None and not send_mask[zi, si]:
+                        continue
+                    sid = int(sensor_ids[zi, si])
+                    payload = json.dumps({
+                        "id": sid,
+                        "sensor_id": sid,
+                        "timestamp": timestamp,
+                        "temperature": float(temps[zi, si]),
+                        "humidity": float(hums[zi, si]),
+                        "soil_moisture": int(soils[zi, si]),
+                        "is_anomaly": bool(is_anom[zi, si]),
+                        "seq": int(seq[zi, si]),
+                        "publish_ts": publish_ts,
+                    })
+                    if publisher.publish_raw(zone_topics[si], payload):
+                        stats["messages"] += 1
+                    else:
+                        stats["failed"] += 1
+            stats["rounds"] += 1
+
+            # ─── 固定周期调度 ──────────────────────────────────────────────
+            next_tick += interval
+            now = time.monotonic()
+            if now >= next_tick:
+                missed = int((now - next_tick) // interval) + 1
+                next_tick += missed * interval
+                stats["overruns"] += 1
+            if now >= next_report:
+                next_report = now + REPORT_EVERY_SEC
+                elapsed = now - started
+                print(f"[Fleet] 分区 {zone_start}-{zone_stop - 1} | 轮次 {stats['rounds']} | "
+                      f"{stats['messages'] / elapsed:.0f} 条/秒 | 失败 {stats['failed']} 条 | 超时 {stats['overruns']} 次")
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if aggregator is not None:
+            for summary in aggregator.flush():
+                publish_summary(publisher, summary, stats)
+        publisher.close()
+
+    stats["elapsed_sec"] = round(time.monotonic() - started, 3)
+    return stats
+
+
+def publish_summary(publisher: MqttPublisher, summary: dict, stats: dict) -> None:
+    if publisher.publish_raw(f"greenhouse/{summary['zone']}/summary", json.dumps(summary)):
+        stats["summaries"] += 1
+    else:
+        stats["failed"] += 1
+
+
+def run_fleet(
+    num_zones: int,
+    sensors_per_zone: int = 30,
+    rate: float = 0.1,
+    workers: int = 0,
+    anomaly_rate: float = 0.01,
+    broker: str = "localhost",
+    port: int = 1883,
+    qos: int = 0,
+    duration: float = 0.0,
+    aggregate_window: float = 0.0,
+    rules_source: str = None,
+    rules_interval: float = 5.0,
+    partitions: int = 0
+) -> None:
+    """把 num_zones 个分区切分到 workers 个进程并行仿真（workers=0 表示使用 CPU 核数）"""
+    workers = workers or os.cpu_count() or 1
+    shards = shard_zones(num_zones, min(workers, num_zones))
+    print(f"[Info] 多分区仿真：{num_zones} 个分区 × {sensors_per_zone} 传感器，"
+          f"每分区 {rate} 轮/秒，{len(shards)} 个工作进程 → 目标 {num_zones * sensors_per_zone * rate:.0f} 条/秒\n")
+
+    args = [(a, b, sensors_per_zone, rate, anomaly_rate, broker, port, qos, duration, aggregate_window,
+             rules_source, rules_interval, partitions)
+            for a, b in shards]
+    with multiprocessing.Pool(len(shards)) as pool:
+        try:
+            results = pool.starmap(run_shard, args)
+        except KeyboardInterrupt:
+            print("\n[Info] 收到 Ctrl+C，程序退出。")
+            pool.terminate()
+            return
+
+    total = sum(r["messages"] for r in results)
+    elapsed = max(r["elapsed_sec"] for r in results)
+    print(f"[Info] 仿真结束：共发布 {total} 条（失败 {sum(r['failed'] for r in results)} 条），"
+          f"平均 {total / elapsed:.0f} 条/秒，"
+          f"超时 {sum(r['overruns'] for r in results)} 次，"
+          f"需人工干预 {sum(r['manual_alerts'] for r in results)} 次"
+          + (f"，窗口汇总 {sum(r['summaries'] for r in results)} 条" if aggregate_window > 0 else ""))
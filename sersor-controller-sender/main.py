@@ -5,17 +5,44 @@ main.py
 
 主流程：生成 → 检测 → 自动控制 → 逐条发送 → 打印摘要
 （已将“原来一次性发送整批”改为“一个一个发送”）
+
+流水线：生成/检测/控制在主线程，发布在独立线程，两者之间用有界队列连接，
+发布本轮数据的同时即可开始下一轮的生成与检测；主循环按单调时钟在固定周期边界触发，
+不会因处理或网络耗时而漂移，跟不上时统计超时次数。
+
+回放模式（--replay）：用录制文件替代 generate_batch 作为数据来源，按录制节奏 × 倍速逐批送入
+同一条 检测 → 控制 → 发布 流水线（见 replay.py）；回放时不丢批，发布跟不上会反压读取。
+
+死区压缩（--deadband）：检测与控制仍使用整批数据，只有超出死区、心跳到期或异常的读数才发布（见 deadband.py）。
+
+边缘预聚合（--aggregate-window）：按窗口累计每个传感器的统计量，窗口结束时发布一条汇总到 <topic>/summary，
+窗口内只逐条发布异常读数（见 aggregator.py）。
+
+阈值规则（--rules）：检测与控制共用 rules.py 编译出的阈值查找表，规则文件或数据库变化时自动热加载。
+
+运行时剖析（--profile）：按阶段计时、cProfile / 调用栈采样、tracemalloc，定时或 SIGUSR1 时写报告（见 profiling.py）。
 """
 
 import time
+import datetime
 import threading
+import queue
 import argparse
+import json
 import os
 
+import numpy as np
+
 from data_generator import generate_batch
 from anomaly_detector import detect_anomalies
 from controller import update_baselines
-from mqtt_sender import publish_individual  # 这里改成逐条发送
+from mqtt_sender import MqttPublisher  # 持久连接，逐条发送
+from fleet_sim import run_fleet
+from replay import replay_batches
+from deadband import DeadbandFilter, DEFAULT_HEARTBEAT_SEC
+from aggregator import WindowAggregator
+from rules import RuleSet
+from profiling import profiler
 
 # ─── 全局基准值与每轮增量 ───────────────────────────────────────────────────
 base_temp = 25.0   # 温度基准 (℃)
@@ -25,6 +52,9 @@ base_soil = 500.0  # 土壤含水基准（单位自定）
 temp_step = 0.0    # 每轮温度增量 (℃)
 hum_step  = 0.0    # 每轮湿度增量 (%RH)
 soil_step = 0.0    # 每轮土壤含水增量 (单位)
+
+PIPELINE_DEPTH = 2  # 生成阶段与发布阶段之间最多积压的批次数
+SHUTDOWN_WAIT_S = 5.0  # 退出时等待发布线程腾出队列的最长时间（秒）
 # ────────────────────────────────────────────────────────────────────────────
 
 
@@ -145,7 +175,98 @@ def parse_args():
                         help="每批传感器数量（默认 30）")
     parser.add_argument("--anomaly-rate", "-r", type=float, default=0.01,
                         help="小概率异常注入率（0~1，默认 0.05）")
-    return parser.parse_args()
+    parser.add_argument("--partitions", type=int, default=0,
+                        help="按 sensor_id 分区发布到 <topic>/<分区号>（多分区仿真为 greenhouse/<zone>/<分区号>），"
+                             "需与接收端入库进程数一致（默认 0 不分区）")
+    parser.add_argument("--qos", type=int, default=1, choices=[0, 1, 2],
+                        help="MQTT 发布 QoS（默认 1，接收端断线期间由 broker 缓存）")
+    # 多分区仿真模式（压测用）
+    parser.add_argument("--zones", type=int, default=0,
+                        help="大于 0 时进入多分区仿真模式，模拟的分区数（默认 0 为单温室交互模式）")
+    parser.add_argument("--sensors-per-zone", type=int, default=30,
+                        help="仿真模式下每个分区的传感器数（默认 30）")
+    parser.add_argument("--rate", type=float, default=0.1,
+                        help="仿真模式下每个分区每秒的轮数（默认 0.1，即 10 秒一轮）")
+    parser.add_argument("--workers", "-w", type=int, default=0,
+                        help="仿真模式下的工作进程数（默认 0 = CPU 核数）")
+    parser.add_argument("--duration", type=float, default=0.0,
+                        help="仿真模式运行秒数（默认 0 = 一直运行）")
+    # 回放模式
+    parser.add_argument("--replay", type=str, default=None,
+                        help="回放录制文件（.ndjson/.jsonl/.csv/.npy）代替随机生成数据")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="回放倍速（默认 1 为原速，0 为不限速）")
+    parser.add_argument("--keep-timestamps", action="store_true",
+                        help="回放时保留原始时间戳（默认平移到当前时刻，保留相对间隔）")
+    # 死区压缩（例外上报）
+    parser.add_argument("--deadband", type=str, default=None,
+                        help="启用死区压缩，格式 温度,湿度,土壤 例如 0.5,2,15；变化不超过死区的读数不发布")
+    parser.add_argument("--heartbeat", type=float, default=DEFAULT_HEARTBEAT_SEC,
+                        help=f"死区压缩时的心跳间隔（秒），到期即使无变化也发布（默认 {DEFAULT_HEARTBEAT_SEC:g}）")
+    # 阈值规则
+    parser.add_argument("--rules", type=str, default=None,
+                        help="阈值规则来源：JSON 文件路径或 postgresql:// 连接串（读取 plants 表），默认使用内置阈值")
+    parser.add_argument("--rules-interval", type=float, default=5.0,
+                        help="检查规则是否变化的间隔（秒），变化时自动重新编译（默认 5）")
+    # 边缘预聚合
+    parser.add_argument("--aggregate-window", type=float, default=0.0,
+                        help="大于 0 时启用边缘预聚合：每个窗口（秒）发布一条汇总，只逐条发布异常读数（默认 0 关闭）")
+    # 运行时剖析
+    parser.add_argument("--profile", type=str, default=os.getenv("PROFILE", ""),
+                        help="开启运行时剖析：cpu,sample,mem,timers 或 all（默认读取环境变量 PROFILE，空为关闭）")
+    parser.add_argument("--profile-dir", type=str, default=os.getenv("PROFILE_DIR", "profiles"),
+                        help="剖析报告目录（默认 profiles）")
+    parser.add_argument("--profile-interval", type=float, default=float(os.getenv("PROFILE_INTERVAL", "60")),
+                        help="定时写剖析报告的间隔（秒，0 表示只在 SIGUSR1 时写；默认 60）")
+    parser.add_argument("--profile-cpu-window", type=float, default=float(os.getenv("PROFILE_CPU_WINDOW", "10")),
+                        help="每次 cProfile 剖析的秒数（默认 10）")
+    args = parser.parse_args()
+    if args.aggregate_window > 0 and args.replay:
+        # 汇总按固定的传感器集合累计，回放文件中的传感器集合每批可能不同
+        parser.error("--aggregate-window 不能与 --replay 同时使用")
+    return args
+
+
+def publish_stage(publish_queue, publisher, topic, partitions, stats):
+    """
+    发布阶段（独立线程）：从有界队列取出已完成检测/控制的批次并发布，
+    与下一轮的生成、检测并行进行。收到 None 时退出。
+    """
+    while True:
+        item = publish_queue.get()
+        if item is None:
+            return
+        round_no, timestamp, batch, single_alerts, avg_alert, baselines = item
+        profiler.tick("publish")
+
+        # ─── 4. 逐条发送到 MQTT（复用持久连接）──────────────────────────────
+        started = time.monotonic()
+        with profiler.stage("publish"):
+            publisher.publish_records(
+                batch,
+                topic=topic,
+                partitions=partitions,
+                delay=0.0   # 如果想每条之间加个短延时，可设置为 0.05 / 0.1 等
+            )
+        publish_sec = time.monotonic() - started
+
+        # ─── 5. 控制台输出本轮摘要 ───────────────────────────────────────
+        b_t, b_h, b_s = baselines
+        print(f"[{timestamp}] 第 {round_no} 轮 逐条发布 {len(batch)} 条数据（{publish_sec * 1000:.0f} ms） | "
+              f"基准 → 温度: {b_t:.2f} ℃, 湿度: {b_h:.2f}%RH, 土壤: {b_s:.2f}")
+        if single_alerts:
+            print("  单传感器告警（示例前3条）：", single_alerts[:3])
+        if avg_alert:
+            print("  平均值告警：", avg_alert)
+        deadband_filter = stats.get("deadband")
+        if deadband_filter is not None:
+            d = deadband_filter.stats()
+            print(f"  死区压缩：累计 {d['seen']} 条读数发布 {d['sent']} 条（压缩比 {d['compression']}），"
+                  f"其中变化 {d['changed']}、心跳 {d['heartbeats']}、异常 {d['anomalies']}、首次 {d['new']}")
+        if stats["tick_overruns"] or stats["publish_overruns"]:
+            print(f"  超时统计：生成/检测超出周期 {stats['tick_overruns']} 次，"
+                  f"发布积压丢弃 {stats['publish_overruns']} 轮")
+        print()  # 空行分隔
 
 
 def main():
@@ -156,17 +277,81 @@ def main():
     interval_sec = args.interval
     num_sensors  = args.num_sensors
     anomaly_rate = args.anomaly_rate
+    partitions   = args.partitions
+    qos          = args.qos
+
+    profiler.start(args.profile, out_dir=args.profile_dir, interval=args.profile_interval,
+                   name="sender", cpu_window=args.profile_cpu_window)
+
+    if args.zones > 0:
+        run_fleet(
+            args.zones,
+            sensors_per_zone=args.sensors_per_zone,
+            rate=args.rate,
+            workers=args.workers,
+            anomaly_rate=anomaly_rate,
+            broker=broker,
+            port=port,
+            qos=qos,
+            duration=args.duration,
+            aggregate_window=args.aggregate_window,
+            rules_source=args.rules,
+            rules_interval=args.rules_interval,
+            partitions=partitions
+        )
+        return
 
     global base_temp, base_hum, base_soil, temp_step, hum_step, soil_step
 
+    # 回放模式：数据来源换成录制文件，节奏由录制时间决定
+    replay_stats = {}
+    replayer = None
+    if args.replay:
+        replayer = replay_batches(args.replay, speed=args.speed,
+                                  retime=not args.keep_timestamps, stats=replay_stats)
+
     # 启动按键监听线程
     listener_thread = threading.Thread(target=key_listener_loop, daemon=True)
     listener_thread.start()
 
-    print(f"[Info] 主循环启动：每 {interval_sec} 秒生成→检测→控制→逐条发送\n")
+    # 发布阶段：有界队列 + 独立线程 + 持久连接
+    stats = {"tick_overruns": 0, "publish_overruns": 0}
+    deadband_filter = None
+    if args.deadband:
+        deadband_filter = DeadbandFilter(
+            deadband=tuple(float(v) for v in args.deadband.split(",")),
+            heartbeat_sec=args.heartbeat
+        )
+        stats["deadband"] = deadband_filter
+
+    rule_set = RuleSet(args.rules, check_interval=args.rules_interval)
+
+    aggregator = None
+    summary_topic = f"{topic}/summary"
+    if args.aggregate_window > 0:
+        aggregator = WindowAggregator([list(range(1, num_sensors + 1))], args.aggregate_window)
+    publish_queue = queue.Queue(maxsize=PIPELINE_DEPTH)
+    publisher = MqttPublisher(broker=broker, port=port, qos=qos)
+    publish_thread = threading.Thread(
+        target=publish_stage,
+        args=(publish_queue, publisher, topic, partitions, stats),
+        daemon=True
+    )
+    publish_thread.start()
+
+    if replayer is not None:
+        speed_desc = "不限速" if args.speed <= 0 else f"{args.speed:g}×"
+        print(f"[Info] 回放模式启动：{args.replay}（{speed_desc}），检测→控制→发布流程不变\n")
+    else:
+        print(f"[Info] 主循环启动：每 {interval_sec} 秒生成→检测→控制，发布在独立线程中并行进行\n")
+
+    # 单调时钟调度：第 k 轮固定在 start + k * interval 触发，不受处理与网络耗时影响而漂移
+    next_tick = time.monotonic()
+    round_no = 0
 
     try:
         while True:
+            profiler.tick("round")
             # ─── 1. 手动增量先行 ────────────────────────────────────────────
             if temp_step != 0.0:
                 before_t = base_temp
@@ -184,53 +369,120 @@ def main():
                 print(f"🖥️ 手动增量：土壤含水基准 {before_s:.2f} → {base_soil:.2f} (step={soil_step:+.2f})")
 
             # ─── 2. 生成数据 & 检测异常 ────────────────────────────────────────
-            batch = generate_batch(
-                base_temp=base_temp,
-                base_hum=base_hum,
-                base_soil=base_soil,
-                num_sensors=num_sensors,
-                anomaly_rate=anomaly_rate
-            )
-            single_alerts, avg_alert = detect_anomalies(batch)
+            if replayer is not None:
+                # 阻塞到下一批的计划时刻；文件读完即结束
+                batch = next(replayer, None)
+                if batch is None:
+                    print(f"[Info] 回放结束：共 {replay_stats['batches']} 批 {replay_stats['records']} 条，"
+                          f"落后计划 {replay_stats['behind']} 次"
+                          f"（最大 {replay_stats['max_behind_sec']:.2f} 秒）")
+                    break
+            else:
+                with profiler.stage("generate"):
+                    batch = generate_batch(
+                        base_temp=base_temp,
+                        base_hum=base_hum,
+                        base_soil=base_soil,
+                        num_sensors=num_sensors,
+                        anomaly_rate=anomaly_rate
+                    )
+            with profiler.stage("detect"):
+                rules = rule_set.current()  # 未到检查间隔时直接返回缓存的编译结果
+                single_alerts, avg_alert = detect_anomalies(batch, rules)
 
             # ─── 3. 自动控制 + 最大补偿 & 是否告警 ─────────────────────────────
-            base_temp, base_hum, base_soil = update_baselines(
-                base_temp, base_hum, base_soil,
-                avg_alert,
-                temp_step=0.1,    # 自动补偿最小步长
-                hum_step=0.2,
-                soil_step=2.0,
-                max_temp_comp=3.0,   # 最大补偿能力
-                max_hum_comp=5.0,
-                max_soil_comp=20.0
-            )
-
-            # ─── 4. 逐条发送到 MQTT ──────────────────────────────────────────
-            #    将 batch 中的每条记录单独作为 JSON 发布
-            publish_individual(
-                batch,
-                broker=broker,
-                port=port,
-                topic=topic,
-                delay=0.0   # 如果想每条之间加个短延时，可设置为 0.05 / 0.1 等
-            )
-
-            # ─── 5. 控制台输出本轮摘要 ───────────────────────────────────────
+            with profiler.stage("control"):
+                base_temp, base_hum, base_soil = update_baselines(
+                    base_temp, base_hum, base_soil,
+                    avg_alert,
+                    temp_step=0.1,    # 自动补偿最小步长
+                    hum_step=0.2,
+                    soil_step=2.0,
+                    max_temp_comp=3.0,   # 最大补偿能力
+                    max_hum_comp=5.0,
+                    max_soil_comp=20.0,
+                    rules=rules
+                )
+
+            # 本轮时间戳（死区压缩/预聚合后本轮可能一条都不发布，摘要仍按本轮时间打印）
             timestamp = batch[0]["timestamp"] if batch else "N/A"
-            print(f"[{timestamp}] 逐条发布 {len(batch)} 条数据 | "
-                  f"基准 → 温度: {base_temp:.2f} ℃, 湿度: {base_hum:.2f}%RH, 土壤: {base_soil:.2f}")
-            if single_alerts:
-                print("  单传感器告警（示例前3条）：", single_alerts[:3])
-            if avg_alert:
-                print("  平均值告警：", avg_alert)
-            print()  # 空行分隔
 
-            # ─── 6. 等待下一轮 ─────────────────────────────────────────────
-            time.sleep(interval_sec)
+            # ─── 3.4 边缘预聚合：累计到窗口，窗口结束发布汇总；本轮只逐条发布异常读数 ─────
+            if aggregator is not None and batch:
+                data_ts = datetime.datetime.fromisoformat(batch[0]["timestamp"]).timestamp()
+                with profiler.stage("aggregate"):
+                    values = np.array([[[r["temperature"], r["humidity"], r["soil_moisture"]] for r in batch]])
+                    summaries = aggregator.add(values, [[r["is_anomaly"] for r in batch]], data_ts)
+                for summary in summaries:
+                    publisher.publish_raw(summary_topic, json.dumps(summary))
+                    print(f"📊 窗口汇总 {summary['window_start']} ~ {summary['window_end']}："
+                          f"{len(summary['sensor_ids'])} 个传感器，共 {sum(summary['count'])} 条读数")
+                batch = [r for r in batch if r["is_anomaly"]]
+
+            # ─── 3.5 死区压缩：只发布有变化 / 心跳到期 / 异常的读数 ─────────────────
+            # 心跳按数据时间戳计算，回放加速时与接收端看到的时间轴一致
+            if deadband_filter is not None and batch:
+                data_ts = datetime.datetime.fromisoformat(batch[0]["timestamp"]).timestamp()
+                with profiler.stage("deadband"):
+                    batch = deadband_filter.filter(batch, now=data_ts)
+
+            # ─── 4. 交给发布阶段；队列满说明发布跟不上，最多等到下一个周期边界 ─────
+            round_no += 1
+            if replayer is not None:
+                publish_queue.put((round_no, timestamp, batch, single_alerts, avg_alert,
+                                   (base_temp, base_hum, base_soil)))
+                continue
+
+            next_tick += interval_sec
+            enqueue_at = time.monotonic()
+            try:
+                # enqueue 阶段耗时高说明发布线程跟不上
+                with profiler.stage("enqueue"):
+                    publish_queue.put(
+                        (round_no, timestamp, batch, single_alerts, avg_alert, (base_temp, base_hum, base_soil)),
+                        timeout=max(0.0, next_tick - enqueue_at)
+                    )
+            except queue.Full:
+                stats["publish_overruns"] += 1
+                print(f"[Warning] 发布阶段积压，第 {round_no} 轮数据被丢弃"
+                      f"（累计 {stats['publish_overruns']} 轮）")
+                if enqueue_at < next_tick:
+                    # 一直等到了本周期边界：积压已记为发布超时，不再算处理超时，直接开始下一轮
+                    continue
+
+            # ─── 6. 等待下一个周期边界 ─────────────────────────────────────────
+            now = time.monotonic()
+            if now >= next_tick:
+                # 本轮处理超出周期：跳过已错过的边界，对齐到下一个未来边界
+                missed = int((now - next_tick) // interval_sec) + 1
+                next_tick += missed * interval_sec
+                stats["tick_overruns"] += 1
+                print(f"[Warning] 第 {round_no} 轮处理超出周期，跳过 {missed} 个周期边界"
+                      f"（累计超时 {stats['tick_overruns']} 次）")
+            time.sleep(max(0.0, next_tick - time.monotonic()))
 
     except KeyboardInterrupt:
         print("\n[Info] 收到 Ctrl+C，程序退出。")
     finally:
+        try:
+            publish_queue.put(None, timeout=max(interval_sec, SHUTDOWN_WAIT_S))
+        except queue.Full:
+            # 发布线程卡住（例如 broker 无响应）：丢弃积压的批次，确保退出信号能放进队列
+            dropped = 0
+            while True:
+                try:
+                    publish_queue.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    break
+            print(f"[Warning] 发布线程无响应，丢弃积压的 {dropped} 轮数据")
+            publish_queue.put_nowait(None)
+        publish_thread.join(timeout=None if replayer is not None else interval_sec)
+        if aggregator is not None:
+            # 退出前发出未满的窗口，避免最后一段数据丢失
+            for summary in aggregator.flush():
+                publisher.publish_raw(summary_topic, json.dumps(summary))
+        publisher.close()
         print("[Info] 退出完成。")
 
 
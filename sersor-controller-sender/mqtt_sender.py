@@ -4,12 +4,29 @@
 mqtt_sender.py
 
 原有的 publish_batch() 保留不变，我们在此新增 publish_individual() 用于逐条发送。
+
+每条记录在发送前都会附加：
+  - "seq":        该传感器的发送序号（从 1 开始逐条递增），接收端据此检测丢包/乱序；
+  - "publish_ts": 发送时刻的 Unix 时间戳（秒，浮点，微秒级精度），接收端据此计算端到端延迟。
 """
 
 import json
 import paho.mqtt.client as mqtt
 import time
 
+# 每个传感器的发送序号（进程内持续递增，跨轮次保留）
+_seq_by_sensor = {}
+
+
+def stamp_record(record: dict) -> dict:
+    """为一条记录附加 seq 与高精度 publish_ts（原地修改并返回）"""
+    sid = record.get("sensor_id")
+    seq = _seq_by_sensor.get(sid, 0) + 1
+    _seq_by_sensor[sid] = seq
+    record["seq"] = seq
+    record["publish_ts"] = time.time()
+    return record
+
 def publish_batch(
     batch: list,
     broker: str = "localhost",
@@ -27,6 +44,8 @@ def publish_batch(
         return
 
     client.loop_start()
+    for record in batch:
+        stamp_record(record)
     try:
         payload = json.dumps(batch, ensure_ascii=False)
     except (TypeError, ValueError) as e:
@@ -43,12 +62,67 @@ def publish_batch(
     client.disconnect()
 
 
+class MqttPublisher:
+    """
+    持久连接的发布器：只连接一次，后续每轮复用同一连接逐条发布，
+    避免 publish_individual() 每轮都重新建立 TCP/MQTT 连接。
+    """
+
+    def __init__(self, broker: str = "localhost", port: int = 1883, qos: int = 0):
+        self.broker = broker
+        self.port = port
+        self.qos = qos
+        self.client = mqtt.Client()
+        self.client.connect_async(broker, port)
+        self.client.loop_start()   # 网络线程负责连接与断线自动重连
+
+    def publish_records(
+        self,
+        batch: list,
+        topic: str = "greenhouse/sensors",
+        partitions: int = 0,
+        delay: float = 0.0
+    ) -> int:
+        """逐条发布 batch，参数含义同 publish_individual()；返回成功交给客户端的条数"""
+        sent = 0
+        for record in batch:
+            stamp_record(record)
+            try:
+                payload = json.dumps(record, ensure_ascii=False)
+            except (TypeError, ValueError) as e:
+                print(f"[Error] 序列化单条记录为 JSON 失败：{e}；记录内容：{record}")
+                continue
+
+            record_topic = topic
+            if partitions > 0:
+                record_topic = f"{topic}/{record['sensor_id'] % partitions}"
+
+            result = self.client.publish(record_topic, payload, qos=self.qos)
+            if result[0] != mqtt.MQTT_ERR_SUCCESS:
+                print(f"[Warning] 发布单条消息到主题 '{record_topic}' 失败，状态码：{result[0]}；记录：{record}")
+            else:
+                sent += 1
+            if delay > 0.0:
+                time.sleep(delay)
+        return sent
+
+    def publish_raw(self, topic: str, payload: str) -> bool:
+        """发布已序列化好的负载（由调用方负责 seq / publish_ts 等字段）"""
+        return self.client.publish(topic, payload, qos=self.qos)[0] == mqtt.MQTT_ERR_SUCCESS
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
 def publish_individual(
     batch: list,
     broker: str = "localhost",
     port: int = 1883,
     topic: str = "greenhouse/sensors",
-    delay: float = 0.0
+    delay: float = 0.0,
+    partitions: int = 0,
+    qos: int = 0
 ) -> None:
     """
     按条逐条发布 batch 中的每一条记录：
@@ -63,6 +137,9 @@ def publish_individual(
           }
       - broker/port/topic: MQTT 服务配置
       - delay: 每发完一条后，等待 delay 秒再发送下一条（可设为 0.0 不延迟）
+      - partitions: 大于 0 时按 sensor_id % partitions 发到子主题 "<topic>/<分区号>"，
+        配合接收端有序多进程入库（ingest_pool --ordered）保证同一传感器始终由同一进程处理
+      - qos: MQTT QoS 等级；接收端使用持久会话时需 ≥1，broker 才会在其断线期间缓存消息
 
     这会用同一个连接循环发多条消息，但每条都单独序列化成 JSON。
     """
@@ -75,19 +152,35 @@ def publish_individual(
 
     client.loop_start()
 
+    pending = []
     for record in batch:
+        stamp_record(record)
         try:
             payload = json.dumps(record, ensure_ascii=False)
         except (TypeError, ValueError) as e:
             print(f"[Error] 序列化单条记录为 JSON 失败：{e}；记录内容：{record}")
             continue
 
-        result = client.publish(topic, payload)
+        record_topic = topic
+        if partitions > 0:
+            record_topic = f"{topic}/{record['sensor_id'] % partitions}"
+
+        result = client.publish(record_topic, payload, qos=qos)
         if result[0] != mqtt.MQTT_ERR_SUCCESS:
-            print(f"[Warning] 发布单条消息到主题 '{topic}' 失败，状态码：{result[0]}；记录：{record}")
+            print(f"[Warning] 发布单条消息到主题 '{record_topic}' 失败，状态码：{result[0]}；记录：{record}")
+        elif qos > 0:
+            pending.append(result)
         # 如果需要间隔，可以在这里加延时
         if delay > 0.0:
             time.sleep(delay)
 
+    # QoS ≥1 时等待 broker 确认后再断开，避免在途消息随连接一起丢失
+    for info in pending:
+        try:
+            info.wait_for_publish(timeout=5)
+        except (ValueError, RuntimeError) as e:
+            print(f"[Warning] 等待消息确认失败：{e}")
+            break
+
     client.loop_stop()
     client.disconnect()
@@ -0,0 +1,21 @@
+# profiling.py
+
+"""
+profiling.py
+
+运行时剖析，与接收端共用一份实现（仓库根目录 common/profiling.py，说明见该文件），这里只负责导入。
+
+开启方式：main.py --profile cpu,sample,mem,timers（或 all）。
+发送端被剖析的循环：round（主循环每轮）与 publish（发布线程每批）；
+阶段：generate / detect / control / aggregate / deadband / enqueue / publish。
+多分区仿真模式（--zones）的工作进程不在剖析范围内。
+"""
+
+import os
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.append(_ROOT)
+
+from common.profiling import MODES, Profiler, parse_modes, profiler  # noqa: E402,F401
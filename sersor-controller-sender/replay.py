@@ -0,0 +1,264 @@
+# replay.py
+
+"""
+replay.py
+
+回放录制的传感器读数，替代 generate_batch() 作为主流程的数据来源，用于复现线上问题
+和用真实数据形态压测接收端。
+
+支持的文件格式（按扩展名识别）：
+  - .ndjson / .jsonl : 每行一条 JSON，字段与发送格式一致（timestamp 或 time_stamp 均可）；
+  - .csv             : 数据库导出，例如
+                       \\copy (SELECT * FROM rawdata_from_sensors ORDER BY time_stamp, id) TO 'dump.csv' CSV HEADER
+  - .npy             : 二进制结构化数组（RECORD_DTYPE），可由本模块的 convert 子命令从上面两种格式转换，
+                       回放时开销最小。
+
+读取方式：文本文件用 mmap 映射后按块切行，.npy 用 np.load(mmap_mode="r") 按块切片，
+文件不会整体读入内存。
+
+回放规则：
+  - 按文件顺序发送，同一时间戳的连续记录组成一批（与 generate_batch 一轮一批一致），
+    因此每个传感器的先后顺序与文件中一致（文件需按时间排序，数据库导出时请带 ORDER BY）；
+  - 相邻两批之间的间隔 = 原始时间差 / speed，按单调时钟对齐到起点，不会累积漂移；
+    speed <= 0 表示不等待，尽可能快地发送；
+  - 默认把时间戳平移到“当前时刻 + 原始偏移”，保留相对间隔，避免与库中已有数据撞唯一约束；
+    retime=False 时原样发送原始时间戳。
+
+用法：
+    python main.py --replay dump.csv --speed 10 -b localhost
+    python replay.py convert dump.csv dump.npy
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import mmap
+import os
+import time
+
+import numpy as np
+
+# 二进制回放格式：ts 为 Unix 秒（本地时间按 naive datetime 换算）
+RECORD_DTYPE = np.dtype([
+    ("sensor_id",     np.int64),
+    ("ts",            np.float64),
+    ("temperature",   np.float64),
+    ("humidity",      np.float64),
+    ("soil_moisture", np.int64),
+    ("is_anomaly",    np.bool_),
+])
+
+CHUNK_BYTES = 4 * 1024 * 1024   # 文本文件每次切分的字节数
+CHUNK_ROWS = 65536              # .npy 每次切片的行数
+MAX_BATCH = 10000               # 单批最多记录数，同一时间戳的记录过多时拆成多批连续发送
+BEHIND_WARN_SEC = 1.0           # 落后计划时间超过该值计为一次落后
+
+
+def _parse_ts(value) -> float:
+    """ISO 字符串（T 或空格分隔）或数字 → Unix 秒"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("t", "true", "1")
+    return bool(value)
+
+
+def _mmap_lines(path: str, chunk_bytes: int = CHUNK_BYTES):
+    """mmap 映射文本文件，每次产出一块完整行的列表（bytes），块边界对齐到换行符"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            pos = 0
+            while pos < size:
+                end = min(size, pos + chunk_bytes)
+                if end < size:
+                    nl = mm.rfind(b"\n", pos, end)
+                    if nl == -1:
+                        # 单行超过块大小：延伸到下一个换行符
+                        nl = mm.find(b"\n", end)
+                        end = size if nl == -1 else nl + 1
+                    else:
+                        end = nl + 1
+                yield mm[pos:end].splitlines()
+                pos = end
+
+
+def read_ndjson(path: str):
+    """逐条产出 (sensor_id, ts, temperature, humidity, soil_moisture, is_anomaly)"""
+    for lines in _mmap_lines(path):
+        for line in lines:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            yield (int(d["sensor_id"]), _parse_ts(d.get("timestamp", d.get("time_stamp"))),
+                   float(d["temperature"]), float(d["humidity"]),
+                   int(d["soil_moisture"]), _parse_bool(d.get("is_anomaly", False)))
+
+
+def read_csv(path: str):
+    """数据库导出的 CSV（带表头），列名与 rawdata_from_sensors 一致，多余的列（如 id）忽略"""
+    header = None
+    last_raw_ts, last_ts = None, None
+    for lines in _mmap_lines(path):
+        rows = csv.reader(line.decode("utf-8") for line in lines)
+        if header is None:
+            header = {name.strip(): i for i, name in enumerate(next(rows))}
+            col_ts = header["time_stamp"] if "time_stamp" in header else header["timestamp"]
+            col_sid, col_t, col_h, col_s = (header[k] for k in
+                                            ("sensor_id", "temperature", "humidity", "soil_moisture"))
+            col_anom = header.get("is_anomaly")
+        for row in rows:
+            if not row:
+                continue
+            raw_ts = row[col_ts]
+            if raw_ts != last_raw_ts:
+                # 同一轮的记录时间戳相同，只解析一次
+                last_raw_ts, last_ts = raw_ts, _parse_ts(raw_ts)
+            yield (int(row[col_sid]), last_ts, float(row[col_t]), float(row[col_h]),
+                   int(float(row[col_s])), col_anom is not None and _parse_bool(row[col_anom]))
+
+
+def read_npy(path: str):
+    arr = np.load(path, mmap_mode="r")
+    if arr.dtype != RECORD_DTYPE:
+        raise ValueError(f"{path} 的 dtype 不是 RECORD_DTYPE: {arr.dtype}")
+    for start in range(0, len(arr), CHUNK_ROWS):
+        # 切片仍是映射视图，tolist() 一次性转成 Python 元组
+        yield from arr[start:start + CHUNK_ROWS].tolist()
+
+
+READERS = {
+    ".ndjson": read_ndjson,
+    ".jsonl": read_ndjson,
+    ".csv": read_csv,
+    ".npy": read_npy,
+}
+
+
+def read_records(path: str):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"不支持的回放文件格式: {ext}（支持 {', '.join(READERS)}）")
+    return READERS[ext](path)
+
+
+def replay_batches(path: str, speed: float = 1.0, retime: bool = True,
+                   max_batch: int = MAX_BATCH, stats: dict = None):
+    """
+    按录制节奏产出批次（list[dict]，格式同 generate_batch），在每批的计划时刻之前阻塞等待。
+
+    参数：
+        path      (str)  : 回放文件。
+        speed     (float): 回放倍速，1 为原速，<= 0 为不限速。
+        retime    (bool) : 是否把时间戳平移到当前时刻（保留相对间隔）。
+        max_batch (int)  : 单批最多记录数。
+        stats     (dict) : 可选，回放过程中累加 batches / records / behind / max_behind_sec。
+    """
+    stats = {} if stats is None else stats
+    for key in ("batches", "records", "behind"):
+        stats.setdefault(key, 0)
+    stats.setdefault("max_behind_sec", 0.0)
+
+    first_ts = None
+    start_mono = None
+    shift = 0.0
+    batch, batch_ts = [], None
+
+    def emit(records, ts):
+        # 等到计划时刻（相对首条记录的偏移 / 倍速）
+        if speed > 0:
+            due = start_mono + (ts - first_ts) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif -delay > BEHIND_WARN_SEC:
+                stats["behind"] += 1
+                stats["max_behind_sec"] = max(stats["max_behind_sec"], -delay)
+        timestamp = datetime.datetime.fromtimestamp(ts + shift).isoformat()
+        out = []
+        for sid, _, t, h, s, anom in records:
+            out.append({
+                "id": sid,
+                "sensor_id": sid,
+                "timestamp": timestamp,
+                "temperature": round(t, 2),
+                "humidity": round(h, 2),
+                "soil_moisture": int(s),
+                "is_anomaly": bool(anom),
+            })
+        stats["batches"] += 1
+        stats["records"] += len(out)
+        return out
+
+    for record in read_records(path):
+        ts = record[1]
+        if first_ts is None:
+            first_ts = ts
+            start_mono = time.monotonic()
+            if retime:
+                # 按整秒平移，原始时间戳是整秒时平移后仍是整秒
+                shift = float(round(time.time() - first_ts))
+        if batch and (ts != batch_ts or len(batch) >= max_batch):
+            yield emit(batch, batch_ts)
+            batch = []
+        batch.append(record)
+        batch_ts = ts
+    if batch:
+        yield emit(batch, batch_ts)
+
+
+def convert(src: str, dst: str) -> int:
+    """把 NDJSON/CSV 转成 .npy 二进制回放文件，返回记录数（分块追加到临时文件，内存占用与文件大小无关）"""
+    tmp = dst + ".tmp"
+    count = 0
+    with open(tmp, "wb") as out:
+        chunk = []
+        for record in read_records(src):
+            chunk.append(record)
+            if len(chunk) >= CHUNK_ROWS:
+                out.write(np.array(chunk, dtype=RECORD_DTYPE).tobytes())
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            out.write(np.array(chunk, dtype=RECORD_DTYPE).tobytes())
+            count += len(chunk)
+
+    # 写 .npy 头，再把原始记录映射进来
+    arr = np.lib.format.open_memmap(dst, mode="w+", dtype=RECORD_DTYPE, shape=(count,))
+    if count:
+        arr[:] = np.memmap(tmp, dtype=RECORD_DTYPE, mode="r", shape=(count,))
+    arr.flush()
+    del arr
+    os.remove(tmp)
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回放文件工具")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_conv = sub.add_parser("convert", help="把 NDJSON/CSV 转成 .npy 二进制回放文件")
+    p_conv.add_argument("src")
+    p_conv.add_argument("dst")
+    p_info = sub.add_parser("info", help="统计回放文件的记录数、传感器数与时间跨度")
+    p_info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.cmd == "convert":
+        n = convert(args.src, args.dst)
+        print(f"已转换 {n} 条记录 → {args.dst}")
+    else:
+        n, sensors, first, last = 0, set(), None, None
+        for sid, ts, *_ in read_records(args.path):
+            n += 1
+            sensors.add(sid)
+            first = ts if first is None else first
+            last = ts
+        span = 0.0 if first is None else last - first
+        print(f"{args.path}: {n} 条记录，{len(sensors)} 个传感器，时间跨度 {span:.0f} 秒")
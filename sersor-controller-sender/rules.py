@@ -0,0 +1,251 @@
+# rules.py
+
+"""
+rules.py
+
+阈值规则引擎：单传感器阈值与平均值阈值的唯一来源（anomaly_detector.py 与 controller.py 都从这里取值）。
+
+规则来源（RuleSet(source)）：
+  - None                    : 只使用 DEFAULT_LIMITS；
+  - JSON 文件路径            : 格式见下；
+  - postgresql://... 连接串 : 读取数据库中的 plants 表（以及可选的 sensors 表），需要 psycopg2。
+
+JSON 规则文件格式（每个阈值为 [下限, 上限]，null 表示沿用上一级）：
+    {
+        "defaults": {"temperature": [15, 30], "avg_temperature": [17, 28]},
+        "plants": {
+            "tomato":  {"temperature": [18, 29], "humidity": [50, 80]},
+            "lettuce": {"temperature": [10, 24]}
+        },
+        "sensor_plant": {"1-15": "tomato", "16-30": "lettuce"},
+        "sensors": {"7": {"soil_moisture": [150, null]}},
+        "zones": {"3": {"avg_temperature": [16, 26]}}
+    }
+优先级：sensors（单个传感器） > plants（所种植物） > defaults > DEFAULT_LIMITS。
+单传感器阈值键为 temperature / humidity / soil_moisture，
+平均值阈值键为 avg_temperature / avg_humidity / avg_soil_moisture，按分区（zone）生效，单温室模式为分区 0。
+
+数据库来源：
+    plants  (id, temp_min, temp_max, hum_min, hum_max, soil_min, soil_max)  —— 列为 NULL 表示沿用默认
+    sensors (sensor_id, plant_id)                                          —— 可选，传感器所种植物
+阈值列与 sensors 表不在原始建表脚本中，由接收端初始化数据库时补上（receiver-database/database.py 的
+RULES_SCHEMA_SQL：ALTER TABLE plants ADD COLUMN IF NOT EXISTS ...，CREATE TABLE IF NOT EXISTS sensors ...）。
+只读取存在的列，缺少 sensors 表时植物规则不会关联到任何传感器。
+数据库规则在后台线程中定时重新读取（连接超时 RULES_DB_CONNECT_TIMEOUT 秒），读完整体替换编译结果，
+主循环取规则时不会等待数据库；读取失败时继续使用上一版。
+
+编译：规则在加载时一次性编译成按 sensor_id / 分区号直接下标的 numpy 查找表（形状 (N, 3) 的下限/上限），
+检测时只做数组索引，不再逐条查字典；规则变化（文件 mtime 或数据库内容变化）时重新编译一次。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+METRICS = ("temperature", "humidity", "soil_moisture")
+AVG_METRICS = ("avg_temperature", "avg_humidity", "avg_soil_moisture")
+
+# 内置默认阈值（请根据大棚实际情况调整，或通过规则文件/数据库覆盖）
+DEFAULT_LIMITS = {
+    "temperature":       (15.0, 30.0),    # 单传感器温度 (℃)
+    "humidity":          (30.0, 80.0),    # 单传感器湿度 (%RH)
+    "soil_moisture":     (100.0, 700.0),  # 单传感器土壤含水量（单位自定）
+    "avg_temperature":   (17.0, 28.0),    # 平均温度 (℃)
+    "avg_humidity":      (40.0, 75.0),    # 平均湿度 (%RH)
+    "avg_soil_moisture": (200.0, 600.0),  # 平均土壤含水量（单位自定）
+}
+
+# 数据库 plants 表的列前缀 → 指标
+_DB_COLUMNS = {"temp": "temperature", "hum": "humidity", "soil": "soil_moisture"}
+RULES_DB_CONNECT_TIMEOUT = 5  # 秒
+
+
+def _apply(lo, hi, keys, overrides):
+    """把 {指标: [下限, 上限]} 覆盖到 lo/hi 的一行上（None 表示不覆盖）"""
+    for i, key in enumerate(keys):
+        limit = overrides.get(key)
+        if limit is None:
+            continue
+        if limit[0] is not None:
+            lo[i] = float(limit[0])
+        if limit[1] is not None:
+            hi[i] = float(limit[1])
+
+
+def _expand_ids(key):
+    """"7" → [7]；"1-15" → [1..15]"""
+    key = str(key)
+    if "-" in key:
+        a, b = key.split("-", 1)
+        return range(int(a), int(b) + 1)
+    return [int(key)]
+
+
+class CompiledRules:
+    """
+    编译后的查找表：
+        lo / hi         形状 (max_sensor_id + 1, 3)，按 sensor_id 直接下标；
+        avg_lo / avg_hi 形状 (max_zone + 1, 3)，按分区号直接下标；
+    超出表范围的 sensor_id / 分区使用默认阈值。
+    """
+
+    def __init__(self, spec: dict, version: str = "default"):
+        self.version = version
+        defaults = dict(DEFAULT_LIMITS)
+        defaults.update({k: v for k, v in spec.get("defaults", {}).items() if v is not None})
+
+        self.default_lo = np.array([defaults[k][0] for k in METRICS], dtype=np.float64)
+        self.default_hi = np.array([defaults[k][1] for k in METRICS], dtype=np.float64)
+        self.default_avg_lo = np.array([defaults[k][0] for k in AVG_METRICS], dtype=np.float64)
+        self.default_avg_hi = np.array([defaults[k][1] for k in AVG_METRICS], dtype=np.float64)
+
+        # 植物 → 阈值
+        plant_limits = {}
+        for name, overrides in spec.get("plants", {}).items():
+            lo, hi = self.default_lo.copy(), self.default_hi.copy()
+            _apply(lo, hi, METRICS, overrides)
+            plant_limits[str(name)] = (lo, hi)
+
+        sensor_plant = {}
+        for key, plant in spec.get("sensor_plant", {}).items():
+            for sid in _expand_ids(key):
+                sensor_plant[sid] = str(plant)
+        sensor_overrides = {}
+        for key, overrides in spec.get("sensors", {}).items():
+            for sid in _expand_ids(key):
+                sensor_overrides[sid] = overrides
+
+        size = max([0, *sensor_plant, *sensor_overrides]) + 1
+        self.lo = np.tile(self.default_lo, (size, 1))
+        self.hi = np.tile(self.default_hi, (size, 1))
+        for sid, plant in sensor_plant.items():
+            if plant in plant_limits:
+                self.lo[sid], self.hi[sid] = plant_limits[plant]
+        for sid, overrides in sensor_overrides.items():
+            _apply(self.lo[sid], self.hi[sid], METRICS, overrides)
+
+        zones = {int(k): v for k, v in spec.get("zones", {}).items()}
+        size = max([0, *zones]) + 1
+        self.avg_lo = np.tile(self.default_avg_lo, (size, 1))
+        self.avg_hi = np.tile(self.default_avg_hi, (size, 1))
+        for zone, overrides in zones.items():
+            _apply(self.avg_lo[zone], self.avg_hi[zone], AVG_METRICS, overrides)
+
+    @staticmethod
+    def _lookup(table_lo, table_hi, default_lo, default_hi, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < len(table_lo))
+        idx = np.where(inside, ids, 0)
+        lo = np.where(inside[..., None], table_lo[idx], default_lo)
+        hi = np.where(inside[..., None], table_hi[idx], default_hi)
+        return lo, hi
+
+    def sensor_limits(self, sensor_ids):
+        """sensor_ids 任意形状 → (lo, hi)，形状为 sensor_ids.shape + (3,)"""
+        return self._lookup(self.lo, self.hi, self.default_lo, self.default_hi, sensor_ids)
+
+    def zone_limits(self, zone_ids):
+        """zone_ids 任意形状 → 平均值阈值 (avg_lo, avg_hi)，形状为 zone_ids.shape + (3,)"""
+        return self._lookup(self.avg_lo, self.avg_hi, self.default_avg_lo, self.default_avg_hi, zone_ids)
+
+
+DEFAULT_RULES = CompiledRules({})
+
+
+def load_rules_file(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_rules_db(dsn: str) -> dict:
+    """从 plants（以及可选的 sensors）表读取规则，转换成与 JSON 规则文件相同的结构"""
+    import psycopg2  # 只有使用数据库规则来源时才需要
+
+    conn = psycopg2.connect(dsn, connect_timeout=RULES_DB_CONNECT_TIMEOUT)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM plants")
+        columns = [d[0] for d in cur.description]
+        plants = {}
+        for row in cur.fetchall():
+            rec = dict(zip(columns, row))
+            plant_id = rec.get("id", rec.get("plant_id"))
+            plants[str(plant_id)] = {
+                metric: [rec.get(f"{prefix}_min"), rec.get(f"{prefix}_max")]
+                for prefix, metric in _DB_COLUMNS.items()
+            }
+
+        cur.execute("SELECT to_regclass('sensors') IS NOT NULL")
+        sensor_plant = {}
+        if cur.fetchone()[0]:
+            cur.execute("SELECT sensor_id, plant_id FROM sensors WHERE plant_id IS NOT NULL")
+            sensor_plant = {str(sid): str(pid) for sid, pid in cur.fetchall()}
+        return {"plants": plants, "sensor_plant": sensor_plant}
+    finally:
+        conn.close()
+
+
+class RuleSet:
+    """
+    规则来源 + 编译结果缓存，热加载：
+        文件来源由 current() 每隔 check_interval 秒检查一次 mtime/大小；数据库来源由后台线程每隔
+        check_interval 秒读取并比较内容摘要，current() 只取已编译好的结果。
+        变化时重新编译并整体替换；加载失败时打印警告并继续使用上一版规则。
+    调用方可比较 current().version 判断是否需要刷新自己缓存的派生数组。
+    """
+
+    def __init__(self, source: str = None, check_interval: float = 5.0):
+        self.source = source
+        self.check_interval = check_interval
+        self._compiled = DEFAULT_RULES
+        self._fingerprint = None
+        self._next_check = 0.0
+        self.reloads = 0
+        self._thread = None
+        if source:
+            self._refresh(initial=True)
+            if self._is_db():
+                self._thread = threading.Thread(target=self._reload_loop, name="rules-reload", daemon=True)
+                self._thread.start()
+
+    def _is_db(self) -> bool:
+        return self.source.startswith(("postgresql://", "postgres://"))
+
+    def _refresh(self, initial: bool = False) -> None:
+        try:
+            if self._is_db():
+                spec = load_rules_db(self.source)
+                fingerprint = hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+            else:
+                st = os.stat(self.source)
+                fingerprint = f"{st.st_mtime_ns}:{st.st_size}"
+                if fingerprint == self._fingerprint:
+                    return
+                spec = load_rules_file(self.source)
+            if fingerprint == self._fingerprint:
+                return
+            self._compiled = CompiledRules(spec, version=fingerprint)
+            self._fingerprint = fingerprint
+            self.reloads += 1
+            print(f"[Info] 阈值规则{'已加载' if initial else '已变化，重新编译'}：{self.source}（版本 {fingerprint[:16]}）")
+        except Exception as e:
+            if initial:
+                raise
+            print(f"[Warning] 重新加载阈值规则失败，继续使用上一版：{e}")
+
+    def _reload_loop(self) -> None:
+        while True:
+            time.sleep(self.check_interval)
+            self._refresh()
+
+    def current(self) -> CompiledRules:
+        if self.source and self._thread is None:
+            now = time.monotonic()
+            if now >= self._next_check:
+                self._next_check = now + self.check_interval
+                self._refresh()
+        return self._compiled
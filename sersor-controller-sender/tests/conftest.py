@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 发送端模块按平铺方式导入（python main.py 在本目录下运行），测试同样把本目录放到搜索路径最前面
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from aggregator import WindowAggregator
+
+WINDOW = 300.0
+T0 = 1_749_132_000.0      # 对齐到 300 秒窗口
+
+
+def rounds(n, seed=0):
+    rng = np.random.default_rng(seed)
+    base = np.array([22.0, 55.0, 420.0])
+    return base + rng.normal(0, [1.0, 3.0, 20.0], size=(n, 2, 3, 3))   # (轮数, Z=2, S=3, 3)
+
+
+def merge(a, b):
+    """与接收端 ON CONFLICT 合并相同：条数与和相加，最小 / 最大取两者"""
+    return {
+        "count": np.add(a["count"], b["count"]),
+        "sum": np.add(a["sum"], b["sum"]),
+        "sumsq": np.add(a["sumsq"], b["sumsq"]),
+        "min": np.minimum(a["min"], b["min"]),
+        "max": np.maximum(a["max"], b["max"]),
+    }
+
+
+def test_window_rollover_emits_one_summary_per_zone():
+    agg = WindowAggregator([[1, 2, 3], [4, 5, 6]], WINDOW, zone_ids=[10, 11])
+    values = rounds(3)
+    anomalies = np.zeros((2, 3), dtype=bool)
+    assert agg.add(values[0], anomalies, T0) == []
+    assert agg.add(values[1], anomalies, T0 + 10) == []
+    out = agg.add(values[2], anomalies, T0 + WINDOW)
+    assert [s["zone"] for s in out] == [10, 11]
+    assert out[1]["sensor_ids"] == [4, 5, 6]
+    assert out[0]["count"] == [2, 2, 2]
+    np.testing.assert_allclose(out[0]["sum"], values[0, 0] + values[1, 0], atol=1e-4)
+    np.testing.assert_allclose(out[0]["min"], np.minimum(values[0, 0], values[1, 0]))
+    # 第三轮属于新窗口
+    assert agg.flush()[0]["count"] == [1, 1, 1]
+
+
+def test_partial_windows_merge_to_full_window_stats():
+    values = rounds(12, seed=1)
+    anomalies = np.zeros((2, 3), dtype=bool)
+    sensor_ids = [[1, 2, 3], [4, 5, 6]]
+
+    # 发送端在窗口中途退出（flush 发出不完整窗口），重启后继续同一窗口
+    first = WindowAggregator(sensor_ids, WINDOW)
+    for i in range(5):
+        first.add(values[i], anomalies, T0 + i * 10)
+    part_a = first.flush()
+    second = WindowAggregator(sensor_ids, WINDOW)
+    for i in range(5, 12):
+        second.add(values[i], anomalies, T0 + i * 10)
+    part_b = second.flush()
+    assert part_a[0]["window_start"] == part_b[0]["window_start"]
+
+    for zi in range(2):
+        merged = merge(part_a[zi], part_b[zi])
+        n = merged["count"][:, None]
+        data = values[:, zi]                  # (轮数, S, 3)
+        np.testing.assert_array_equal(merged["count"], [12, 12, 12])
+        np.testing.assert_allclose(merged["sum"] / n, data.mean(axis=0), atol=1e-4)
+        std = np.sqrt((merged["sumsq"] - merged["sum"] ** 2 / n) / (n - 1))
+        np.testing.assert_allclose(std, data.std(axis=0, ddof=1), rtol=1e-3)
+        np.testing.assert_array_equal(merged["min"], data.min(axis=0))
+        np.testing.assert_array_equal(merged["max"], data.max(axis=0))
+
+
+def test_flush_without_readings_is_empty():
+    agg = WindowAggregator([[1]], WINDOW)
+    assert agg.flush() == []
+
+
+@pytest.mark.parametrize("ts", [T0, T0 + 299.9])
+def test_window_aligned_to_multiple_of_length(ts):
+    agg = WindowAggregator([[1]], WINDOW)
+    agg.add([[[20.0, 50.0, 400.0]]], [[False]], ts)
+    assert agg.window_start == T0
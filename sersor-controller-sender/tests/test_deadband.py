@@ -0,0 +1,70 @@
+import numpy as np
+
+from deadband import DeadbandFilter
+
+DEADBAND = (0.5, 2.0, 15.0)
+HEARTBEAT = 60.0
+
+
+def series(n, seed=0):
+    """一个传感器每 5 秒一条读数：缓慢漂移 + 小噪声 + 偶尔的阶跃"""
+    rng = np.random.default_rng(seed)
+    drift = np.cumsum(rng.normal(0, [0.05, 0.2, 1.5], size=(n, 3)), axis=0)
+    steps = np.zeros((n, 3))
+    steps[n // 2:] += [3.0, 10.0, 80.0]
+    return np.array([22.0, 55.0, 420.0]) + drift + steps
+
+
+def locf(times, published):
+    """接收端阶梯保持：每个时刻取该时刻及之前最近一条已发布的读数"""
+    out, last = [], None
+    pub = dict(published)
+    for t in times:
+        last = pub.get(t, last)
+        out.append(last)
+    return out
+
+
+def test_locf_reconstruction_within_deadband():
+    n = 400
+    values = series(n)
+    times = [i * 5.0 for i in range(n)]
+    flt = DeadbandFilter(DEADBAND, heartbeat_sec=HEARTBEAT)
+    published = []
+    for t, v in zip(times, values):
+        if flt.select([7], [v], [False], now=t)[0]:
+            published.append((t, v))
+
+    assert published[0][0] == 0.0              # 首条必发
+    assert len(published) < n / 2              # 稳定期大部分读数被抑制
+    gaps = np.diff([t for t, _ in published])
+    assert gaps.max() <= HEARTBEAT             # 心跳保证保持时间不超过心跳间隔
+
+    held = np.array(locf(times, published))
+    assert np.all(np.abs(held - values) <= np.asarray(DEADBAND))
+
+    stats = flt.stats()
+    assert stats["seen"] == n
+    assert stats["sent"] == len(published)
+    assert stats["sent"] + stats["suppressed"] == n
+    assert stats["new"] == 1
+
+
+def test_anomalies_always_published():
+    flt = DeadbandFilter(DEADBAND, heartbeat_sec=0)
+    v = [22.0, 55.0, 420.0]
+    assert flt.select([1], [v], [False], now=0.0).tolist() == [True]
+    assert flt.select([1], [v], [False], now=1.0).tolist() == [False]
+    assert flt.select([1], [v], [True], now=2.0).tolist() == [True]
+    assert flt.counters["anomalies"] == 1
+
+
+def test_filter_keeps_order_and_vectorises_sensors():
+    flt = DeadbandFilter(DEADBAND, heartbeat_sec=0)
+    batch = [{"sensor_id": sid, "temperature": 22.0, "humidity": 55.0, "soil_moisture": 420, "is_anomaly": False}
+             for sid in (3, 1, 2)]
+    assert flt.filter(batch, now=0.0) == batch
+    batch[1] = {**batch[1], "temperature": 23.0}
+    assert [r["sensor_id"] for r in flt.filter(batch, now=1.0)] == [1]
+    assert flt.stats()["sensors"] == 3
+    assert flt.filter([], now=2.0) == []